@@ -0,0 +1,265 @@
+"""
+Admission control for model- and TTS-bound routes.
+
+Two layers keep a burst of requests (a class logging in at once) from
+turning into a wall of upstream 429s:
+
+  - RateLimiter: token buckets per client per route and per route
+    overall. A request that finds its bucket empty is turned away
+    straight away with the time until the next token.
+  - UpstreamGate: caps in-flight upstream calls (one gate for OpenAI,
+    one for ElevenLabs). Callers beyond the cap wait in a bounded queue.
+    If the queue is full, or no slot frees up within the queue timeout,
+    the call is shed.
+
+Either way the caller gets Overloaded, which the app turns into a 429
+with a Retry-After header. Only requests that are about to call OpenAI
+or ElevenLabs are charged; cache hits and locally answered commands are
+free.
+
+Clients are keyed on the remote address. Login is by username alone, so
+a user id in a header or body is whatever the caller says it is; keying
+on it would let one caller mint a fresh bucket per request. Behind a
+reverse proxy, have the server resolve the real peer (uvicorn
+--proxy-headers --forwarded-allow-ips=<proxy>, or ProxyFix for
+app.py); X-Forwarded-For is not read here. A classroom behind one NAT
+shares a bucket, so size RATE_LIMIT_CLIENT for it.
+
+Limits are written "<requests>/<seconds>": the bucket holds up to
+<requests> tokens and refills at that rate. 0 disables a limit.
+
+Tuning (environment variables):
+  RATE_LIMIT_CLIENT=20/60          per client (remote address) per route
+  RATE_LIMIT_ROUTE=300/60          per route across all clients
+  RATE_LIMIT_CLIENT_<ROUTE>=...    override for one route, e.g. RATE_LIMIT_CLIENT_JARVIS_CHAT=40/60
+  RATE_LIMIT_ROUTE_<ROUTE>=...     override for one route, e.g. RATE_LIMIT_ROUTE_START_QUEST=120/60
+  RATE_LIMIT_MAX_CLIENTS=10000     client buckets kept (least recently used are dropped)
+  UPSTREAM_LLM_CONCURRENCY=16      in-flight OpenAI calls (0 = unbounded)
+  UPSTREAM_TTS_CONCURRENCY=8       in-flight ElevenLabs calls (0 = unbounded)
+  UPSTREAM_QUEUE=32                calls allowed to wait for a slot, per gate
+  UPSTREAM_QUEUE_TIMEOUT=5         seconds a call may wait for a slot
+"""
+
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+def parse_limit(value):
+    """Parse "20/60" into (burst, tokens per second); "0" or "" means unlimited (None)."""
+    value = (value or "").strip()
+    if not value or value == "0":
+        return None
+    count, _, seconds = value.partition("/")
+    count, seconds = float(count), float(seconds or 1)
+    if count <= 0 or seconds <= 0:
+        return None
+    return count, count / seconds
+
+
+CLIENT_LIMIT = os.environ.get("RATE_LIMIT_CLIENT", "20/60")
+ROUTE_LIMIT = os.environ.get("RATE_LIMIT_ROUTE", "300/60")
+MAX_CLIENTS = int(os.environ.get("RATE_LIMIT_MAX_CLIENTS", "10000"))
+LLM_CONCURRENCY = int(os.environ.get("UPSTREAM_LLM_CONCURRENCY", "16"))
+TTS_CONCURRENCY = int(os.environ.get("UPSTREAM_TTS_CONCURRENCY", "8"))
+QUEUE_SIZE = int(os.environ.get("UPSTREAM_QUEUE", "32"))
+QUEUE_TIMEOUT = float(os.environ.get("UPSTREAM_QUEUE_TIMEOUT", "5"))
+
+
+class Overloaded(Exception):
+    """A request or upstream call was shed; retry after `retry_after` seconds."""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class TokenBucket:
+    def __init__(self, burst, rate):
+        self.burst = burst
+        self.rate = rate
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def peek(self, now):
+        """Refill up to `now`; returns 0 if a token is available, else seconds until one is."""
+        # `now` is read before the limiter lock, so a later caller may have refilled already
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        """Spend one token; returns 0 on success, else seconds until a token is available."""
+        wait = self.peek(now)
+        if not wait:
+            self.tokens -= 1
+        return wait
+
+
+class RateLimiter:
+    def __init__(self, client_limit=CLIENT_LIMIT, route_limit=ROUTE_LIMIT, max_clients=MAX_CLIENTS):
+        self.client_limit = client_limit
+        self.route_limit = route_limit
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._limits = {}  # route -> (client limit, route limit)
+        self._clients = OrderedDict()  # (route, client) -> TokenBucket, least recently used first
+        self._routes = {}  # route -> TokenBucket
+        self._counts = {}  # route -> {"allowed", "limited_client", "limited_route"}
+
+    def _route_limits(self, route):
+        if route not in self._limits:
+            name = route.upper()
+            self._limits[route] = (
+                parse_limit(os.environ.get(f"RATE_LIMIT_CLIENT_{name}", self.client_limit)),
+                parse_limit(os.environ.get(f"RATE_LIMIT_ROUTE_{name}", self.route_limit)),
+            )
+        return self._limits[route]
+
+    def check(self, route, client):
+        """Admit one request for `client` on `route`, or raise Overloaded."""
+        now = time.monotonic()
+        with self._lock:
+            client_limit, route_limit = self._route_limits(route)
+            counts = self._counts.setdefault(route, {"allowed": 0, "limited_client": 0, "limited_route": 0})
+
+            client_bucket = route_bucket = None
+            if client_limit:
+                key = (route, client)
+                client_bucket = self._clients.get(key)
+                if client_bucket is None:
+                    client_bucket = self._clients[key] = TokenBucket(*client_limit)
+                    while len(self._clients) > self.max_clients:
+                        self._clients.popitem(last=False)
+                self._clients.move_to_end(key)
+            if route_limit:
+                route_bucket = self._routes.get(route)
+                if route_bucket is None:
+                    route_bucket = self._routes[route] = TokenBucket(*route_limit)
+
+            # Spend from neither bucket unless both admit, so a refused request costs nothing
+            wait = client_bucket.peek(now) if client_bucket else 0
+            if wait:
+                counts["limited_client"] += 1
+                raise Overloaded("Too many requests, please slow down", wait)
+            wait = route_bucket.peek(now) if route_bucket else 0
+            if wait:
+                counts["limited_route"] += 1
+                raise Overloaded("This feature is busy right now", wait)
+            for bucket in (client_bucket, route_bucket):
+                if bucket:
+                    bucket.take(now)
+
+            counts["allowed"] += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "clients_tracked": len(self._clients),
+                "routes": {route: dict(counts) for route, counts in self._counts.items()},
+            }
+
+
+class UpstreamGate:
+    def __init__(self, name, limit, queue_size=QUEUE_SIZE, queue_timeout=QUEUE_TIMEOUT):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._waiting = 0
+        self._max_waiting = 0
+        self._waited_ms = 0.0
+        self._max_wait_ms = 0.0
+        self._counts = {"admitted": 0, "queued": 0, "shed_queue_full": 0, "shed_timeout": 0}
+
+    def acquire(self):
+        """Take an in-flight slot, waiting up to queue_timeout; raises Overloaded when shed."""
+        started = time.monotonic()
+        deadline = started + self.queue_timeout
+        with self._cond:
+            if self.limit > 0 and self._in_flight >= self.limit:
+                if self._waiting >= self.queue_size:
+                    self._counts["shed_queue_full"] += 1
+                    raise Overloaded(f"Too many {self.name} requests in progress", self.queue_timeout)
+                self._counts["queued"] += 1
+                self._waiting += 1
+                self._max_waiting = max(self._max_waiting, self._waiting)
+                try:
+                    while self._in_flight >= self.limit:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._counts["shed_timeout"] += 1
+                            raise Overloaded(f"Too many {self.name} requests in progress", self.queue_timeout)
+                        self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+            self._in_flight += 1
+            self._counts["admitted"] += 1
+            waited_ms = (time.monotonic() - started) * 1000
+            self._waited_ms += waited_ms
+            self._max_wait_ms = max(self._max_wait_ms, waited_ms)
+
+    def release(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify()
+
+    @contextmanager
+    def slot(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def hold(self):
+        """Acquire a slot that outlives one block (e.g. a streamed response); release it via the handle."""
+        self.acquire()
+        return Slot(self)
+
+    def stats(self):
+        with self._cond:
+            admitted = self._counts["admitted"] or 1
+            return {
+                "limit": self.limit,
+                "in_flight": self._in_flight,
+                "waiting": self._waiting,
+                "max_waiting": self._max_waiting,
+                **self._counts,
+                "avg_wait_ms": round(self._waited_ms / admitted, 1),
+                "max_wait_ms": round(self._max_wait_ms, 1),
+            }
+
+
+class Slot:
+    """A held gate slot whose release() is safe to call more than once."""
+
+    def __init__(self, gate):
+        self._gate = gate
+        self._lock = threading.Lock()
+        self._held = True
+
+    def release(self):
+        with self._lock:
+            if not self._held:
+                return
+            self._held = False
+        self._gate.release()
+
+
+limiter = RateLimiter()
+llm_gate = UpstreamGate("AI", LLM_CONCURRENCY)
+tts_gate = UpstreamGate("voice", TTS_CONCURRENCY)
+
+
+def stats():
+    return {"rate_limits": limiter.stats(), "llm": llm_gate.stats(), "tts": tts_gate.stats()}
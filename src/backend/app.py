@@ -3,17 +3,23 @@ VoiceQuest Flask Backend
 ========================
 Run with: python app.py
 Requires: pip install -r requirements.txt
+Async mode: uvicorn asgi:app (see asgi.py)
 Set environment variables in backend/.env:
   OPENAI_API_KEY=your_openai_key
   ELEVENLABS_API_KEY=your_elevenlabs_key
+  OPENAI_BASE_URL=http://localhost:8080/v1   (optional, e.g. a local fake server)
+  ELEVENLABS_BASE_URL=http://localhost:8081   (optional, e.g. a local stub server)
 """
 
 import os
 import json
 import uuid
 import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
 from datetime import datetime, timedelta
-from flask import Flask, request, jsonify, Response
+import click
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 from openai import OpenAI
 import requests
@@ -22,6 +28,49 @@ from dotenv import load_dotenv
 # Load .env file from the backend directory
 load_dotenv(os.path.join(os.path.dirname(__file__), '.env'))
 
+# Local modules read their tuning from the environment at import time
+import http_client
+from db import PoolExhausted, get_db, get_pool, init_app as init_db_pool, release_db
+from streaming import TutorReplyStream, parse_tutor_reply, sse_event
+from tts_cache import TTSCache, cache_key as tts_cache_key, MAX_AGE as TTS_CACHE_MAX_AGE
+from transcripts import (
+    SCHEMA as TRANSCRIPT_SCHEMA, append_messages,
+    PAGE_SIZE as TRANSCRIPT_PAGE_SIZE, load_page as load_transcript_page
+)
+from conversation_store import SCHEMA as CONVERSATION_SCHEMA, create_store as create_conversation_store
+from levels import DEFAULT_CURVE as level_curve
+from user_stats import (
+    SCHEMA as USER_STATS_SCHEMA, quest_xp, read_stats, rebuild as rebuild_user_stats,
+    record_achievements, record_quest_added, record_quest_completion
+)
+from xp_ledger import (
+    SCHEMA as XP_LEDGER_SCHEMA, BUCKETS as XP_BUCKETS,
+    history as xp_history, parse_range as parse_xp_range, record_xp
+)
+from intent_bench import (
+    CORPUS as INTENT_CORPUS, QUESTS as BENCH_QUESTS, local_classifier as local_intent_classifier, run as run_intent_bench
+)
+from load_bench import run as run_load_bench
+from jarvis_prompt import PromptStats, build_messages as build_jarvis_messages
+from intents import IntentCache, JARVIS_INTENTS, engine as intent_engine
+from session_context import ContextStats, build_history as build_quest_history
+from speech_pipeline import PipelineStats, SentenceSpeaker, TurnTimer
+from openers import OpenerPool, PREWARM as OPENER_PREWARM, SYNTHESIZE as OPENER_TTS
+from migrations import check_query_plans, is_empty as is_empty_db, migrate, schema_version
+import llm_json
+import admission
+from queries import (
+    AWARD_ACHIEVEMENTS_SQL, CANVAS_SESSION_SQL, LOAD_SESSION_SQL, QUEST_PROGRESS_SQL, QUESTS_FOR_USER_SQL,
+    QUESTS_SQL, USER_ACHIEVEMENTS_SQL
+)
+from admission import Overloaded, llm_gate, tts_gate
+from llm_json import RESPONSE_FORMAT, Schema, number, one_of, scalar, text
+from canvas import (
+    CanvasFetchError, cache as canvas_cache, due_date_order, fetch_assignments_for_courses, format_assignment,
+    format_courses,
+    iter_course_assignments, iter_items as iter_canvas_items, COURSES_TTL as CANVAS_COURSES_TTL
+)
+
 app = Flask(__name__)
 CORS(app)
 
@@ -29,15 +78,57 @@ CORS(app)
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", "")
 ELEVENLABS_API_KEY = os.environ.get("ELEVENLABS_API_KEY", "")
 ELEVENLABS_VOICE_ID = os.environ.get("ELEVENLABS_VOICE_ID", "iP95p4xoKVk53GoZ742B")
+OPENAI_BASE_URL = os.environ.get("OPENAI_BASE_URL") or None  # Point at a local fake server for testing
+ELEVENLABS_BASE_URL = os.environ.get("ELEVENLABS_BASE_URL", "https://api.elevenlabs.io").rstrip("/")
+TTS_STREAM_CHUNK_SIZE = int(os.environ.get("TTS_STREAM_CHUNK_SIZE", "4096"))
+LLM_WORKERS = int(os.environ.get("LLM_WORKERS", "8"))
+CUSTOM_QUEST_DEADLINE = float(os.environ.get("CUSTOM_QUEST_DEADLINE", "30"))
 DATABASE = "voicequest.db"
 
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
+openai_client = OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL)
+# Fan-out model calls for custom quest generation (opener refills have their own, see openers.py)
+llm_executor = ThreadPoolExecutor(max_workers=LLM_WORKERS, thread_name_prefix="llm")
 
 # --- Database Setup ---
-def get_db():
-    db = sqlite3.connect(DATABASE)
-    db.row_factory = sqlite3.Row
-    return db
+# Connections come from a WAL-mode pool (see db.py); get_db() is request-scoped
+init_db_pool(app, DATABASE)
+
+
+@app.errorhandler(PoolExhausted)
+def handle_pool_exhausted(error):
+    response = jsonify({"message": "The server is busy, please try again shortly.", "retry_after": error.retry_after})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(error.retry_after)
+    return response
+
+
+# --- Admission Control ---
+# Token buckets per client and route, plus caps on in-flight upstream calls (see admission.py)
+def shed_payload(error):
+    return {"message": f"{error.reason}. Please try again in {error.retry_after}s.", "retry_after": error.retry_after}
+
+
+def shed_response(error):
+    response = jsonify(shed_payload(error))
+    response.status_code = 429
+    response.headers["Retry-After"] = str(error.retry_after)
+    return response
+
+
+@app.errorhandler(Overloaded)
+def handle_overloaded(error):
+    return shed_response(error)
+
+
+def rate_limit_client():
+    """Who a request is charged to: the remote address (see admission for why not the user id)."""
+    return f"ip:{request.remote_addr}"
+
+
+def charge_rate_limit(route):
+    """Charge a request that is about to call OpenAI or ElevenLabs; raises Overloaded when over the limit."""
+    admission.limiter.check(route, rate_limit_client())
+
 
 def init_db():
     db = get_db()
@@ -126,14 +217,23 @@ def init_db():
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             FOREIGN KEY (user_id) REFERENCES users(id)
         );
-    """)
+    """ + TRANSCRIPT_SCHEMA + CONVERSATION_SCHEMA + USER_STATS_SCHEMA + XP_LEDGER_SCHEMA)
     db.commit()
 
-    # Seed quests if empty
+    # Seed quests if empty; under the write lock so concurrent workers seed once
+    db.execute("BEGIN IMMEDIATE")
     cursor = db.execute("SELECT COUNT(*) as count FROM quests")
     if cursor.fetchone()["count"] == 0:
         seed_quests(db)
         seed_achievements(db)
+    db.commit()
+
+    # Everything after the baseline schema is a numbered migration
+    for version, description in migrate(db):
+        print(f"Applied migration {version}: {description}")
+
+    if OPENER_PREWARM and OPENAI_API_KEY:
+        opener_pool.warm(db)
 
     db.close()
 
@@ -280,7 +380,6 @@ def seed_quests(db):
             (q["title"], q["description"], q["topic"], q["difficulty"],
              q["xp_reward"], q["estimated_minutes"], q["icon"], q["system_prompt"], q["num_questions"])
         )
-    db.commit()
 
 def seed_achievements(db):
     achievements = [
@@ -307,72 +406,35 @@ def seed_achievements(db):
                VALUES (?, ?, ?, ?, ?, ?)""",
             (name, desc, icon, category, req_type, req_value)
         )
-    db.commit()
 
 
 # --- Helper Functions ---
 def calculate_level(xp):
     """Level up every 100 XP, with increasing requirements."""
-    level = 1
-    xp_needed = 100
-    remaining = xp
-    while remaining >= xp_needed:
-        remaining -= xp_needed
-        level += 1
-        xp_needed = int(xp_needed * 1.2)
-    return level
+    return level_curve.level(xp)
 
 def xp_for_next_level(xp):
     """Calculate XP needed for next level."""
-    level = 1
-    xp_needed = 100
-    remaining = xp
-    while remaining >= xp_needed:
-        remaining -= xp_needed
-        level += 1
-        xp_needed = int(xp_needed * 1.2)
-    return xp_needed - remaining
+    return level_curve.xp_to_next(xp)
 
 def check_and_award_achievements(db, user_id):
-    """Check if user has earned any new achievements."""
-    user = db.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
-    if not user:
+    """Check if user has earned any new achievements.
+
+    All rules are evaluated and awarded in one set-based statement against
+    the user row, so the cost does not grow with the number of achievement
+    definitions, and a concurrent award is counted only once.
+    """
+    awarded = [row["achievement_id"] for row in db.execute(AWARD_ACHIEVEMENTS_SQL, (user_id,)).fetchall()]
+    if not awarded:
         return []
 
-    achievements = db.execute("SELECT * FROM achievements").fetchall()
-    newly_unlocked = []
-
-    for ach in achievements:
-        # Check if already unlocked
-        existing = db.execute(
-            "SELECT id FROM user_achievements WHERE user_id = ? AND achievement_id = ?",
-            (user_id, ach["id"])
-        ).fetchone()
-        if existing:
-            continue
-
-        # Check requirement
-        met = False
-        if ach["requirement_type"] == "quests_completed":
-            met = user["quests_completed"] >= ach["requirement_value"]
-        elif ach["requirement_type"] == "xp":
-            met = user["xp"] >= ach["requirement_value"]
-        elif ach["requirement_type"] == "streak":
-            met = user["streak"] >= ach["requirement_value"]
-        elif ach["requirement_type"] == "level":
-            met = user["level"] >= ach["requirement_value"]
-
-        if met:
-            db.execute(
-                "INSERT INTO user_achievements (user_id, achievement_id) VALUES (?, ?)",
-                (user_id, ach["id"])
-            )
-            newly_unlocked.append({"name": ach["name"], "icon": ach["icon"]})
-
-    if newly_unlocked:
-        db.commit()
+    record_achievements(db, user_id, len(awarded))
+    db.commit()
 
-    return newly_unlocked
+    placeholders = ", ".join("?" * len(awarded))
+    rows = db.execute(f"SELECT id, name, icon FROM achievements WHERE id IN ({placeholders})", awarded).fetchall()
+    details = {row["id"]: row for row in rows}
+    return [{"name": details[ach_id]["name"], "icon": details[ach_id]["icon"]} for ach_id in awarded]
 
 def update_streak(db, user_id):
     """Update user's daily streak."""
@@ -399,6 +461,86 @@ def update_streak(db, user_id):
     db.commit()
 
 
+@app.cli.command("backfill-levels")
+def backfill_levels():
+    """Recompute every user's level from their XP with the current curve."""
+    db = get_db()
+    users = db.execute("SELECT id, xp FROM users").fetchall()
+    infos = level_curve.levels_for([u["xp"] for u in users])
+    db.executemany(
+        "UPDATE users SET level = ? WHERE id = ?",
+        [(info[0], u["id"]) for u, info in zip(users, infos)]
+    )
+    db.commit()
+    db.close()
+    print(f"Recomputed levels for {len(users)} users")
+
+
+@app.cli.command("rebuild-stats")
+def rebuild_stats():
+    """Recompute the materialized user stats from quest and session history."""
+    db = get_db()
+    rebuild_user_stats(db)
+    db.commit()
+    db.close()
+    print("Rebuilt user stats")
+
+
+@app.cli.command("bench-intents")
+@click.option("--rounds", default=200, help="Passes over the corpus for the local engine.")
+@click.option("--llm", is_flag=True, help="Also run the corpus through the Jarvis model path.")
+def bench_intents(rounds, llm):
+    """Measure local intent accuracy and latency against the benchmark corpus."""
+    results = {"local": run_intent_bench(local_intent_classifier(), rounds=rounds)}
+    if llm:
+        # Open-ended cases have no single right answer from the model
+        context = {"current_page": "/quests", "user_logged_in": False, "available_quests": BENCH_QUESTS}
+        results["llm"] = run_intent_bench(
+            lambda t: jarvis_llm_reply(f"bench-{uuid.uuid4()}", t, context),
+            corpus=[case for case in INTENT_CORPUS if case[1]]
+        )
+    for path, result in results.items():
+        print(f"{path}: {result['cases']} cases, accuracy {result['accuracy']:.1%}, "
+              f"p50 {result['p50_ms']} ms, p99 {result['p99_ms']} ms")
+        for transcript, expected, got in result["misses"]:
+            print(f"  {transcript!r}: expected {expected}, got {got}")
+
+
+@app.cli.command("bench-load")
+@click.option("--url", default="http://localhost:5000/api/health", help="Endpoint to load.")
+@click.option("--method", default="GET", help="HTTP method.")
+@click.option("--body", default=None, help="JSON request body.")
+@click.option("--requests", "total", default=200, help="Requests to send.")
+@click.option("--concurrency", default=20, help="Requests in flight at once.")
+def bench_load(url, method, body, total, concurrency):
+    """Load a running server (Flask or asgi.py) and report latency and throughput."""
+    result = run_load_bench(url, method.upper(), json.loads(body) if body else None, total, concurrency)
+    print(f"{result['requests']} requests, {result['concurrency']} concurrent: "
+          f"{result['throughput_rps']} req/s, p50 {result['p50_ms']} ms, p90 {result['p90_ms']} ms, "
+          f"p99 {result['p99_ms']} ms, max {result['max_ms']} ms")
+    for status, count in sorted(result["statuses"].items(), key=str):
+        print(f"  {status}: {count}")
+
+
+@app.cli.command("check-query-plans")
+def check_query_plans_command():
+    """Fail if a hot query plans a full table scan or a temporary sort."""
+    db = get_db()
+    version = schema_version(db)
+    problems = check_query_plans(db)
+    empty = not problems and is_empty_db(db)
+    db.close()
+    print(f"Schema version {version}")
+    if empty:
+        print("Warning: the database has no users or sessions; plans may differ on real data")
+    for name, details in problems.items():
+        for detail in details:
+            print(f"  {name}: {detail}")
+    if problems:
+        raise SystemExit(1)
+    print("All hot queries use an index")
+
+
 # --- Auth Routes ---
 @app.route("/api/auth/register", methods=["POST"])
 def register():
@@ -453,50 +595,13 @@ def get_profile(user_id):
 @app.route("/api/user/<int:user_id>/stats", methods=["GET"])
 def get_stats(user_id):
     db = get_db()
-    user = db.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
+    snapshot = read_stats(db, user_id)
+    db.close()
 
-    if not user:
-        db.close()
+    if not snapshot:
         return jsonify({"message": "User not found"}), 404
 
-    total_quests = db.execute("SELECT COUNT(*) as count FROM quests").fetchone()["count"]
-    total_achievements = db.execute("SELECT COUNT(*) as count FROM achievements").fetchone()["count"]
-    unlocked_achievements = db.execute(
-        "SELECT COUNT(*) as count FROM user_achievements WHERE user_id = ?", (user_id,)
-    ).fetchone()["count"]
-
-    # Topic progress
-    topics = db.execute("""
-        SELECT q.topic,
-               COUNT(CASE WHEN uqp.completed = 1 THEN 1 END) as completed,
-               COUNT(*) as total,
-               COALESCE(AVG(CASE WHEN uqp.best_score > 0 THEN uqp.best_score END), 0) as avg_score
-        FROM quests q
-        LEFT JOIN user_quest_progress uqp ON q.id = uqp.quest_id AND uqp.user_id = ?
-        GROUP BY q.topic
-    """, (user_id,)).fetchall()
-
-    # Weekly XP (last 7 days) - simplified
-    weekly_xp = [0] * 7
-    sessions = db.execute("""
-        SELECT qs.score, qs.completed_at
-        FROM quest_sessions qs
-        WHERE qs.user_id = ? AND qs.status = 'completed'
-        AND qs.completed_at >= date('now', '-7 days')
-        ORDER BY qs.completed_at
-    """, (user_id,)).fetchall()
-
-    for session in sessions:
-        if session["completed_at"]:
-            try:
-                completed = datetime.fromisoformat(session["completed_at"])
-                days_ago = (datetime.now() - completed).days
-                if 0 <= days_ago < 7:
-                    weekly_xp[6 - days_ago] += session["score"]
-            except (ValueError, TypeError):
-                pass
-
-    db.close()
+    user, topics, weekly_xp = snapshot
 
     stats = {
         "xp": user["xp"],
@@ -505,9 +610,9 @@ def get_stats(user_id):
         "streak": user["streak"],
         "longest_streak": user["longest_streak"],
         "quests_completed": user["quests_completed"],
-        "total_quests": total_quests,
-        "achievements_unlocked": unlocked_achievements,
-        "total_achievements": total_achievements,
+        "total_quests": user["total_quests"],
+        "achievements_unlocked": user["achievements_unlocked"],
+        "total_achievements": user["total_achievements"],
         "weekly_xp": weekly_xp,
         "topics_progress": [
             {
@@ -522,15 +627,32 @@ def get_stats(user_id):
 
     return jsonify({"stats": stats})
 
+@app.route("/api/user/<int:user_id>/xp_history", methods=["GET"])
+def get_xp_history(user_id):
+    """XP earned per day/week/month, e.g. ?range=90d&bucket=week (weeks are labelled by their Monday)."""
+    days = parse_xp_range(request.args.get("range", "30d"))
+    bucket = request.args.get("bucket", "day")
+
+    if days is None:
+        return jsonify({"message": "range must look like 7d, 12w, 6m or 1y"}), 400
+    if bucket not in XP_BUCKETS:
+        return jsonify({"message": f"bucket must be one of: {', '.join(XP_BUCKETS)}"}), 400
+
+    db = get_db()
+    user = db.execute("SELECT id FROM users WHERE id = ?", (user_id,)).fetchone()
+    if not user:
+        db.close()
+        return jsonify({"message": "User not found"}), 404
+
+    result = xp_history(db, user_id, days, bucket)
+    db.close()
+
+    return jsonify({"xp_history": result})
+
 @app.route("/api/user/<int:user_id>/achievements", methods=["GET"])
 def get_achievements(user_id):
     db = get_db()
-    achievements = db.execute("""
-        SELECT a.*, ua.unlocked_at
-        FROM achievements a
-        LEFT JOIN user_achievements ua ON a.id = ua.achievement_id AND ua.user_id = ?
-        ORDER BY a.category, a.requirement_value
-    """, (user_id,)).fetchall()
+    achievements = db.execute(USER_ACHIEVEMENTS_SQL, (user_id,)).fetchall()
     db.close()
 
     result = []
@@ -555,14 +677,9 @@ def get_quests():
     db = get_db()
 
     if user_id:
-        quests = db.execute("""
-            SELECT q.*, uqp.completed as is_completed, uqp.best_score
-            FROM quests q
-            LEFT JOIN user_quest_progress uqp ON q.id = uqp.quest_id AND uqp.user_id = ?
-            ORDER BY q.difficulty, q.topic
-        """, (user_id,)).fetchall()
+        quests = db.execute(QUESTS_FOR_USER_SQL, (user_id,)).fetchall()
     else:
-        quests = db.execute("SELECT * FROM quests ORDER BY difficulty, topic").fetchall()
+        quests = db.execute(QUESTS_SQL).fetchall()
 
     db.close()
 
@@ -584,40 +701,65 @@ def start_quest(quest_id):
         return jsonify({"message": "user_id is required"}), 400
 
     db = get_db()
-    quest = db.execute("SELECT * FROM quests WHERE id = ?", (quest_id,)).fetchone()
+    quest, opener, error = begin_quest(db, quest_id, user_id)
+    if error:
+        db.close()
+        payload, status = error
+        return jsonify(payload), status
+
+    if opener:
+        tutor_message = opener["content"]
+    else:
+        # Generate first question using OpenAI, without holding a pooled connection
+        charge_rate_limit("start_quest")
+        release_db()
+        try:
+            tutor_message = generate_catalog_opener(quest)
+        except Overloaded as e:
+            return shed_response(e)
+        except Exception as e:
+            return jsonify({"message": f"OpenAI API error: {str(e)}"}), 500
+        db = get_db()
+
+    session = save_quest_start(db, quest, user_id, tutor_message)
+    db.close()
+
+    if not quest["is_custom"]:
+        opener_pool.refill_async(quest_id)
 
+    return jsonify({"session": session, "opener_audio_cached": bool(opener and opener["tts_key"])})
+
+
+def begin_quest(db, quest_id, user_id):
+    """Look up a quest, update the streak and take a ready-made opener if one is pooled.
+
+    Commits before returning. Returns (quest, opener or None, None) or
+    (None, None, (error payload, status)).
+    """
+    quest = db.execute("SELECT * FROM quests WHERE id = ?", (quest_id,)).fetchone()
     if not quest:
-        db.close()
-        return jsonify({"message": "Quest not found"}), 404
+        return None, None, ({"message": "Quest not found"}, 404)
 
-    # Update streak
     update_streak(db, user_id)
 
-    session_id = str(uuid.uuid4())
+    # Catalog quests usually have a pre-generated opener ready
+    opener = opener_pool.take(db, quest_id) if not quest["is_custom"] else None
+    db.commit()
+    return quest, opener, None
 
-    # Generate first question using OpenAI
-    try:
-        response = openai_client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": quest["system_prompt"] + f"\n\nThis is a voice-based learning session with {quest['num_questions']} questions. Start by warmly greeting the student and asking the FIRST question. Keep your response concise (2-3 sentences max) since it will be read aloud."},
-                {"role": "user", "content": "Start the quest!"}
-            ],
-            max_tokens=200,
-            temperature=0.7
-        )
-        tutor_message = response.choices[0].message.content
-    except Exception as e:
-        db.close()
-        return jsonify({"message": f"OpenAI API error: {str(e)}"}), 500
 
+def save_quest_start(db, quest, user_id, tutor_message):
+    """Create the session for a started quest and count the attempt; returns the session payload."""
+    quest_id = quest["id"]
+    session_id = str(uuid.uuid4())
     messages = [{"role": "tutor", "content": tutor_message, "timestamp": datetime.now().isoformat()}]
 
     db.execute(
-        """INSERT INTO quest_sessions (session_id, user_id, quest_id, messages, total_questions, status)
-           VALUES (?, ?, ?, ?, ?, 'active')""",
-        (session_id, user_id, quest_id, json.dumps(messages), quest["num_questions"])
+        """INSERT INTO quest_sessions (session_id, user_id, quest_id, total_questions, status)
+           VALUES (?, ?, ?, ?, 'active')""",
+        (session_id, user_id, quest_id, quest["num_questions"])
     )
+    append_messages(db, session_id, messages)
 
     # Update or create progress record
     existing = db.execute(
@@ -637,51 +779,76 @@ def start_quest(quest_id):
         )
 
     db.commit()
-    db.close()
 
-    return jsonify({
-        "session": {
-            "session_id": session_id,
-            "quest_id": quest_id,
-            "messages": messages,
-            "current_question": 1,
-            "total_questions": quest["num_questions"],
-            "score": 0,
-            "status": "active"
-        }
-    })
+    return {
+        "session_id": session_id,
+        "quest_id": quest_id,
+        "messages": messages,
+        "current_question": 1,
+        "total_questions": quest["num_questions"],
+        "score": 0,
+        "status": "active"
+    }
 
-@app.route("/api/quests/session/<session_id>/respond", methods=["POST"])
-def respond_to_quest(session_id):
-    data = request.json
-    user_message = data.get("message", "")
 
-    if not user_message:
-        return jsonify({"message": "Message is required"}), 400
+def catalog_opener_args(quest, temperature=0.7):
+    """Completion arguments for a catalog quest's greeting and first question."""
+    return {
+        "model": "gpt-4o-mini",
+        "messages": [
+            {"role": "system", "content": quest["system_prompt"] + f"\n\nThis is a voice-based learning session with {quest['num_questions']} questions. Start by warmly greeting the student and asking the FIRST question. Keep your response concise (2-3 sentences max) since it will be read aloud."},
+            {"role": "user", "content": "Start the quest!"}
+        ],
+        "max_tokens": 200,
+        "temperature": temperature,
+    }
+
+
+def generate_catalog_opener(quest, temperature=0.7):
+    """Greeting and first question for a quest, straight from the model."""
+    with llm_gate.slot():
+        response = openai_client.chat.completions.create(**catalog_opener_args(quest, temperature))
+    return response.choices[0].message.content
 
-    db = get_db()
-    session = db.execute("SELECT * FROM quest_sessions WHERE session_id = ?", (session_id,)).fetchone()
+
+# Ready-made openers for catalog quests, refilled in the background
+opener_pool = OpenerPool(
+    generate_catalog_opener,
+    synthesize=(lambda text: synthesize_to_cache(text)) if OPENER_TTS else None
+)
+
+
+quest_context_stats = ContextStats()
+QUEST_TURN_ARGS = {"model": "gpt-4o-mini", "max_tokens": 300, "temperature": 0.7}
+
+
+def load_quest_turn(db, session_id, user_message):
+    """Load a session and build the OpenAI prompt for the next turn.
+
+    Returns (turn, None) on success or (None, (error payload, status)).
+    """
+    session = db.execute(LOAD_SESSION_SQL, (session_id,)).fetchone()
 
     if not session:
-        db.close()
-        return jsonify({"message": "Session not found"}), 404
+        return None, ({"message": "Session not found"}, 404)
 
     if session["status"] != "active":
-        db.close()
-        return jsonify({"message": "Session already completed"}), 400
+        return None, ({"message": "Session already completed"}, 400)
 
     quest = db.execute("SELECT * FROM quests WHERE id = ?", (session["quest_id"],)).fetchone()
-    messages = json.loads(session["messages"])
     current_q = session["current_question"] + 1
     total_q = session["total_questions"]
-    is_last = current_q >= total_q
 
     # Add user message
-    messages.append({
+    user_entry = {
         "role": "user",
         "content": user_message,
         "timestamp": datetime.now().isoformat()
-    })
+    }
+
+    # Recent turns verbatim, older ones as a rolling summary stored on the session
+    history, summary, summarized_seq, accounting = build_quest_history(db, session, user_entry)
+    quest_context_stats.record(accounting)
 
     # Build conversation for OpenAI
     openai_messages = [
@@ -698,62 +865,47 @@ IMPORTANT INSTRUCTIONS:
 6. Keep responses concise since they'll be read aloud."""}
     ]
 
-    for msg in messages:
-        role = "assistant" if msg["role"] == "tutor" else "user"
-        openai_messages.append({"role": role, "content": msg["content"]})
-
-    try:
-        response = openai_client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=openai_messages,
-            max_tokens=300,
-            temperature=0.7
-        )
-        raw_response = response.choices[0].message.content
-    except Exception as e:
-        db.close()
-        return jsonify({"message": f"OpenAI API error: {str(e)}"}), 500
-
-    # Parse response
-    is_correct = False
-    score_delta = 0
-    tutor_message = raw_response
-
-    try:
-        # Try to extract JSON from response
-        if "{" in raw_response and "}" in raw_response:
-            json_start = raw_response.index("{")
-            json_end = raw_response.index("}") + 1
-            json_str = raw_response[json_start:json_end]
-            parsed = json.loads(json_str)
-            is_correct = parsed.get("is_correct", False)
-            score_delta = min(parsed.get("score_delta", 0), 20)
-            tutor_message = raw_response[json_end:].strip()
-            if not tutor_message:
-                tutor_message = "Great effort! Let's continue."
-    except (json.JSONDecodeError, ValueError):
-        score_delta = 10  # Default partial credit
+    openai_messages.extend(history)
+
+    return {
+        "session_id": session_id,
+        "session": session,
+        "quest": quest,
+        "context_summary": json.dumps(summary),
+        "summarized_seq": summarized_seq,
+        "user_entry": user_entry,
+        "current_q": current_q,
+        "total_q": total_q,
+        "is_last": current_q >= total_q,
+        "openai_messages": openai_messages,
+    }, None
+
+
+def finish_quest_turn(db, turn, is_correct, score_delta, tutor_message):
+    """Persist the tutor reply, award XP on completion and build the response payload."""
+    session = turn["session"]
+    quest = turn["quest"]
+    current_q = turn["current_q"]
+    total_q = turn["total_q"]
 
     new_score = session["score"] + score_delta
 
-    # Add tutor response to messages
-    messages.append({
+    # Append only this turn's two messages to the transcript
+    append_messages(db, turn["session_id"], [turn["user_entry"], {
         "role": "tutor",
         "content": tutor_message,
         "timestamp": datetime.now().isoformat(),
         "is_correct": is_correct,
         "feedback": tutor_message
-    })
+    }])
 
-    quest_complete = is_last
+    quest_complete = turn["is_last"]
     xp_earned = 0
 
     if quest_complete:
         status = "completed"
         # Calculate XP: base reward scaled by score
-        max_score = total_q * 20
-        score_ratio = new_score / max_score if max_score > 0 else 0
-        xp_earned = int(quest["xp_reward"] * max(0.3, score_ratio))  # Min 30% XP
+        xp_earned = quest_xp(quest["xp_reward"], new_score, total_q)
 
         # Update user
         user = db.execute("SELECT * FROM users WHERE id = ?", (session["user_id"],)).fetchone()
@@ -765,7 +917,10 @@ IMPORTANT INSTRUCTIONS:
             (new_xp, new_level, session["user_id"])
         )
 
-        # Update quest progress
+        # Update quest progress and the stats snapshot in the same transaction
+        progress = db.execute(QUEST_PROGRESS_SQL, (session["user_id"], session["quest_id"])).fetchone()
+        record_quest_completion(db, session["user_id"], quest["topic"], progress, new_score)
+        record_xp(db, session["user_id"], xp_earned, "quest_completed", turn["session_id"], session["quest_id"])
         db.execute("""
             UPDATE user_quest_progress
             SET completed = 1, best_score = MAX(best_score, ?)
@@ -781,16 +936,17 @@ IMPORTANT INSTRUCTIONS:
     # Update session
     db.execute("""
         UPDATE quest_sessions
-        SET messages = ?, current_question = ?, score = ?, status = ?,
-            completed_at = CASE WHEN ? = 'completed' THEN ? ELSE completed_at END
+        SET current_question = ?, score = ?, status = ?,
+            completed_at = CASE WHEN ? = 'completed' THEN ? ELSE completed_at END,
+            context_summary = ?, summarized_seq = ?
         WHERE session_id = ?
-    """, (json.dumps(messages), current_q, new_score, status,
-          status, datetime.now().isoformat() if quest_complete else None, session_id))
+    """, (current_q, new_score, status,
+          status, datetime.now().isoformat() if quest_complete else None,
+          turn["context_summary"], turn["summarized_seq"], turn["session_id"]))
 
     db.commit()
-    db.close()
 
-    return jsonify({
+    return {
         "tutor_message": tutor_message,
         "is_correct": is_correct,
         "feedback": tutor_message,
@@ -799,11 +955,230 @@ IMPORTANT INSTRUCTIONS:
         "total_questions": total_q,
         "quest_complete": quest_complete,
         "xp_earned": xp_earned if quest_complete else 0
-    })
+    }
+
+
+@app.route("/api/quests/session/<session_id>/respond", methods=["POST"])
+def respond_to_quest(session_id):
+    data = request.json
+    user_message = data.get("message", "")
+
+    if not user_message:
+        return jsonify({"message": "Message is required"}), 400
+
+    db = get_db()
+    turn, error = load_quest_turn(db, session_id, user_message)
+    if error:
+        db.close()
+        payload, status = error
+        return jsonify(payload), status
+    charge_rate_limit("respond_to_quest")
+    # The turn is loaded; don't hold a pooled connection across the model call
+    release_db()
+
+    try:
+        with llm_gate.slot():
+            response = openai_client.chat.completions.create(
+                messages=turn["openai_messages"],
+                **QUEST_TURN_ARGS
+            )
+        raw_response = response.choices[0].message.content
+    except Overloaded as e:
+        return shed_response(e)
+    except Exception as e:
+        return jsonify({"message": f"OpenAI API error: {str(e)}"}), 500
+
+    is_correct, score_delta, tutor_message = parse_tutor_reply(raw_response)
+    db = get_db()
+    result = finish_quest_turn(db, turn, is_correct, score_delta, tutor_message)
+    db.close()
+
+    return jsonify(result)
+
+
+@app.route("/api/quests/session/<session_id>/respond/stream", methods=["POST"])
+def respond_to_quest_stream(session_id):
+    """Streaming variant of respond_to_quest (Server-Sent Events).
+
+    Events: "evaluation" once the JSON header has streamed in, "token" for
+    every text delta, "sentence" for each complete sentence, then "done"
+    with the same payload as the non-streaming route (or "error").
+    """
+    data = request.json
+    user_message = data.get("message", "")
+
+    if not user_message:
+        return jsonify({"message": "Message is required"}), 400
+
+    db = get_db()
+    turn, error = load_quest_turn(db, session_id, user_message)
+    if error:
+        db.close()
+        payload, status = error
+        return jsonify(payload), status
+    charge_rate_limit("respond_to_quest_stream")
+
+    def generate():
+        reply = TutorReplyStream()
+        try:
+            stream = openai_client.chat.completions.create(
+                messages=turn["openai_messages"],
+                stream=True,
+                **QUEST_TURN_ARGS
+            )
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                for event, payload in reply.feed(chunk.choices[0].delta.content):
+                    yield sse_event(event, payload)
+        except Exception as e:
+            yield sse_event("error", {"message": f"OpenAI API error: {str(e)}"})
+            return
+        finally:
+            slot.release()
+
+        for event, payload in reply.finish():
+            yield sse_event(event, payload)
+
+        # Persist and award XP once, after the full reply has arrived
+        result = finish_quest_turn(get_db(), turn, reply.is_correct, reply.score_delta, reply.tutor_message)
+        yield sse_event("done", result)
+
+    # finish_quest_turn checks out a fresh connection once the reply is complete
+    release_db()
+    # Overloaded becomes a 429 before any event is sent. The slot is freed as soon
+    # as the model stream ends, or when the response closes if it never started.
+    slot = llm_gate.hold()
+    response = Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+    response.call_on_close(slot.release)
+    return response
+
+
+speak_pipeline_stats = PipelineStats()
+
+
+@app.route("/api/quests/session/<session_id>/respond/speak", methods=["POST"])
+def respond_and_speak(session_id):
+    """respond/stream plus audio: each sentence is synthesized while the rest is generated.
+
+    Emits the respond/stream events, plus "audio" (base64 MP3, in sentence
+    order) or "audio_error" per sentence, then "timing" with this turn's
+    stage timings and finally "done".
+    """
+    data = request.json
+    user_message = data.get("message", "")
+    voice_id = data.get("voice_id", ELEVENLABS_VOICE_ID)
+
+    if not user_message:
+        return jsonify({"message": "Message is required"}), 400
+
+    if not ELEVENLABS_API_KEY:
+        return jsonify({"message": "ElevenLabs API key not configured"}), 500
+
+    timer = TurnTimer()
+    db = get_db()
+    turn, error = load_quest_turn(db, session_id, user_message)
+    if error:
+        db.close()
+        payload, status = error
+        return jsonify(payload), status
+    charge_rate_limit("respond_and_speak")
+
+    def generate():
+        reply = TutorReplyStream()
+        speaker = SentenceSpeaker(lambda text: synthesize(text, voice_id))
+
+        def speak(event, payload):
+            if event == "sentence":
+                timer.mark("first_sentence_ms")
+                payload = {**payload, "index": speaker.submit(payload["text"])}
+            return sse_event(event, payload)
+
+        def audio(events):
+            for event, payload in events:
+                if event == "audio":
+                    timer.mark("tts_ttfb_ms", payload["tts_ttfb_ms"])
+                    timer.mark("first_audio_ms")
+                yield sse_event(event, payload)
+
+        try:
+            try:
+                stream = openai_client.chat.completions.create(
+                    messages=turn["openai_messages"],
+                    stream=True,
+                    **QUEST_TURN_ARGS
+                )
+                for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        timer.mark("llm_ttft_ms")
+                    for event, payload in reply.feed(delta):
+                        yield speak(event, payload)
+                    yield from audio(speaker.ready())
+            except Exception as e:
+                yield sse_event("error", {"message": f"OpenAI API error: {str(e)}"})
+                return
+            finally:
+                # Generation is over; the clips still draining only need TTS slots
+                slot.release()
+
+            for event, payload in reply.finish():
+                yield speak(event, payload)
+            timer.mark("llm_total_ms")
+
+            # Persist before waiting on the last clips so a dropped client still keeps the turn
+            result = finish_quest_turn(get_db(), turn, reply.is_correct, reply.score_delta, reply.tutor_message)
+
+            yield from audio(speaker.drain())
+            timer.mark("total_ms")
+            speak_pipeline_stats.record(timer.marks)
+            yield sse_event("timing", timer.marks)
+            yield sse_event("done", result)
+        finally:
+            # Also runs when the client disconnects mid-turn
+            speaker.cancel()
+
+    # finish_quest_turn checks out a fresh connection once the reply is complete
+    release_db()
+    # Overloaded becomes a 429 before any event is sent. The slot is freed as soon
+    # as the model stream ends, or when the response closes if it never started.
+    slot = llm_gate.hold()
+    response = Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+    response.call_on_close(slot.release)
+    return response
+
+
+@app.route("/api/quests/session/<session_id>/messages", methods=["GET"])
+def get_session_messages(session_id):
+    """Page backwards through a session transcript (newest page first)."""
+    before = request.args.get("before", type=int)
+    limit = request.args.get("limit", TRANSCRIPT_PAGE_SIZE, type=int)
+
+    db = get_db()
+    session = db.execute("SELECT session_id FROM quest_sessions WHERE session_id = ?", (session_id,)).fetchone()
+    if not session:
+        db.close()
+        return jsonify({"message": "Session not found"}), 404
+
+    messages, next_before = load_transcript_page(db, session_id, before, limit)
+    db.close()
+
+    return jsonify({"messages": messages, "next_before": next_before})
 
 
-# --- Jarvis Chat Sessions (in-memory) ---
-jarvis_sessions = {}
+# --- Jarvis Chat Sessions ---
+# Bounded, TTL-evicting history (in-memory by default; JARVIS_STORE=sqlite to persist)
+jarvis_store = create_conversation_store()
 
 JARVIS_SYSTEM_PROMPT = """You are Jarvis, a friendly and intelligent voice assistant for VoiceQuest — a voice-powered learning adventure app.
 
@@ -848,8 +1223,13 @@ Context awareness:
 - "Jarvis, start quest one" → start_quest with the quest at position 1
 - Be generous in interpretation. Natural speech should work.
 - The wake word "Jarvis" may or may not be present in the transcript — process the command regardless.
+
+The current context (page, login state, available quests and any Canvas LMS data) arrives in a separate message just before the user's latest message. Some lists may be trimmed to the items most relevant to the request.
+IMPORTANT: When Canvas courses or assignments are listed and the user asks about their assignments or wants to study for a class, use that Canvas data. Create quests based on their ACTUAL assignment topics, not generic ones.
 """
 
+jarvis_prompt_stats = PromptStats()
+
 
 @app.route("/api/jarvis/chat", methods=["POST"])
 def jarvis_chat():
@@ -862,101 +1242,94 @@ def jarvis_chat():
     if not message:
         return jsonify({"message": "Message is required"}), 400
 
+    # Deterministic commands are answered by the local grammar
+    local = jarvis_local_reply(session_id, message, context)
+    if local:
+        return jsonify(local)
+
     if not OPENAI_API_KEY:
         return jsonify({"message": "OpenAI API key not configured"}), 500
 
-    # Build context string
-    current_page = context.get("current_page", "/")
-    user_logged_in = context.get("user_logged_in", False)
-    user_name = context.get("user_name", "")
-    available_quests = context.get("available_quests", [])
-    canvas_data = context.get("canvas_data", {})
+    charge_rate_limit("jarvis_chat")
+    try:
+        parsed = jarvis_llm_reply(session_id, message, context)
+        return jsonify(parsed)
 
-    context_parts = [f"Current page: {current_page}"]
-    if user_logged_in:
-        context_parts.append(f"User is logged in as: {user_name}")
-    else:
-        context_parts.append("User is NOT logged in yet. If they tell you their name, use the 'login' intent.")
+    except Overloaded as e:
+        return shed_response(e)
+    except Exception as e:
+        return jsonify({"message": f"Jarvis error: {str(e)}"}), 500
 
-    if available_quests:
-        quest_list = "\n".join([
-            f"  #{i+1} — ID: {q['id']}, Title: \"{q['title']}\", Topic: {q['topic']}"
-            for i, q in enumerate(available_quests)
-        ])
-        context_parts.append(f"Available quests:\n{quest_list}")
-
-    # Add Canvas LMS context if available
-    if canvas_data:
-        canvas_courses = canvas_data.get("courses", [])
-        canvas_assignments = canvas_data.get("assignments", [])
-        if canvas_courses:
-            course_list = "\n".join([
-                f"  - {c.get('name', 'Unknown')} (ID: {c.get('id')})"
-                for c in canvas_courses
-            ])
-            context_parts.append(f"Canvas LMS courses (user's real school courses):\n{course_list}")
-        if canvas_assignments:
-            assignment_list = "\n".join([
-                f"  - \"{a.get('name', 'Untitled')}\" (Course: {a.get('course_name', 'Unknown')}, Due: {a.get('due_at', 'No due date')})"
-                for a in canvas_assignments[:15]  # Limit to 15 to avoid token overflow
-            ])
-            context_parts.append(f"Canvas LMS assignments (user's real school assignments):\n{assignment_list}")
-            context_parts.append("IMPORTANT: When the user asks about their assignments or wants to study for a class, use the Canvas data above. Create quests based on their ACTUAL assignment topics, not generic ones.")
-
-    context_message = "\n".join(context_parts)
-
-    # Get or create session
-    if session_id not in jarvis_sessions:
-        jarvis_sessions[session_id] = []
-
-    history = jarvis_sessions[session_id]
-
-    # Build messages for OpenAI
-    openai_messages = [
-        {"role": "system", "content": JARVIS_SYSTEM_PROMPT + f"\n\nCurrent context:\n{context_message}"}
-    ]
 
-    # Add conversation history (keep last 20 messages to avoid token limits)
-    for msg in history[-20:]:
-        openai_messages.append(msg)
+JARVIS_COMPLETION_ARGS = {"model": "gpt-4o-mini", "max_tokens": 200, "temperature": 0.3, **RESPONSE_FORMAT}
+JARVIS_REPLY = Schema(
+    {
+        "intent": one_of("login", "navigate", "start_quest", "create_quest", "filter", "help",
+                         "chat", "greeting", "logout"),
+        "target": scalar,
+        "message": text(),
+    },
+    required=("intent", "message"),
+    defaults={"target": ""},
+)
+JARVIS_FALLBACK_MESSAGE = "I didn't quite understand that. Try saying something like 'go to my profile' or 'start a quest'."
+
+
+def jarvis_local_reply(session_id, message, context):
+    """Answer from the local intent grammar (recording the turn), or None to ask the model."""
+    local = intent_engine.match(
+        "jarvis", message, context.get("available_quests", []), JARVIS_INTENTS,
+        logged_in=context.get("user_logged_in", False)
+    )
+    if local:
+        jarvis_store.append(
+            session_id,
+            {"role": "user", "content": message},
+            {"role": "assistant", "content": json.dumps(local)}
+        )
+    return local
 
-    # Add new user message
-    openai_messages.append({"role": "user", "content": message})
 
-    try:
-        response = openai_client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=openai_messages,
-            max_tokens=200,
-            temperature=0.3
-        )
-        raw = response.choices[0].message.content.strip()
+def jarvis_llm_reply(session_id, message, context):
+    """Ask the model for Jarvis's reply, record it in the session history and parse it."""
+    openai_messages, prompt = jarvis_request(session_id, message, context)
+    release_db()  # The SQLite history store may have checked one out
+    with llm_gate.slot():
+        response = openai_client.chat.completions.create(messages=openai_messages, **JARVIS_COMPLETION_ARGS)
+    return jarvis_finish_reply(session_id, message, response, prompt)
 
-        # Store in history
-        history.append({"role": "user", "content": message})
-        history.append({"role": "assistant", "content": raw})
-        jarvis_sessions[session_id] = history
 
-        # Parse JSON
-        try:
-            parsed = json.loads(raw)
-        except json.JSONDecodeError:
-            # Try to extract JSON
-            try:
-                json_start = raw.index("{")
-                json_end = raw.rindex("}") + 1
-                parsed = json.loads(raw[json_start:json_end])
-            except (ValueError, json.JSONDecodeError):
-                parsed = {
-                    "intent": "chat",
-                    "target": "",
-                    "message": raw if len(raw) < 200 else "I didn't quite understand that. Try saying something like 'go to my profile' or 'start a quest'."
-                }
+def jarvis_request(session_id, message, context):
+    """Return (OpenAI messages, prompt accounting) for one Jarvis turn."""
+    # Session history, already capped to the last JARVIS_HISTORY_MESSAGES messages
+    history = jarvis_store.get(session_id)
 
-        return jsonify(parsed)
+    # Static prompt and history first so the provider can cache the prefix
+    openai_messages, prompt_tokens, trimmed = build_jarvis_messages(JARVIS_SYSTEM_PROMPT, history, context, message)
+    return openai_messages, (prompt_tokens, trimmed)
 
-    except Exception as e:
-        return jsonify({"message": f"Jarvis error: {str(e)}"}), 500
+
+def jarvis_finish_reply(session_id, message, response, prompt):
+    """Record a completed Jarvis turn and parse the model's JSON reply."""
+    jarvis_prompt_stats.record(*prompt, getattr(response, "usage", None))
+    raw = response.choices[0].message.content.strip()
+
+    # Store in history
+    jarvis_store.append(
+        session_id,
+        {"role": "user", "content": message},
+        {"role": "assistant", "content": raw}
+    )
+
+    parsed = llm_json.parse("jarvis", raw, JARVIS_REPLY)
+    if parsed is None:
+        # Short plain-text replies are still worth speaking back
+        return {
+            "intent": "chat",
+            "target": "",
+            "message": raw if len(raw) < 200 and "{" not in raw else JARVIS_FALLBACK_MESSAGE
+        }
+    return parsed
 
 
 @app.route("/api/jarvis/reset", methods=["POST"])
@@ -964,12 +1337,25 @@ def jarvis_reset():
     """Reset a Jarvis chat session."""
     data = request.json
     session_id = data.get("session_id", "")
-    if session_id in jarvis_sessions:
-        del jarvis_sessions[session_id]
+    jarvis_store.reset(session_id)
     return jsonify({"status": "ok"})
 
 
 # --- Voice Command AI Route ---
+voice_intents = IntentCache()
+VOICE_COMPLETION_ARGS = {"model": "gpt-4o-mini", "max_tokens": 150, "temperature": 0.3, **RESPONSE_FORMAT}
+VOICE_REPLY = Schema(
+    {
+        "intent": one_of("navigate", "start_quest", "filter", "help", "unknown"),
+        "target": scalar,
+        "message": text(),
+        "confidence": number(0.0, 1.0),
+    },
+    required=("intent", "message"),
+    defaults={"target": "", "confidence": 0.0},
+)
+
+
 @app.route("/api/voice/command", methods=["POST"])
 def voice_command():
     """Use OpenAI to interpret a voice command and return a structured action."""
@@ -981,9 +1367,32 @@ def voice_command():
     if not transcript:
         return jsonify({"message": "Transcript is required"}), 400
 
+    # Repeated and simple commands are answered without a model call
+    cached, cache_key = voice_intents.resolve(transcript, current_page, available_quests)
+    if cached:
+        return jsonify(cached)
+
     if not OPENAI_API_KEY:
         return jsonify({"message": "OpenAI API key not configured"}), 500
 
+    charge_rate_limit("voice_command")
+    try:
+        with llm_gate.slot():
+            response = openai_client.chat.completions.create(
+                messages=voice_command_messages(transcript, current_page, available_quests),
+                **VOICE_COMPLETION_ARGS
+            )
+        raw = response.choices[0].message.content.strip()
+        return jsonify(parse_voice_reply(raw, cache_key))
+
+    except Overloaded as e:
+        return shed_response(e)
+    except Exception as e:
+        return jsonify({"message": f"AI command error: {str(e)}"}), 500
+
+
+def voice_command_messages(transcript, current_page, available_quests):
+    """System prompt plus transcript for the voice command model call."""
     # Build quest context for the AI
     quest_list = ""
     if available_quests:
@@ -1018,41 +1427,104 @@ Rules:
 - Be generous in interpretation. "I want to learn about space" → start the Solar System quest. "Take me home" → navigate to /dashboard.
 - Keep messages concise (will be read aloud via TTS)."""
 
-    try:
-        response = openai_client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": transcript}
-            ],
-            max_tokens=150,
-            temperature=0.3
-        )
-        raw = response.choices[0].message.content.strip()
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": transcript}
+    ]
 
-        # Parse JSON from response
-        parsed = json.loads(raw)
-        return jsonify(parsed)
 
-    except json.JSONDecodeError:
-        # Try to extract JSON if there's extra text
-        try:
-            json_start = raw.index("{")
-            json_end = raw.rindex("}") + 1
-            parsed = json.loads(raw[json_start:json_end])
-            return jsonify(parsed)
-        except (ValueError, json.JSONDecodeError):
-            return jsonify({
-                "intent": "unknown",
-                "target": "",
-                "message": "I didn't quite catch that. Try saying something like 'start a quest' or 'go to profile'.",
-                "confidence": 0
-            })
-    except Exception as e:
-        return jsonify({"message": f"AI command error: {str(e)}"}), 500
+def parse_voice_reply(raw, cache_key):
+    """Parse the model's JSON answer, caching it under `cache_key` when it is valid."""
+    parsed = llm_json.parse("voice", raw, VOICE_REPLY)
+    if parsed is None:
+        return {
+            "intent": "unknown",
+            "target": "",
+            "message": "I didn't quite catch that. Try saying something like 'start a quest' or 'go to profile'.",
+            "confidence": 0
+        }
+    voice_intents.put(cache_key, parsed)
+    return parsed
 
 
 # --- TTS Route ---
+TTS_MODEL_ID = "eleven_turbo_v2_5"
+TTS_VOICE_SETTINGS = {
+    "stability": 0.5,
+    "similarity_boost": 0.75
+}
+
+tts_cache = TTSCache()
+
+
+def synthesize(text, voice_id=ELEVENLABS_VOICE_ID):
+    """Synthesize `text` through the TTS cache; returns (audio, cache key, timing)."""
+    started = time.monotonic()
+    key = tts_cache_key(text, voice_id, TTS_MODEL_ID, TTS_VOICE_SETTINGS)
+    cached = tts_cache.get(key)
+    if cached is not None:
+        elapsed = round((time.monotonic() - started) * 1000, 1)
+        return cached, key, {"cached": True, "ttfb_ms": elapsed, "total_ms": elapsed}
+    if not ELEVENLABS_API_KEY:
+        raise RuntimeError("ElevenLabs API key not configured")
+
+    audio = bytearray()
+    ttfb_ms = None
+    with tts_gate.slot():
+        response = http_client.post(
+            f"{ELEVENLABS_BASE_URL}/v1/text-to-speech/{voice_id}/stream",
+            headers={
+                "Accept": "audio/mpeg",
+                "Content-Type": "application/json",
+                "xi-api-key": ELEVENLABS_API_KEY
+            },
+            json={
+                "text": text,
+                "model_id": TTS_MODEL_ID,
+                "voice_settings": TTS_VOICE_SETTINGS
+            },
+            stream=True
+        )
+        try:
+            if response.status_code != 200:
+                raise RuntimeError(f"ElevenLabs API error: Status {response.status_code}")
+            for chunk in response.iter_content(chunk_size=TTS_STREAM_CHUNK_SIZE):
+                if chunk:
+                    if ttfb_ms is None:
+                        ttfb_ms = round((time.monotonic() - started) * 1000, 1)
+                    audio += chunk
+        finally:
+            response.close()
+    if not audio:
+        raise RuntimeError("Empty audio response from ElevenLabs")
+
+    audio = bytes(audio)
+    tts_cache.put(key, audio)
+    return audio, key, {"cached": False, "ttfb_ms": ttfb_ms, "total_ms": round((time.monotonic() - started) * 1000, 1)}
+
+
+def synthesize_to_cache(text, voice_id=ELEVENLABS_VOICE_ID):
+    """Synthesize `text` into the TTS cache ahead of time; returns the cache key or None."""
+    try:
+        return synthesize(text, voice_id)[1]
+    except (RuntimeError, requests.exceptions.RequestException) as e:
+        app.logger.error(f"TTS prewarm failed: {str(e)}")
+        return None
+
+
+def tts_audio_response(audio, etag, cache_status):
+    return Response(
+        audio,
+        mimetype="audio/mpeg",
+        headers={
+            "Content-Type": "audio/mpeg",
+            "ETag": f'"{etag}"',
+            "Cache-Control": f"public, max-age={TTS_CACHE_MAX_AGE}",
+            "X-Cache": cache_status
+        }
+    )
+
+
 @app.route("/api/tts", methods=["POST"])
 def text_to_speech():
     data = request.json
@@ -1062,14 +1534,27 @@ def text_to_speech():
     if not text:
         return jsonify({"message": "Text is required"}), 400
 
+    # Same text + voice settings always yields interchangeable audio, so the key is the ETag
+    key = tts_cache_key(text, voice_id, TTS_MODEL_ID, TTS_VOICE_SETTINGS)
+    if f'"{key}"' in request.headers.get("If-None-Match", "") and key in tts_cache:
+        return Response(status=304, headers={"ETag": f'"{key}"', "Cache-Control": f"public, max-age={TTS_CACHE_MAX_AGE}"})
+
+    cached = tts_cache.get(key)
+    if cached is not None:
+        return tts_audio_response(cached, key, "HIT")
+
     if not ELEVENLABS_API_KEY:
         return jsonify({"message": "ElevenLabs API key not configured"}), 500
 
+    charge_rate_limit("text_to_speech")
+    # The upstream slot is held while the clip streams and freed once the response closes
+    tts_gate.acquire()  # Overloaded becomes a 429
+    relaying = False
     try:
         # ElevenLabs API requires the API key in the header as xi-api-key
         # No username or additional credentials needed - just the API key
-        response = requests.post(
-            f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}",
+        response = http_client.post(
+            f"{ELEVENLABS_BASE_URL}/v1/text-to-speech/{voice_id}/stream",
             headers={
                 "Accept": "audio/mpeg",
                 "Content-Type": "application/json",
@@ -1077,36 +1562,64 @@ def text_to_speech():
             },
             json={
                 "text": text,
-                "model_id": "eleven_turbo_v2_5",
-                "voice_settings": {
-                    "stability": 0.5,
-                    "similarity_boost": 0.75
-                }
+                "model_id": TTS_MODEL_ID,
+                "voice_settings": TTS_VOICE_SETTINGS
             },
-            timeout=15  # Add timeout to prevent hanging
+            stream=True  # Per-host timeout applies per chunk while streaming
         )
         
         # Log response for debugging
         if response.status_code != 200:
             error_msg = response.text[:200] if response.text else "Unknown error"
+            response.close()
             app.logger.error(f"ElevenLabs API error: Status {response.status_code}, Response: {error_msg}")
             return jsonify({"message": f"ElevenLabs API error: {error_msg}"}), 500
 
-
-        if not response.content:
+        chunks = response.iter_content(chunk_size=TTS_STREAM_CHUNK_SIZE)
+        first_chunk = next(chunks, b"")
+        if not first_chunk:
+            response.close()
             return jsonify({"message": "Empty audio response from ElevenLabs"}), 500
-
-        return Response(
-            response.content,
-            mimetype="audio/mpeg",
-            headers={"Content-Type": "audio/mpeg"}
-        )
+        relaying = True
     except requests.exceptions.Timeout:
         return jsonify({"message": "TTS request timed out. Check your internet connection."}), 500
     except requests.exceptions.ConnectionError:
         return jsonify({"message": "Cannot connect to ElevenLabs API. Check your internet connection."}), 500
     except Exception as e:
         return jsonify({"message": f"TTS error: {str(e)}"}), 500
+    finally:
+        if not relaying:
+            tts_gate.release()
+
+    def relay():
+        # Chunks are only pulled from upstream as the client consumes them,
+        # so a slow listener backs pressure up to ElevenLabs instead of
+        # buffering the clip here. The clip is written through to the cache
+        # and only committed once it has arrived in full.
+        writer = tts_cache.open_writer(key)
+        complete = False
+        try:
+            writer.write(first_chunk)
+            yield first_chunk
+            for chunk in chunks:
+                if chunk:
+                    writer.write(chunk)
+                    yield chunk
+            complete = True
+        except requests.exceptions.RequestException as e:
+            app.logger.error(f"ElevenLabs stream interrupted: {str(e)}")
+        finally:
+            response.close()
+            if complete:
+                writer.commit()
+            else:
+                writer.discard()
+
+    audio = tts_audio_response(relay(), key, "MISS")
+    audio.call_on_close(tts_gate.release)
+    # relay() never runs its finally if the client is gone before the first chunk
+    audio.call_on_close(response.close)
+    return audio
 
 
 # --- Health Check ---
@@ -1119,21 +1632,95 @@ def health():
     })
 
 
+@app.route("/api/metrics", methods=["GET"])
+def metrics():
+    return jsonify({
+        "db_pool": get_pool().stats(),
+        "tts_cache": tts_cache.stats(),
+        "canvas_cache": canvas_cache.stats(),
+        "http": http_client.stats(),
+        "jarvis_sessions": jarvis_store.stats(),
+        "voice_intents": voice_intents.stats(),
+        "local_intents": intent_engine.stats(),
+        "jarvis_prompt": jarvis_prompt_stats.stats(),
+        "opener_pool": opener_pool.stats(),
+        "speak_pipeline": speak_pipeline_stats.stats(),
+        "quest_context": quest_context_stats.stats(),
+        "llm_json": llm_json.stats.stats(),
+        "admission": admission.stats()
+    })
+
+
 # --- Custom Quest Creation ---
+# Metadata and the first question are generated in parallel under one deadline
+pending_quest_metadata = set()
+
+
 @app.route("/api/quests/custom", methods=["POST"])
 def create_custom_quest():
     """Create a personalized quest based on the student's request, prioritizing subject content in assignments."""
-    data = request.json
+    spec, error = custom_quest_request(request.json)
+    if error:
+        payload, status = error
+        return jsonify(payload), status
+
+    charge_rate_limit("create_custom_quest")
+
+    # --- Generate metadata and the opening question concurrently ---
+    # The opener only needs the system prompt, so neither call waits on the other
+    client = openai_client.with_options(timeout=CUSTOM_QUEST_DEADLINE)
+    meta_future = llm_executor.submit(generate_quest_metadata, client, spec["topic"], spec["assignment_context"])
+    opener_future = llm_executor.submit(
+        generate_quest_opener, client, spec["system_prompt"], spec["topic"], spec["num_questions"]
+    )
+
+    # With defer_metadata the session is returned as soon as the opener is ready
+    waiting_on = [opener_future] if spec["defer_metadata"] else [meta_future, opener_future]
+    done, not_done = wait(waiting_on, timeout=CUSTOM_QUEST_DEADLINE, return_when=FIRST_EXCEPTION)
+    failed = next((f for f in waiting_on if f in done and f.exception()), None)
+    if failed or not_done:
+        # Drop whichever call hasn't started; a running one is bounded by the client timeout
+        meta_future.cancel()
+        opener_future.cancel()
+        if failed and isinstance(failed.exception(), Overloaded):
+            return shed_response(failed.exception())
+        error = str(failed.exception()) if failed else f"timed out after {CUSTOM_QUEST_DEADLINE:g}s"
+        prefix = "Failed to generate quest" if failed is meta_future else "Failed to create quest"
+        return jsonify({"message": f"{prefix}: {error}"}), 500
+
+    meta = {} if spec["defer_metadata"] else meta_future.result()
+
+    # --- Insert quest into DB ---
+    db = get_db()
+    try:
+        payload = save_custom_quest(db, spec, meta, opener_future.result())
+    except Exception as e:
+        return jsonify({"message": f"Failed to create quest: {str(e)}"}), 500
+    finally:
+        db.close()
+
+    if spec["defer_metadata"]:
+        quest_id = payload["quest"]["id"]
+        meta_future.add_done_callback(lambda f: fill_quest_metadata(quest_id, spec["topic"], f))
+    return jsonify(payload)
+
+
+def custom_quest_request(data):
+    """Validate a custom quest request and build its tutor prompt.
+
+    Returns (spec, None) or (None, (error payload, status)).
+    """
     user_id = data.get("user_id")
     topic = data.get("topic", "").strip()
     num_questions = data.get("num_questions", 5)
     canvas_assignments = data.get("canvas_assignments", [])
+    defer_metadata = bool(data.get("defer_metadata", False))
 
     if not user_id or not topic:
-        return jsonify({"message": "user_id and topic are required"}), 400
+        return None, ({"message": "user_id and topic are required"}, 400)
 
     if not OPENAI_API_KEY:
-        return jsonify({"message": "OpenAI API key not configured"}), 500
+        return None, ({"message": "OpenAI API key not configured"}, 500)
 
     # --- Build assignment context with neutral labels ---
     assignment_context = ""
@@ -1172,12 +1759,87 @@ RULES:
 - Always align questions to the assignment subject(s) provided above.
 """
 
-    # --- Generate quest metadata ---
-    try:
-        meta_response = openai_client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": """Generate quest metadata for a voice-based learning app. Respond with ONLY a JSON object:
+    return {
+        "user_id": user_id,
+        "topic": topic,
+        "num_questions": num_questions,
+        "defer_metadata": defer_metadata,
+        "assignment_context": assignment_context,
+        "system_prompt": system_prompt,
+    }, None
+
+
+def save_custom_quest(db, spec, meta, tutor_message):
+    """Insert a custom quest and start its first session; returns the response payload."""
+    quest = custom_quest_fields(meta, spec["topic"])
+    user_id = spec["user_id"]
+    num_questions = spec["num_questions"]
+    defer_metadata = spec["defer_metadata"]
+
+    db.execute(
+        """INSERT INTO quests (title, description, topic, difficulty, xp_reward, estimated_minutes, icon, system_prompt, num_questions, is_custom)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 1)""",
+        (quest["title"], quest["description"], quest["topic"], quest["difficulty"],
+         quest["xp_reward"], quest["estimated_minutes"], quest["icon"],
+         spec["system_prompt"], num_questions)
+    )
+    quest_id = db.execute("SELECT last_insert_rowid()").fetchone()[0]
+    if not defer_metadata:
+        record_quest_added(db, quest["topic"])
+
+    # --- Start quest session ---
+    update_streak(db, user_id)
+    session_id = str(uuid.uuid4())
+
+    messages = [{"role": "tutor", "content": tutor_message, "timestamp": datetime.now().isoformat()}]
+
+    db.execute(
+        """INSERT INTO quest_sessions (session_id, user_id, quest_id, total_questions, status)
+           VALUES (?, ?, ?, ?, 'active')""",
+        (session_id, user_id, quest_id, num_questions)
+    )
+    append_messages(db, session_id, messages)
+
+    # --- Create progress record ---
+    db.execute(
+        "INSERT INTO user_quest_progress (user_id, quest_id, attempts, last_attempt) VALUES (?, ?, 1, ?)",
+        (user_id, quest_id, datetime.now().isoformat())
+    )
+    db.commit()
+
+    if defer_metadata:
+        pending_quest_metadata.add(quest_id)
+
+    return {
+        "quest": {"id": quest_id, **quest},
+        "session": {
+            "session_id": session_id,
+            "quest_id": quest_id,
+            "messages": messages,
+            "current_question": 1,
+            "total_questions": num_questions,
+            "score": 0,
+            "status": "active"
+        },
+        "metadata_pending": defer_metadata
+    }
+
+
+QUEST_METADATA = Schema({
+    "title": text(80),
+    "description": text(300),
+    "difficulty": one_of("beginner", "intermediate", "advanced"),
+    "icon": text(8),
+    "topic_category": text(40),
+})
+
+
+def quest_metadata_args(topic, assignment_context):
+    """Completion arguments for a custom quest's title, description, difficulty, icon and category."""
+    return {
+        "model": "gpt-4o-mini",
+        "messages": [
+            {"role": "system", "content": """Generate quest metadata for a voice-based learning app. Respond with ONLY a JSON object:
 {
   "title": "<short catchy title, 3-5 words>",
   "description": "<1 sentence describing what the student will practice>",
@@ -1185,102 +1847,100 @@ RULES:
   "icon": "<single emoji that fits the topic>",
   "topic_category": "<one of: Science, Math, History, Literature, Geography, Technology, Language, Music, or the most fitting category>"
 }"""},
-                {"role": "user", "content": f"Create a quest about: {topic}\n\n{assignment_context}"}
-            ],
-            max_tokens=150,
-            temperature=0.5
-        )
-        meta_raw = meta_response.choices[0].message.content.strip()
-        try:
-            meta = json.loads(meta_raw)
-        except json.JSONDecodeError:
-            json_start = meta_raw.index("{")
-            json_end = meta_raw.rindex("}") + 1
-            meta = json.loads(meta_raw[json_start:json_end])
-    except Exception as e:
-        return jsonify({"message": f"Failed to generate quest: {str(e)}"}), 500
+            {"role": "user", "content": f"Create a quest about: {topic}\n\n{assignment_context}"}
+        ],
+        "max_tokens": 150,
+        "temperature": 0.5,
+        **RESPONSE_FORMAT,
+    }
+
+
+def parse_quest_metadata(raw):
+    # An unusable reply (counted in /api/metrics) leaves every field to custom_quest_fields' defaults
+    return llm_json.parse("quest_metadata", raw, QUEST_METADATA) or {}
+
+
+def generate_quest_metadata(client, topic, assignment_context):
+    """Title, description, difficulty, icon and category for a custom quest."""
+    with llm_gate.slot():
+        meta_response = client.chat.completions.create(**quest_metadata_args(topic, assignment_context))
+    return parse_quest_metadata(meta_response.choices[0].message.content)
+
 
+def quest_opener_args(system_prompt, topic, num_questions):
+    """Completion arguments for the tutor's greeting and first question on a custom quest."""
+    return {
+        "model": "gpt-4o-mini",
+        "messages": [
+            {"role": "system", "content": system_prompt + f"\n\nThis is a voice-based learning session with {num_questions} questions about {topic}. Start by briefly greeting the student and asking the FIRST question using a subject-focused phrase. Do NOT reference assignment titles."},
+            {"role": "user", "content": "Start the quest!"}
+        ],
+        "max_tokens": 200,
+        "temperature": 0.7,
+    }
+
+
+def generate_quest_opener(client, system_prompt, topic, num_questions):
+    """The tutor's greeting and first question for a custom quest."""
+    with llm_gate.slot():
+        first_response = client.chat.completions.create(**quest_opener_args(system_prompt, topic, num_questions))
+    return first_response.choices[0].message.content
+
+
+def custom_quest_fields(meta, topic):
+    """Quest columns from generated metadata, with defaults for anything missing."""
     # --- Set XP and estimated time ---
     difficulty = meta.get("difficulty", "intermediate")
     xp_map = {"beginner": 50, "intermediate": 75, "advanced": 100}
-    xp_reward = xp_map.get(difficulty, 75)
     time_map = {"beginner": 5, "intermediate": 7, "advanced": 10}
-    est_minutes = time_map.get(difficulty, 7)
+    return {
+        "title": meta.get("title", topic[:30]),
+        "description": meta.get("description", f"Practice questions about {topic}"),
+        "topic": meta.get("topic_category", "General"),
+        "difficulty": difficulty,
+        "xp_reward": xp_map.get(difficulty, 75),
+        "estimated_minutes": time_map.get(difficulty, 7),
+        "icon": meta.get("icon", "📝"),
+    }
 
-    # --- Insert quest into DB ---
-    db = get_db()
-    try:
-        db.execute(
-            """INSERT INTO quests (title, description, topic, difficulty, xp_reward, estimated_minutes, icon, system_prompt, num_questions)
-               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-            (meta.get("title", topic[:30]),
-             meta.get("description", f"Practice questions about {topic}"),
-             meta.get("topic_category", "General"),
-             difficulty, xp_reward, est_minutes,
-             meta.get("icon", "📝"),
-             system_prompt, num_questions)
-        )
-        db.commit()
-        quest_id = db.execute("SELECT last_insert_rowid()").fetchone()[0]
-
-        # --- Start quest session ---
-        update_streak(db, user_id)
-        session_id = str(uuid.uuid4())
-
-        first_response = openai_client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": system_prompt + f"\n\nThis is a voice-based learning session with {num_questions} questions about {topic}. Start by briefly greeting the student and asking the FIRST question using a subject-focused phrase. Do NOT reference assignment titles."},
-                {"role": "user", "content": "Start the quest!"}
-            ],
-            max_tokens=200,
-            temperature=0.7
-        )
-        tutor_message = first_response.choices[0].message.content
 
-        messages = [{"role": "tutor", "content": tutor_message, "timestamp": datetime.now().isoformat()}]
+def fill_quest_metadata(quest_id, topic, future):
+    """Apply metadata that arrived after a defer_metadata session was returned."""
+    try:
+        meta = future.result()
+    except Exception:
+        meta = {}  # Keep the placeholder fields
+    apply_quest_metadata(quest_id, topic, meta)
 
-        db.execute(
-            """INSERT INTO quest_sessions (session_id, user_id, quest_id, messages, total_questions, status)
-               VALUES (?, ?, ?, ?, ?, 'active')""",
-            (session_id, user_id, quest_id, json.dumps(messages), num_questions)
-        )
 
-        # --- Create progress record ---
+def apply_quest_metadata(quest_id, topic, meta):
+    quest = custom_quest_fields(meta, topic)
+    db = get_db()
+    try:
         db.execute(
-            "INSERT INTO user_quest_progress (user_id, quest_id, attempts, last_attempt) VALUES (?, ?, 1, ?)",
-            (user_id, quest_id, datetime.now().isoformat())
+            """UPDATE quests SET title = ?, description = ?, topic = ?, difficulty = ?,
+                   xp_reward = ?, estimated_minutes = ?, icon = ?
+               WHERE id = ?""",
+            (quest["title"], quest["description"], quest["topic"], quest["difficulty"],
+             quest["xp_reward"], quest["estimated_minutes"], quest["icon"], quest_id)
         )
+        record_quest_added(db, quest["topic"])
         db.commit()
-
-        return jsonify({
-            "quest": {
-                "id": quest_id,
-                "title": meta.get("title", topic[:30]),
-                "description": meta.get("description", f"Practice questions about {topic}"),
-                "topic": meta.get("topic_category", "General"),
-                "difficulty": difficulty,
-                "xp_reward": xp_reward,
-                "estimated_minutes": est_minutes,
-                "icon": meta.get("icon", "📝"),
-            },
-            "session": {
-                "session_id": session_id,
-                "quest_id": quest_id,
-                "messages": messages,
-                "current_question": 1,
-                "total_questions": num_questions,
-                "score": 0,
-                "status": "active"
-            }
-        })
-    except Exception as e:
-        db.close()
-        return jsonify({"message": f"Failed to create quest: {str(e)}"}), 500
     finally:
         db.close()
+        pending_quest_metadata.discard(quest_id)
 
 
+@app.route("/api/quests/<int:quest_id>", methods=["GET"])
+def get_quest(quest_id):
+    """A single quest; custom quests created with defer_metadata report when their metadata lands."""
+    db = get_db()
+    quest = db.execute("SELECT * FROM quests WHERE id = ?", (quest_id,)).fetchone()
+    db.close()
+    if not quest:
+        return jsonify({"message": "Quest not found"}), 404
+    return jsonify({**dict(quest), "metadata_pending": quest_id in pending_quest_metadata})
+
 
 # --- Canvas LMS Integration ---
 # In-memory cache for active sessions (also stored in DB)
@@ -1290,10 +1950,7 @@ def get_canvas_session_from_db(session_id):
     """Get Canvas session from database."""
     db = get_db()
     try:
-        row = db.execute(
-            "SELECT * FROM canvas_sessions WHERE session_id = ?",
-            (session_id,)
-        ).fetchone()
+        row = db.execute(CANVAS_SESSION_SQL, (session_id,)).fetchone()
         if row:
             return {
                 "canvas_url": row["canvas_url"],
@@ -1302,7 +1959,9 @@ def get_canvas_session_from_db(session_id):
                 "user_id": row["canvas_user_id"],
             }
     finally:
+        # Canvas calls follow; don't hold a pooled connection across them
         db.close()
+        release_db()
     return None
 
 @app.route("/api/canvas/connect", methods=["POST"])
@@ -1319,7 +1978,7 @@ def canvas_connect():
     try:
         # Validate by fetching user profile from Canvas API
         headers = {"Authorization": f"Bearer {api_key}"}
-        resp = requests.get(f"{canvas_url}/api/v1/users/self/profile", headers=headers, timeout=10)
+        resp = http_client.get(f"{canvas_url}/api/v1/users/self/profile", headers=headers)
 
         if resp.status_code != 200:
             return jsonify({"message": "Invalid Canvas URL or API key"}), 401
@@ -1377,36 +2036,34 @@ def canvas_courses():
             return jsonify({"message": "Canvas not connected"}), 401
     else:
         sess = canvas_sessions[session_id]
-    headers = {"Authorization": f"Bearer {sess['api_key']}"}
 
     try:
-        resp = requests.get(
-            f"{sess['canvas_url']}/api/v1/courses",
-            headers=headers,
-            params={"enrollment_state": "active", "per_page": 50},
-            timeout=10
-        )
-        if resp.status_code != 200:
+        try:
+            body = list(iter_canvas_items(
+                sess, "/api/v1/courses",
+                {"enrollment_state": "active"},
+                ttl=CANVAS_COURSES_TTL
+            ))
+        except CanvasFetchError:
             return jsonify({"message": "Failed to fetch courses"}), 500
 
-        courses = []
-        for c in resp.json():
-            if isinstance(c, dict) and "name" in c:
-                courses.append({
-                    "id": c["id"],
-                    "name": c["name"],
-                    "code": c.get("course_code", ""),
-                })
-        return jsonify({"courses": courses})
+        return jsonify({"courses": format_courses(body)})
     except Exception as e:
         return jsonify({"message": f"Error fetching courses: {str(e)}"}), 500
 
 
 @app.route("/api/canvas/assignments", methods=["GET"])
 def canvas_assignments():
-    """Fetch upcoming assignments from Canvas."""
+    """Fetch upcoming assignments from Canvas.
+
+    Follows Canvas pagination. Optional `limit` stops after the first N
+    assignments by due date; `format=ndjson` streams one assignment per
+    line as pages arrive instead of building the whole list.
+    """
     session_id = request.args.get("session_id", "")
     course_id = request.args.get("course_id", "")
+    limit = request.args.get("limit", type=int)
+    stream = request.args.get("format") == "ndjson"
 
     # Try memory first, then database
     if session_id not in canvas_sessions:
@@ -1417,74 +2074,96 @@ def canvas_assignments():
             return jsonify({"message": "Canvas not connected"}), 401
     else:
         sess = canvas_sessions[session_id]
-    headers = {"Authorization": f"Bearer {sess['api_key']}"}
+
+    if stream:
+        return Response(
+            stream_canvas_assignments(sess, course_id, limit),
+            mimetype="application/x-ndjson",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
 
     try:
         assignments = []
+        errors = []
 
         if course_id:
             # Fetch assignments for a specific course
-            url = f"{sess['canvas_url']}/api/v1/courses/{course_id}/assignments"
-            params = {"per_page": 20, "order_by": "due_at"}
-            resp = requests.get(url, headers=headers, params=params, timeout=10)
-            if resp.status_code == 200:
-                for a in resp.json():
+            try:
+                for a in iter_canvas_items(
+                    sess, f"/api/v1/courses/{course_id}/assignments",
+                    {"order_by": "due_at"}, limit=limit
+                ):
                     if isinstance(a, dict):
-                        assignments.append({
-                            "id": a.get("id"),
-                            "name": a.get("name", a.get("title", "Untitled")),
-                            "due_at": a.get("due_at"),
-                            "course_id": a.get("course_id"),
-                            "description": (a.get("description") or "")[:500],  # Increased to 500 chars for better context
-                        })
+                        assignments.append(format_assignment(a, a.get("course_id")))
+            except CanvasFetchError as e:
+                errors.append({"course_id": course_id, "error": str(e)})
         else:
-            # Fetch assignments from ALL active courses
-            courses_resp = requests.get(
-                f"{sess['canvas_url']}/api/v1/courses",
-                headers=headers,
-                params={"enrollment_state": "active", "per_page": 50},
-                timeout=10
-            )
-            if courses_resp.status_code == 200:
-                courses = courses_resp.json()
-                for course in courses:
-                    if not isinstance(course, dict) or "id" not in course:
-                        continue
-                    cid = course["id"]
-                    cname = course.get("name", "Unknown Course")
-                    try:
-                        a_resp = requests.get(
-                            f"{sess['canvas_url']}/api/v1/courses/{cid}/assignments",
-                            headers=headers,
-                            params={"per_page": 10, "order_by": "due_at"},
-                            timeout=10
-                        )
-                        if a_resp.status_code == 200:
-                            for a in a_resp.json():
-                                if isinstance(a, dict):
-                                    assignments.append({
-                                        "id": a.get("id"),
-                                        "name": a.get("name", a.get("title", "Untitled")),
-                                        "due_at": a.get("due_at"),
-                                        "course_id": cid,
-                                        "course_name": cname,
-                                        "description": (a.get("description") or "")[:500],  # Increased to 500 chars for better context
-                                    })
-                    except Exception:
-                        continue  # Skip courses that fail
-
-        return jsonify({"assignments": assignments})
+            # Fetch assignments from ALL active courses, one request per course in parallel
+            try:
+                courses = list(iter_canvas_items(
+                    sess, "/api/v1/courses",
+                    {"enrollment_state": "active"},
+                    ttl=CANVAS_COURSES_TTL
+                ))
+                assignments, errors = fetch_assignments_for_courses(sess, courses)
+                if limit is not None:
+                    assignments = assignments[:limit]
+            except CanvasFetchError as e:
+                errors.append({"course_id": None, "error": str(e)})
+
+        return jsonify({"assignments": assignments, "errors": errors})
     except Exception as e:
         return jsonify({"message": f"Error fetching assignments: {str(e)}"}), 500
 
 
+def stream_canvas_assignments(sess, course_id, limit):
+    """NDJSON body for canvas_assignments: one assignment (or error) object per line.
+
+    Without a limit, courses stream as they finish, each in Canvas due-date
+    order. With a limit, every course is awaited so the N soonest-due
+    assignments can be sent; per-course errors still stream as they occur.
+    """
+    try:
+        if course_id:
+            for a in iter_canvas_items(
+                sess, f"/api/v1/courses/{course_id}/assignments",
+                {"order_by": "due_at"}, limit=limit
+            ):
+                if isinstance(a, dict):
+                    yield json.dumps(format_assignment(a, a.get("course_id"))) + "\n"
+            return
+
+        courses = list(iter_canvas_items(
+            sess, "/api/v1/courses",
+            {"enrollment_state": "active"},
+            ttl=CANVAS_COURSES_TTL
+        ))
+        pending = []
+        for kind, payload in iter_course_assignments(sess, courses):
+            if kind == "error":
+                yield json.dumps(payload) + "\n"
+            elif limit is not None:
+                pending.extend(payload)  # Held back until every course is in
+            else:
+                for a in payload:
+                    yield json.dumps(a) + "\n"
+
+        if limit is not None:
+            pending.sort(key=due_date_order)
+            for a in pending[:limit]:
+                yield json.dumps(a) + "\n"
+    except Exception as e:
+        yield json.dumps({"error": f"Error fetching assignments: {str(e)}"}) + "\n"
+
+
 @app.route("/api/canvas/disconnect", methods=["POST"])
 def canvas_disconnect():
     """Disconnect Canvas session."""
     data = request.json
     session_id = data.get("session_id", "")
-    if session_id in canvas_sessions:
-        del canvas_sessions[session_id]
+    sess = canvas_sessions.pop(session_id, None) or get_canvas_session_from_db(session_id)
+    if sess:
+        canvas_cache.invalidate(sess["canvas_url"], sess["user_id"])
     # Also remove from database
     db = get_db()
     try:
@@ -0,0 +1,631 @@
+"""
+Async serving mode.
+
+    pip install -r requirements.txt
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+
+The routes that wait on upstream services are served natively here, so
+an in-flight call waits on the event loop instead of holding a worker
+thread:
+
+  - quest start, quest respond, custom quest creation, /api/jarvis/chat
+    and /api/voice/command await AsyncOpenAI
+  - /api/tts streams from ElevenLabs through http_client's async client
+  - /api/canvas/courses and /api/canvas/assignments fetch through the
+    same client (see canvas.aiter_items)
+
+Every other route is the unchanged Flask app, run on asgiref's thread
+pool. Request parsing, prompts, reply parsing and persistence are shared
+with app.py. SQLite work (the quest tables and the Jarvis history
+store) runs on worker threads via asyncio.to_thread, so a busy database
+never stalls the loop. Rate limits and upstream gates are the same ones
+the Flask app uses; a queued call waits for its slot on a thread of its
+own (gate_waiters), not on the event loop or the default executor, which
+the calls holding slots need for DNS lookups and database work.
+
+`flask bench-load` drives either server with concurrent requests.
+"""
+
+import asyncio
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+import httpx
+from asgiref.wsgi import WsgiToAsgi
+from openai import AsyncOpenAI
+
+import app as voicequest
+import canvas
+import http_client
+
+voicequest.init_db()
+async_openai = AsyncOpenAI(api_key=voicequest.OPENAI_API_KEY, base_url=voicequest.OPENAI_BASE_URL)
+flask_app = WsgiToAsgi(voicequest.app)
+limiter = voicequest.admission.limiter
+
+# Each gate lets at most UPSTREAM_QUEUE callers wait; one thread each, plus one per gate for callers
+# that get a slot straight away or are shed
+gate_waiters = ThreadPoolExecutor(
+    max_workers=2 * (voicequest.admission.QUEUE_SIZE + 1), thread_name_prefix="gate-wait"
+)
+
+# Deferred custom quest metadata; referenced here so the tasks aren't garbage collected
+background_tasks = set()
+
+
+# --- Helpers ---
+class AsyncRequest:
+    def __init__(self, scope, data):
+        self.scope = scope
+        self.data = data
+        self.headers = dict(scope.get("headers") or [])
+        self.params = {k: v[0] for k, v in parse_qs(scope.get("query_string", b"").decode()).items()}
+
+    def header(self, name):
+        return self.headers.get(name.lower().encode(), b"").decode()
+
+    def client(self):
+        """Same keying as app.rate_limit_client: the remote address."""
+        return f"ip:{(self.scope.get('client') or ('',))[0]}"
+
+
+async def read_json(receive):
+    body = b""
+    more = True
+    while more:
+        message = await receive()
+        body += message.get("body", b"")
+        more = message.get("more_body", False)
+    try:
+        return json.loads(body or b"{}")
+    except ValueError:
+        return None
+
+
+async def send_json(send, payload, status=200, headers=()):
+    body = json.dumps(payload).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            # Match flask-cors's defaults for the routes served by Flask
+            (b"access-control-allow-origin", b"*"),
+            *headers,
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+def streamed_response(chunks, content_type, status=200, headers=(), cleanup=None):
+    """A handler result that sends `chunks` (an async iterator of bytes) as they are produced.
+
+    `cleanup` is awaited once sending ends, however it ends. Put anything
+    that must be released there rather than only in the producer's
+    `finally`: that never runs if the client is gone before the first chunk.
+    """
+    async def respond(send):
+        try:
+            await send({
+                "type": "http.response.start",
+                "status": status,
+                "headers": [
+                    (b"content-type", content_type),
+                    (b"access-control-allow-origin", b"*"),
+                    *headers,
+                ],
+            })
+            async for chunk in chunks:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        finally:
+            try:
+                await chunks.aclose()  # Runs the producer's cleanup even if the client went away
+            finally:
+                if cleanup is not None:
+                    await cleanup()
+        await send({"type": "http.response.body", "body": b""})
+    return respond
+
+
+def int_param(value):
+    """Flask's `type=int`: None when missing or not a number."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def with_db(fn, *args):
+    """Call fn(db, *args) on a pooled connection and return it afterwards."""
+    db = voicequest.get_db()
+    try:
+        return fn(db, *args)
+    finally:
+        db.close()
+
+
+async def run_db(fn, *args):
+    """with_db on a worker thread."""
+    return await asyncio.to_thread(with_db, fn, *args)
+
+
+def run_in_background(coro):
+    task = asyncio.ensure_future(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+
+async def acquire(gate):
+    """Take a slot on a shared upstream gate without blocking the event loop."""
+    acquiring = asyncio.ensure_future(asyncio.get_running_loop().run_in_executor(gate_waiters, gate.acquire))
+    try:
+        # Shielded: cancelling the request must not orphan the waiting thread's slot
+        await asyncio.shield(acquiring)
+    except asyncio.CancelledError:
+        def release_if_acquired(future):
+            if not future.cancelled() and future.exception() is None:
+                gate.release()
+        acquiring.add_done_callback(release_if_acquired)
+        raise
+
+
+async def complete(**kwargs):
+    """An AsyncOpenAI completion holding a slot on the shared upstream LLM gate."""
+    gate = voicequest.llm_gate
+    await acquire(gate)
+    try:
+        return await async_openai.chat.completions.create(**kwargs)
+    finally:
+        gate.release()
+
+
+# --- Quest Routes ---
+async def start_quest(req, quest_id):
+    user_id = req.data.get("user_id")
+
+    if not user_id:
+        return {"message": "user_id is required"}, 400
+
+    quest, opener, error = await run_db(voicequest.begin_quest, int(quest_id), user_id)
+    if error:
+        return error
+
+    if opener:
+        tutor_message = opener["content"]
+    else:
+        limiter.check("start_quest", req.client())
+        try:
+            response = await complete(**voicequest.catalog_opener_args(quest))
+            tutor_message = response.choices[0].message.content
+        except voicequest.Overloaded:
+            raise
+        except Exception as e:
+            return {"message": f"OpenAI API error: {str(e)}"}, 500
+
+    session = await run_db(voicequest.save_quest_start, quest, user_id, tutor_message)
+
+    if not quest["is_custom"]:
+        voicequest.opener_pool.refill_async(quest["id"])
+
+    return {"session": session, "opener_audio_cached": bool(opener and opener["tts_key"])}, 200
+
+
+async def respond_to_quest(req, session_id):
+    user_message = req.data.get("message", "")
+
+    if not user_message:
+        return {"message": "Message is required"}, 400
+
+    turn, error = await run_db(voicequest.load_quest_turn, session_id, user_message)
+    if error:
+        return error
+    limiter.check("respond_to_quest", req.client())
+
+    try:
+        response = await complete(messages=turn["openai_messages"], **voicequest.QUEST_TURN_ARGS)
+        raw_response = response.choices[0].message.content
+    except voicequest.Overloaded:
+        raise
+    except Exception as e:
+        return {"message": f"OpenAI API error: {str(e)}"}, 500
+
+    is_correct, score_delta, tutor_message = voicequest.parse_tutor_reply(raw_response)
+    return await run_db(voicequest.finish_quest_turn, turn, is_correct, score_delta, tutor_message), 200
+
+
+async def quest_metadata(spec):
+    response = await complete(
+        timeout=voicequest.CUSTOM_QUEST_DEADLINE,
+        **voicequest.quest_metadata_args(spec["topic"], spec["assignment_context"])
+    )
+    return voicequest.parse_quest_metadata(response.choices[0].message.content)
+
+
+async def quest_opener(spec):
+    response = await complete(
+        timeout=voicequest.CUSTOM_QUEST_DEADLINE,
+        **voicequest.quest_opener_args(spec["system_prompt"], spec["topic"], spec["num_questions"])
+    )
+    return response.choices[0].message.content
+
+
+async def fill_quest_metadata(quest_id, topic, metadata):
+    """Apply metadata that arrived after a defer_metadata session was returned."""
+    try:
+        meta = await metadata
+    except Exception:
+        meta = {}  # Keep the placeholder fields
+    await asyncio.to_thread(voicequest.apply_quest_metadata, quest_id, topic, meta)
+
+
+async def create_custom_quest(req):
+    spec, error = voicequest.custom_quest_request(req.data)
+    if error:
+        return error
+
+    limiter.check("create_custom_quest", req.client())
+
+    # Metadata and the opener are generated concurrently under one deadline
+    meta_task = asyncio.ensure_future(quest_metadata(spec))
+    opener_task = asyncio.ensure_future(quest_opener(spec))
+    waiting_on = [opener_task] if spec["defer_metadata"] else [meta_task, opener_task]
+    done, not_done = await asyncio.wait(
+        waiting_on, timeout=voicequest.CUSTOM_QUEST_DEADLINE, return_when=asyncio.FIRST_EXCEPTION
+    )
+    failed = next((t for t in waiting_on if t in done and t.exception()), None)
+    if failed or not_done:
+        meta_task.cancel()
+        opener_task.cancel()
+        if failed and isinstance(failed.exception(), voicequest.Overloaded):
+            raise failed.exception()
+        error = str(failed.exception()) if failed else f"timed out after {voicequest.CUSTOM_QUEST_DEADLINE:g}s"
+        prefix = "Failed to generate quest" if failed is meta_task else "Failed to create quest"
+        return {"message": f"{prefix}: {error}"}, 500
+
+    meta = {} if spec["defer_metadata"] else meta_task.result()
+    try:
+        payload = await run_db(voicequest.save_custom_quest, spec, meta, opener_task.result())
+    except Exception as e:
+        meta_task.cancel()
+        return {"message": f"Failed to create quest: {str(e)}"}, 500
+
+    if spec["defer_metadata"]:
+        run_in_background(fill_quest_metadata(payload["quest"]["id"], spec["topic"], meta_task))
+    return payload, 200
+
+
+# --- Jarvis and Voice Command Routes ---
+async def jarvis_chat(req):
+    session_id = req.data.get("session_id", "")
+    message = req.data.get("message", "").strip()
+    context = req.data.get("context", {})
+
+    if not message:
+        return {"message": "Message is required"}, 400
+
+    # The local grammar is fast, but recording the turn may touch the SQLite history store
+    local = await asyncio.to_thread(voicequest.jarvis_local_reply, session_id, message, context)
+    if local:
+        return local, 200
+
+    if not voicequest.OPENAI_API_KEY:
+        return {"message": "OpenAI API key not configured"}, 500
+
+    limiter.check("jarvis_chat", req.client())
+    try:
+        openai_messages, prompt = await asyncio.to_thread(voicequest.jarvis_request, session_id, message, context)
+        response = await complete(messages=openai_messages, **voicequest.JARVIS_COMPLETION_ARGS)
+        reply = await asyncio.to_thread(voicequest.jarvis_finish_reply, session_id, message, response, prompt)
+        return reply, 200
+    except voicequest.Overloaded:
+        raise
+    except Exception as e:
+        return {"message": f"Jarvis error: {str(e)}"}, 500
+
+
+async def voice_command(req):
+    transcript = req.data.get("transcript", "").strip()
+    current_page = req.data.get("current_page", "/dashboard")
+    available_quests = req.data.get("available_quests", [])
+
+    if not transcript:
+        return {"message": "Transcript is required"}, 400
+
+    cached, cache_key = voicequest.voice_intents.resolve(transcript, current_page, available_quests)
+    if cached:
+        return cached, 200
+
+    if not voicequest.OPENAI_API_KEY:
+        return {"message": "OpenAI API key not configured"}, 500
+
+    limiter.check("voice_command", req.client())
+    try:
+        response = await complete(
+            messages=voicequest.voice_command_messages(transcript, current_page, available_quests),
+            **voicequest.VOICE_COMPLETION_ARGS
+        )
+        raw = response.choices[0].message.content.strip()
+        return voicequest.parse_voice_reply(raw, cache_key), 200
+    except voicequest.Overloaded:
+        raise
+    except Exception as e:
+        return {"message": f"AI command error: {str(e)}"}, 500
+
+
+# --- TTS Route ---
+def audio_headers(key, cache_status=None):
+    headers = [
+        (b"etag", f'"{key}"'.encode()),
+        (b"cache-control", f"public, max-age={voicequest.TTS_CACHE_MAX_AGE}".encode()),
+    ]
+    if cache_status:
+        headers.append((b"x-cache", cache_status.encode()))
+    return headers
+
+
+async def text_to_speech(req):
+    text = req.data.get("text", "")
+    voice_id = req.data.get("voice_id", voicequest.ELEVENLABS_VOICE_ID)
+
+    if not text:
+        return {"message": "Text is required"}, 400
+
+    tts_cache = voicequest.tts_cache
+    key = voicequest.tts_cache_key(text, voice_id, voicequest.TTS_MODEL_ID, voicequest.TTS_VOICE_SETTINGS)
+    if f'"{key}"' in req.header("If-None-Match") and key in tts_cache:
+        return streamed_response(aiter_chunks(), b"audio/mpeg", 304, audio_headers(key))
+
+    cached = await asyncio.to_thread(tts_cache.get, key)
+    if cached is not None:
+        return streamed_response(aiter_chunks(cached), b"audio/mpeg", headers=audio_headers(key, "HIT"))
+
+    if not voicequest.ELEVENLABS_API_KEY:
+        return {"message": "ElevenLabs API key not configured"}, 500
+
+    limiter.check("text_to_speech", req.client())
+    # The upstream slot is held while the clip streams and freed once the relay ends
+    await acquire(voicequest.tts_gate)
+    slot = voicequest.admission.Slot(voicequest.tts_gate)  # release() is idempotent
+    relaying = False
+    try:
+        response = await http_client.apost(
+            f"{voicequest.ELEVENLABS_BASE_URL}/v1/text-to-speech/{voice_id}/stream",
+            headers={
+                "Accept": "audio/mpeg",
+                "Content-Type": "application/json",
+                "xi-api-key": voicequest.ELEVENLABS_API_KEY
+            },
+            json={
+                "text": text,
+                "model_id": voicequest.TTS_MODEL_ID,
+                "voice_settings": voicequest.TTS_VOICE_SETTINGS
+            },
+            stream=True
+        )
+
+        if response.status_code != 200:
+            await response.aread()
+            error_msg = response.text[:200] if response.text else "Unknown error"
+            await response.aclose()
+            voicequest.app.logger.error(f"ElevenLabs API error: Status {response.status_code}, Response: {error_msg}")
+            return {"message": f"ElevenLabs API error: {error_msg}"}, 500
+
+        chunks = response.aiter_bytes(voicequest.TTS_STREAM_CHUNK_SIZE)
+        try:
+            first_chunk = await chunks.__anext__()
+        except StopAsyncIteration:
+            first_chunk = b""
+        if not first_chunk:
+            await response.aclose()
+            return {"message": "Empty audio response from ElevenLabs"}, 500
+        relaying = True
+    except httpx.TimeoutException:
+        return {"message": "TTS request timed out. Check your internet connection."}, 500
+    except httpx.ConnectError:
+        return {"message": "Cannot connect to ElevenLabs API. Check your internet connection."}, 500
+    except Exception as e:
+        return {"message": f"TTS error: {str(e)}"}, 500
+    finally:
+        if not relaying:
+            slot.release()
+
+    async def relay():
+        # As in app.text_to_speech: written through to the cache, committed only once complete
+        writer = tts_cache.open_writer(key)
+        complete = False
+        try:
+            writer.write(first_chunk)
+            yield first_chunk
+            async for chunk in chunks:
+                if chunk:
+                    writer.write(chunk)
+                    yield chunk
+            complete = True
+        except httpx.HTTPError as e:
+            voicequest.app.logger.error(f"ElevenLabs stream interrupted: {str(e)}")
+        finally:
+            await release_upstream()
+            if complete:
+                await asyncio.to_thread(writer.commit)
+            else:
+                writer.discard()
+
+    async def release_upstream():
+        await response.aclose()
+        slot.release()
+
+    return streamed_response(relay(), b"audio/mpeg", headers=audio_headers(key, "MISS"), cleanup=release_upstream)
+
+
+async def aiter_chunks(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+# --- Canvas Routes ---
+async def canvas_session(session_id):
+    """The connected Canvas session: memory first, then the database."""
+    sess = voicequest.canvas_sessions.get(session_id)
+    if sess is None:
+        sess = await asyncio.to_thread(voicequest.get_canvas_session_from_db, session_id)
+        if sess:
+            voicequest.canvas_sessions[session_id] = sess
+    return sess
+
+
+async def active_courses(sess):
+    return [
+        c async for c in canvas.aiter_items(
+            sess, "/api/v1/courses", {"enrollment_state": "active"}, ttl=canvas.COURSES_TTL
+        )
+    ]
+
+
+async def canvas_courses(req):
+    sess = await canvas_session(req.params.get("session_id", ""))
+    if not sess:
+        return {"message": "Canvas not connected"}, 401
+
+    try:
+        body = await active_courses(sess)
+    except canvas.CanvasFetchError:
+        return {"message": "Failed to fetch courses"}, 500
+    except Exception as e:
+        return {"message": f"Error fetching courses: {str(e)}"}, 500
+    return {"courses": canvas.format_courses(body)}, 200
+
+
+async def canvas_assignments(req):
+    sess = await canvas_session(req.params.get("session_id", ""))
+    if not sess:
+        return {"message": "Canvas not connected"}, 401
+
+    course_id = req.params.get("course_id", "")
+    limit = int_param(req.params.get("limit"))
+    if req.params.get("format") == "ndjson":
+        return streamed_response(
+            stream_canvas_assignments(sess, course_id, limit), b"application/x-ndjson",
+            headers=[(b"cache-control", b"no-cache"), (b"x-accel-buffering", b"no")]
+        )
+
+    assignments = []
+    errors = []
+    try:
+        if course_id:
+            try:
+                async for a in canvas.aiter_items(
+                    sess, f"/api/v1/courses/{course_id}/assignments",
+                    {"order_by": "due_at"}, limit=limit
+                ):
+                    if isinstance(a, dict):
+                        assignments.append(canvas.format_assignment(a, a.get("course_id")))
+            except canvas.CanvasFetchError as e:
+                errors.append({"course_id": course_id, "error": str(e)})
+        else:
+            try:
+                courses = await active_courses(sess)
+                assignments, errors = await canvas.fetch_assignments_for_courses_async(sess, courses)
+                if limit is not None:
+                    assignments = assignments[:limit]
+            except canvas.CanvasFetchError as e:
+                errors.append({"course_id": None, "error": str(e)})
+    except Exception as e:
+        return {"message": f"Error fetching assignments: {str(e)}"}, 500
+    return {"assignments": assignments, "errors": errors}, 200
+
+
+async def stream_canvas_assignments(sess, course_id, limit):
+    """app.stream_canvas_assignments for the async server, with the same ordering and limit."""
+    try:
+        if course_id:
+            async for a in canvas.aiter_items(
+                sess, f"/api/v1/courses/{course_id}/assignments",
+                {"order_by": "due_at"}, limit=limit
+            ):
+                if isinstance(a, dict):
+                    yield (json.dumps(canvas.format_assignment(a, a.get("course_id"))) + "\n").encode()
+            return
+
+        courses = await active_courses(sess)
+        pending = []
+        async for kind, payload in canvas.iter_course_assignments_async(sess, courses):
+            if kind == "error":
+                yield (json.dumps(payload) + "\n").encode()
+            elif limit is not None:
+                pending.extend(payload)  # Held back until every course is in
+            else:
+                for a in payload:
+                    yield (json.dumps(a) + "\n").encode()
+
+        if limit is not None:
+            pending.sort(key=canvas.due_date_order)
+            for a in pending[:limit]:
+                yield (json.dumps(a) + "\n").encode()
+    except Exception as e:
+        yield (json.dumps({"error": f"Error fetching assignments: {str(e)}"}) + "\n").encode()
+
+
+# (method, path pattern, handler); named groups are passed to the handler
+ASYNC_ROUTES = [
+    (method, re.compile(pattern), handler) for method, pattern, handler in [
+        ("POST", r"/api/quests/(?P<quest_id>\d+)/start", start_quest),
+        ("POST", r"/api/quests/session/(?P<session_id>[^/]+)/respond", respond_to_quest),
+        ("POST", r"/api/quests/custom", create_custom_quest),
+        ("POST", r"/api/jarvis/chat", jarvis_chat),
+        ("POST", r"/api/voice/command", voice_command),
+        ("POST", r"/api/tts", text_to_speech),
+        ("GET", r"/api/canvas/courses", canvas_courses),
+        ("GET", r"/api/canvas/assignments", canvas_assignments),
+    ]
+]
+
+
+def find_route(scope):
+    if scope["type"] != "http":
+        return None, None
+    for method, pattern, handler in ASYNC_ROUTES:
+        match = pattern.fullmatch(scope.get("path", ""))
+        if match and method == scope.get("method"):
+            return handler, match.groupdict()
+    return None, None
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await async_openai.close()
+                await http_client.aclose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    handler, params = find_route(scope)
+    if handler is None:
+        await flask_app(scope, receive, send)
+        return
+
+    data = await read_json(receive) if scope["method"] == "POST" else {}
+    if not isinstance(data, dict):
+        await send_json(send, {"message": "Request body must be a JSON object"}, 400)
+        return
+    try:
+        result = await handler(AsyncRequest(scope, data), **params)
+    except voicequest.Overloaded as e:
+        await send_json(send, voicequest.shed_payload(e), 429, [(b"retry-after", str(e.retry_after).encode())])
+        return
+    except voicequest.PoolExhausted as e:
+        payload = {"message": "The server is busy, please try again shortly.", "retry_after": e.retry_after}
+        await send_json(send, payload, 503, [(b"retry-after", str(e.retry_after).encode())])
+        return
+
+    if callable(result):
+        await result(send)
+    else:
+        payload, status = result
+        await send_json(send, payload, status)
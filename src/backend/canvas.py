@@ -0,0 +1,456 @@
+"""
+Canvas LMS fetch helpers.
+
+Per-course assignment requests are fanned out over a shared thread pool,
+with at most CANVAS_HOST_CONCURRENCY requests in flight per Canvas host
+and an overall CANVAS_FANOUT_DEADLINE so one slow course cannot stall
+the whole call.
+
+GET responses are cached per (canvas_url, canvas_user_id, endpoint,
+params). Fresh entries are served directly; entries past their TTL but
+within CANVAS_STALE_TTL are served immediately while a background
+refresh revalidates them with If-None-Match; anything older is
+revalidated before returning. The cache keeps at most
+CANVAS_CACHE_MAX_ENTRIES responses, dropping the least recently used,
+and entries past TTL + CANVAS_STALE_TTL are swept out periodically.
+
+List endpoints are paginated by Canvas through `Link: rel="next"`
+headers; iter_items() follows them lazily so callers can stop early
+without fetching the remaining pages. A listing longer than
+CANVAS_MAX_PAGES pages is cut off there; that is logged and counted as
+truncated_listings.
+
+The async server uses aiter_items() and iter_course_assignments_async():
+the same cache and limits, fetched with http_client's async client.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeout
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+
+import http_client
+
+REQUEST_TIMEOUT = float(os.environ.get("CANVAS_REQUEST_TIMEOUT", "10"))
+HOST_CONCURRENCY = int(os.environ.get("CANVAS_HOST_CONCURRENCY", "4"))
+FANOUT_DEADLINE = float(os.environ.get("CANVAS_FANOUT_DEADLINE", "15"))
+FANOUT_WORKERS = int(os.environ.get("CANVAS_FANOUT_WORKERS", "16"))
+COURSES_TTL = float(os.environ.get("CANVAS_COURSES_TTL", "600"))
+ASSIGNMENTS_TTL = float(os.environ.get("CANVAS_ASSIGNMENTS_TTL", "120"))
+STALE_TTL = float(os.environ.get("CANVAS_STALE_TTL", "3600"))
+PAGE_SIZE = int(os.environ.get("CANVAS_PAGE_SIZE", "50"))
+MAX_PAGES = int(os.environ.get("CANVAS_MAX_PAGES", "40"))
+CACHE_MAX_ENTRIES = int(os.environ.get("CANVAS_CACHE_MAX_ENTRIES", "5000"))
+CACHE_SWEEP_INTERVAL = 60  # Seconds between sweeps for expired entries
+
+log = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix="canvas")
+_host_limits = {}
+_host_limits_lock = threading.Lock()
+_async_host_limits = {}
+
+
+class CanvasFetchError(Exception):
+    """A single Canvas request failed; the message is safe to show the user."""
+
+
+def host_limit(url):
+    host = urlsplit(url).netloc
+    with _host_limits_lock:
+        if host not in _host_limits:
+            _host_limits[host] = threading.BoundedSemaphore(HOST_CONCURRENCY)
+        return _host_limits[host]
+
+
+def async_host_limit(url):
+    host = urlsplit(url).netloc
+    if host not in _async_host_limits:
+        _async_host_limits[host] = asyncio.Semaphore(HOST_CONCURRENCY)
+    return _async_host_limits[host]
+
+
+class CanvasCache:
+    def __init__(self, stale_ttl=STALE_TTL, max_entries=CACHE_MAX_ENTRIES):
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> {"body", "next", "etag", "ttl", "fetched_at"}, least recently used first
+        self._last_sweep = time.monotonic()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._counters = {
+            "hits": 0,
+            "stale_hits": 0,
+            "misses": 0,
+            "not_modified": 0,
+            "background_refreshes": 0,
+            "invalidations": 0,
+            "evicted": 0,
+            "expired": 0,
+            "truncated_listings": 0,
+        }
+
+    @staticmethod
+    def key(sess, path, params):
+        return (sess["canvas_url"], sess.get("user_id"), path, tuple(sorted((params or {}).items())))
+
+    def get_json(self, sess, path, params=None, ttl=ASSIGNMENTS_TTL, timeout=REQUEST_TIMEOUT):
+        """GET {canvas_url}{path} as JSON, served from cache when possible."""
+        return self.get_page(sess, path, params, ttl, timeout)[0]
+
+    def get_page(self, sess, path, params=None, ttl=ASSIGNMENTS_TTL, timeout=REQUEST_TIMEOUT):
+        """Like get_json, but returns (body, next page URL or None).
+
+        `path` may also be an absolute next-page URL taken from a Link header.
+        """
+        key = self.key(sess, path, params)
+        page, entry = self._lookup(key, sess, path, params, ttl, timeout)
+        if page is not None:
+            return page
+        return self._revalidate(key, sess, path, params, entry, ttl, timeout)
+
+    async def get_page_async(self, sess, path, params=None, ttl=ASSIGNMENTS_TTL, timeout=REQUEST_TIMEOUT):
+        """get_page for the async server; a miss is fetched without blocking the event loop."""
+        key = self.key(sess, path, params)
+        page, entry = self._lookup(key, sess, path, params, ttl, timeout)
+        if page is not None:
+            return page
+        url, headers = self._request(sess, path, entry)
+        resp = await http_client.aget(url, headers=headers, params=params, timeout=timeout)
+        return self._apply(key, sess, entry, ttl, resp)
+
+    def _lookup(self, key, sess, path, params, ttl, timeout):
+        """Return ((body, next URL), entry) when the cache can answer, else (None, entry or None)."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                self._entries.move_to_end(key)
+                age = now - entry["fetched_at"]
+                if age < ttl:
+                    self._counters["hits"] += 1
+                    return (entry["body"], entry["next"]), entry
+                if age < ttl + self.stale_ttl:
+                    self._counters["stale_hits"] += 1
+                    if key not in self._refreshing:
+                        self._refreshing.add(key)
+                        self._counters["background_refreshes"] += 1
+                        _executor.submit(self._background_refresh, key, sess, path, params, ttl, timeout)
+                    return (entry["body"], entry["next"]), entry
+            self._counters["misses"] += 1
+        return None, entry
+
+    @staticmethod
+    def _request(sess, path, entry):
+        headers = {"Authorization": f"Bearer {sess['api_key']}"}
+        if entry and entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        url = path if path.startswith(sess["canvas_url"]) else f"{sess['canvas_url']}{path}"
+        return url, headers
+
+    def _revalidate(self, key, sess, path, params, entry, ttl, timeout):
+        url, headers = self._request(sess, path, entry)
+        resp = http_client.get(url, headers=headers, params=params, timeout=timeout)
+        return self._apply(key, sess, entry, ttl, resp)
+
+    def _apply(self, key, sess, entry, ttl, resp):
+        """Cache a Canvas response (requests or httpx) and return (body, next URL)."""
+        if resp.status_code == 304 and entry:
+            with self._lock:
+                self._counters["not_modified"] += 1
+                entry["fetched_at"] = time.monotonic()
+            return entry["body"], entry["next"]
+        if resp.status_code != 200:
+            raise CanvasFetchError(f"Canvas returned HTTP {resp.status_code}")
+
+        body = resp.json()
+        next_url = resp.links.get("next", {}).get("url")
+        if next_url and not next_url.startswith(sess["canvas_url"]):
+            next_url = None  # Never send the token to another host
+        with self._lock:
+            self._store(key, {
+                "body": body,
+                "next": next_url,
+                "etag": resp.headers.get("ETag"),
+                "ttl": ttl,
+                "fetched_at": time.monotonic(),
+            })
+        return body, next_url
+
+    def _store(self, key, entry):
+        """Insert an entry as most recently used, then evict. Caller holds the lock."""
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        now = entry["fetched_at"]
+        if now - self._last_sweep >= CACHE_SWEEP_INTERVAL:
+            self._last_sweep = now
+            expired = [
+                k for k, e in self._entries.items()
+                if now - e["fetched_at"] >= e["ttl"] + self.stale_ttl
+            ]
+            for k in expired:
+                del self._entries[k]
+            self._counters["expired"] += len(expired)
+        while len(self._entries) > self.max_entries > 0:
+            self._entries.popitem(last=False)
+            self._counters["evicted"] += 1
+
+    def _background_refresh(self, key, sess, path, params, ttl, timeout):
+        try:
+            with self._lock:
+                entry = self._entries.get(key)
+            self._revalidate(key, sess, path, params, entry, ttl, timeout)
+        except Exception:
+            pass  # Keep serving the stale copy; the next request retries
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def invalidate(self, canvas_url, canvas_user_id):
+        """Drop every cached response for one Canvas user."""
+        with self._lock:
+            stale = [k for k in self._entries if k[0] == canvas_url and k[1] == canvas_user_id]
+            for k in stale:
+                del self._entries[k]
+            self._counters["invalidations"] += len(stale)
+
+    def record_truncated(self):
+        with self._lock:
+            self._counters["truncated_listings"] += 1
+
+    def stats(self):
+        with self._lock:
+            return {**self._counters, "entries": len(self._entries)}
+
+
+cache = CanvasCache()
+
+
+def iter_items(sess, path, params=None, ttl=ASSIGNMENTS_TTL, limit=None, timeout=REQUEST_TIMEOUT):
+    """Yield list items across Canvas pages, fetching the next page only when needed.
+
+    Stops after `limit` items when given. Listings longer than MAX_PAGES
+    pages are truncated with a warning.
+    """
+    if limit is not None and limit <= 0:
+        return
+    params = {"per_page": PAGE_SIZE, **(params or {})}
+    url = path
+    yielded = 0
+    for _ in range(MAX_PAGES):
+        body, next_url = cache.get_page(sess, url, params, ttl, timeout)
+        for item in body if isinstance(body, list) else []:
+            yield item
+            yielded += 1
+            if limit is not None and yielded >= limit:
+                return
+        if not next_url:
+            return
+        # The next URL already carries every query parameter
+        url, params = next_url, None
+    _truncated(path, yielded)
+
+
+async def aiter_items(sess, path, params=None, ttl=ASSIGNMENTS_TTL, limit=None, timeout=REQUEST_TIMEOUT):
+    """iter_items for the async server."""
+    if limit is not None and limit <= 0:
+        return
+    params = {"per_page": PAGE_SIZE, **(params or {})}
+    url = path
+    yielded = 0
+    for _ in range(MAX_PAGES):
+        body, next_url = await cache.get_page_async(sess, url, params, ttl, timeout)
+        for item in body if isinstance(body, list) else []:
+            yield item
+            yielded += 1
+            if limit is not None and yielded >= limit:
+                return
+        if not next_url:
+            return
+        url, params = next_url, None
+    _truncated(path, yielded)
+
+
+def _truncated(path, yielded):
+    cache.record_truncated()
+    log.warning("Canvas listing %s truncated after %d pages (%d items)", path, MAX_PAGES, yielded)
+
+
+def format_assignment(a, course_id, course_name=None):
+    assignment = {
+        "id": a.get("id"),
+        "name": a.get("name", a.get("title", "Untitled")),
+        "due_at": a.get("due_at"),
+        "course_id": course_id,
+        "description": (a.get("description") or "")[:500],  # Increased to 500 chars for better context
+    }
+    if course_name is not None:
+        assignment["course_name"] = course_name
+    return assignment
+
+
+def format_courses(items):
+    return [
+        {"id": c["id"], "name": c["name"], "code": c.get("course_code", "")}
+        for c in items
+        if isinstance(c, dict) and "name" in c
+    ]
+
+
+def due_date_order(assignment):
+    """Sort key: soonest due first, undated assignments last."""
+    return (assignment["due_at"] is None, assignment["due_at"] or "")
+
+
+def _fetch_course_assignments(sess, course_id, course_name, deadline):
+    limit = host_limit(sess["canvas_url"])
+    if not limit.acquire(timeout=max(0, deadline - time.monotonic())):
+        raise CanvasFetchError("timed out waiting for a Canvas connection")
+    try:
+        timeout = min(REQUEST_TIMEOUT, max(0.1, deadline - time.monotonic()))
+        return [
+            format_assignment(a, course_id, course_name)
+            for a in iter_items(
+                sess,
+                f"/api/v1/courses/{course_id}/assignments",
+                {"order_by": "due_at"},
+                ttl=ASSIGNMENTS_TTL,
+                timeout=timeout
+            )
+            if isinstance(a, dict)
+        ]
+    finally:
+        limit.release()
+
+
+def iter_course_assignments(sess, courses, deadline_seconds=FANOUT_DEADLINE):
+    """Fetch assignments for every course concurrently, yielding per course as each finishes.
+
+    Yields ("assignments", [..]) or ("error", {"course_id", "course_name", "error"}).
+    """
+    deadline = time.monotonic() + deadline_seconds
+    futures = {}
+    for course in courses:
+        if not isinstance(course, dict) or "id" not in course:
+            continue
+        cid = course["id"]
+        cname = course.get("name", "Unknown Course")
+        future = _executor.submit(_fetch_course_assignments, sess, cid, cname, deadline)
+        futures[future] = (cid, cname)
+
+    finished = set()
+    try:
+        for future in as_completed(futures, timeout=max(0, deadline - time.monotonic())):
+            finished.add(future)
+            cid, cname = futures[future]
+            try:
+                yield "assignments", future.result()
+            except requests.exceptions.Timeout:
+                yield "error", {"course_id": cid, "course_name": cname, "error": "timed out"}
+            except (CanvasFetchError, requests.exceptions.RequestException, ValueError) as e:
+                yield "error", {"course_id": cid, "course_name": cname, "error": str(e)}
+    except FuturesTimeout:
+        pass
+
+    for future, (cid, cname) in futures.items():
+        if future not in finished:
+            future.cancel()
+            yield "error", {"course_id": cid, "course_name": cname, "error": "timed out"}
+
+
+async def _fetch_course_assignments_async(sess, course_id, course_name, deadline):
+    limit = async_host_limit(sess["canvas_url"])
+    try:
+        await asyncio.wait_for(limit.acquire(), timeout=max(0, deadline - time.monotonic()))
+    except asyncio.TimeoutError:
+        raise CanvasFetchError("timed out waiting for a Canvas connection")
+    try:
+        timeout = min(REQUEST_TIMEOUT, max(0.1, deadline - time.monotonic()))
+        return [
+            format_assignment(a, course_id, course_name)
+            async for a in aiter_items(
+                sess,
+                f"/api/v1/courses/{course_id}/assignments",
+                {"order_by": "due_at"},
+                ttl=ASSIGNMENTS_TTL,
+                timeout=timeout
+            )
+            if isinstance(a, dict)
+        ]
+    finally:
+        limit.release()
+
+
+async def iter_course_assignments_async(sess, courses, deadline_seconds=FANOUT_DEADLINE):
+    """iter_course_assignments for the async server: one task per course instead of a pool thread."""
+    deadline = time.monotonic() + deadline_seconds
+    tasks = {}
+    for course in courses:
+        if not isinstance(course, dict) or "id" not in course:
+            continue
+        cid = course["id"]
+        cname = course.get("name", "Unknown Course")
+        task = asyncio.ensure_future(_fetch_course_assignments_async(sess, cid, cname, deadline))
+        tasks[task] = (cid, cname)
+
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, timeout=max(0, deadline - time.monotonic()), return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                break
+            for task in done:
+                cid, cname = tasks[task]
+                try:
+                    yield "assignments", task.result()
+                except httpx.TimeoutException:
+                    yield "error", {"course_id": cid, "course_name": cname, "error": "timed out"}
+                except (CanvasFetchError, httpx.HTTPError, ValueError) as e:
+                    yield "error", {"course_id": cid, "course_name": cname, "error": str(e)}
+    finally:
+        for task in pending:
+            task.cancel()
+
+    for task in pending:
+        cid, cname = tasks[task]
+        yield "error", {"course_id": cid, "course_name": cname, "error": "timed out"}
+
+
+def fetch_assignments_for_courses(sess, courses, deadline_seconds=FANOUT_DEADLINE):
+    """Fetch assignments for every course concurrently.
+
+    Returns (assignments sorted by due date, per-course errors).
+    """
+    assignments = []
+    errors = []
+    for kind, payload in iter_course_assignments(sess, courses, deadline_seconds):
+        if kind == "assignments":
+            assignments.extend(payload)
+        else:
+            errors.append(payload)
+
+    assignments.sort(key=due_date_order)
+    return assignments, errors
+
+
+async def fetch_assignments_for_courses_async(sess, courses, deadline_seconds=FANOUT_DEADLINE):
+    """fetch_assignments_for_courses for the async server."""
+    assignments = []
+    errors = []
+    async for kind, payload in iter_course_assignments_async(sess, courses, deadline_seconds):
+        if kind == "assignments":
+            assignments.extend(payload)
+        else:
+            errors.append(payload)
+
+    assignments.sort(key=due_date_order)
+    return assignments, errors
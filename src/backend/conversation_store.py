@@ -0,0 +1,216 @@
+"""
+Jarvis conversation history stores.
+
+Each session keeps a ring buffer of its last JARVIS_HISTORY_MESSAGES
+messages. Sessions idle for longer than JARVIS_SESSION_TTL seconds are
+dropped, and the least recently used sessions are evicted once there are
+more than JARVIS_MAX_SESSIONS.
+
+JARVIS_STORE=memory (default) keeps history in this process;
+JARVIS_STORE=sqlite keeps it in the app database so it survives restarts
+and is shared between worker processes. There each message's seq is
+computed inside its INSERT, so it is read under the write lock and
+concurrent turns for one session can't pick the same seq, and the idle
+and LRU sweep runs at most every EVICT_INTERVAL seconds per process.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+
+from db import get_db
+
+STORE_KIND = os.environ.get("JARVIS_STORE", "memory")
+HISTORY_MESSAGES = int(os.environ.get("JARVIS_HISTORY_MESSAGES", "20"))
+MAX_SESSIONS = int(os.environ.get("JARVIS_MAX_SESSIONS", "1000"))
+SESSION_TTL = float(os.environ.get("JARVIS_SESSION_TTL", "3600"))
+EVICT_INTERVAL = 60  # Seconds between SQLite eviction sweeps
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS jarvis_messages (
+        session_id TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        role TEXT NOT NULL,
+        content TEXT NOT NULL,
+        PRIMARY KEY (session_id, seq)
+    ) WITHOUT ROWID;
+
+    CREATE TABLE IF NOT EXISTS jarvis_conversations (
+        session_id TEXT PRIMARY KEY,
+        last_active REAL NOT NULL,
+        next_seq INTEGER NOT NULL DEFAULT 0
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_jarvis_conversations_last_active
+        ON jarvis_conversations(last_active);
+"""
+
+
+def _message_bytes(msg):
+    return sys.getsizeof(msg["content"]) + sys.getsizeof(msg["role"])
+
+
+class MemoryConversationStore:
+    def __init__(self, max_sessions=MAX_SESSIONS, ttl=SESSION_TTL, max_messages=HISTORY_MESSAGES):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_messages = max_messages
+        self._sessions = OrderedDict()  # session_id -> (last_active, deque of messages)
+        self._lock = threading.Lock()
+        self._evicted_lru = 0
+        self._evicted_idle = 0
+
+    def get(self, session_id):
+        with self._lock:
+            self._expire(time.monotonic())
+            entry = self._sessions.get(session_id)
+            return list(entry[1]) if entry else []
+
+    def append(self, session_id, *messages):
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            entry = self._sessions.pop(session_id, None)
+            history = entry[1] if entry else deque(maxlen=self.max_messages)
+            history.extend(messages)
+            self._sessions[session_id] = (now, history)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self._evicted_lru += 1
+
+    def reset(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def _expire(self, now):
+        # Oldest-first order means we can stop at the first live session
+        while self._sessions:
+            session_id, (last_active, _) = next(iter(self._sessions.items()))
+            if now - last_active < self.ttl:
+                break
+            del self._sessions[session_id]
+            self._evicted_idle += 1
+
+    def stats(self):
+        with self._lock:
+            messages = sum(len(h) for _, h in self._sessions.values())
+            approx_bytes = sum(_message_bytes(m) for _, h in self._sessions.values() for m in h)
+            return {
+                "store": "memory",
+                "sessions": len(self._sessions),
+                "messages": messages,
+                "approx_bytes": approx_bytes,
+                "evicted_lru": self._evicted_lru,
+                "evicted_idle": self._evicted_idle,
+            }
+
+
+class SQLiteConversationStore:
+    APPEND_SQL = """
+        INSERT INTO jarvis_messages (session_id, seq, role, content)
+        SELECT ?, COALESCE(MAX(seq), -1) + 1, ?, ?
+        FROM jarvis_messages WHERE session_id = ?
+    """
+
+    def __init__(self, max_sessions=MAX_SESSIONS, ttl=SESSION_TTL, max_messages=HISTORY_MESSAGES):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_messages = max_messages
+        self._evict_lock = threading.Lock()
+        self._last_evict = 0.0
+
+    def get(self, session_id):
+        db = get_db()
+        try:
+            row = db.execute(
+                "SELECT last_active FROM jarvis_conversations WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            if not row or time.time() - row["last_active"] >= self.ttl:
+                return []
+            rows = db.execute(
+                """SELECT role, content FROM jarvis_messages WHERE session_id = ?
+                   ORDER BY seq DESC LIMIT ?""",
+                (session_id, self.max_messages)
+            ).fetchall()
+            return [{"role": r["role"], "content": r["content"]} for r in reversed(rows)]
+        finally:
+            db.close()
+
+    def append(self, session_id, *messages):
+        now = time.time()
+        db = get_db()
+        try:
+            db.executemany(
+                self.APPEND_SQL,
+                [(session_id, m["role"], m["content"], session_id) for m in messages]
+            )
+            db.execute(
+                """INSERT INTO jarvis_conversations (session_id, last_active, next_seq)
+                   SELECT ?, ?, COALESCE(MAX(seq), -1) + 1 FROM jarvis_messages WHERE session_id = ?
+                   ON CONFLICT(session_id) DO UPDATE SET last_active = excluded.last_active, next_seq = excluded.next_seq""",
+                (session_id, now, session_id)
+            )
+            # Ring buffer: keep only the last max_messages rows
+            db.execute(
+                """DELETE FROM jarvis_messages WHERE session_id = ? AND seq < (
+                       SELECT next_seq FROM jarvis_conversations WHERE session_id = ?
+                   ) - ?""",
+                (session_id, session_id, self.max_messages)
+            )
+            if self._evict_due():
+                self._evict(db, now)
+            db.commit()
+        finally:
+            db.close()
+
+    def reset(self, session_id):
+        db = get_db()
+        try:
+            db.execute("DELETE FROM jarvis_messages WHERE session_id = ?", (session_id,))
+            db.execute("DELETE FROM jarvis_conversations WHERE session_id = ?", (session_id,))
+            db.commit()
+        finally:
+            db.close()
+
+    def _evict_due(self):
+        now = time.monotonic()
+        with self._evict_lock:
+            if now - self._last_evict < EVICT_INTERVAL:
+                return False
+            self._last_evict = now
+            return True
+
+    def _evict(self, db, now):
+        doomed = [r["session_id"] for r in db.execute(
+            """SELECT session_id FROM jarvis_conversations WHERE last_active < ?
+               UNION
+               SELECT session_id FROM (
+                   SELECT session_id FROM jarvis_conversations
+                   ORDER BY last_active DESC LIMIT -1 OFFSET ?
+               )""",
+            (now - self.ttl, self.max_sessions)
+        ).fetchall()]
+        for session_id in doomed:
+            db.execute("DELETE FROM jarvis_messages WHERE session_id = ?", (session_id,))
+            db.execute("DELETE FROM jarvis_conversations WHERE session_id = ?", (session_id,))
+
+    def stats(self):
+        db = get_db()
+        try:
+            row = db.execute(
+                """SELECT (SELECT COUNT(*) FROM jarvis_conversations) AS sessions,
+                          COUNT(*) AS messages,
+                          COALESCE(SUM(LENGTH(content)), 0) AS approx_bytes
+                   FROM jarvis_messages"""
+            ).fetchone()
+            return {"store": "sqlite", **dict(row)}
+        finally:
+            db.close()
+
+
+def create_store(kind=STORE_KIND):
+    if kind == "sqlite":
+        return SQLiteConversationStore()
+    return MemoryConversationStore()
@@ -0,0 +1,211 @@
+"""
+VoiceQuest SQLite connection pool
+=================================
+Connections are opened once, tuned with WAL journaling and the PRAGMAs
+below, and handed out per request. Routes keep calling get_db() and
+db.close() exactly as before: inside a Flask request the connection is
+shared through `g` and returned to the pool on teardown. A route that
+is about to wait on an upstream service (OpenAI, ElevenLabs, Canvas)
+commits and calls release_db() first, so slow calls don't pin
+connections that plain reads need; a later get_db() checks out a fresh
+one. When no connection frees up in time the app answers 503.
+
+Tuning (environment variables):
+  DB_POOL_SIZE=8              max open connections
+  DB_POOL_TIMEOUT=10          seconds to wait for a free connection
+  DB_BUSY_TIMEOUT_MS=5000     SQLite busy_timeout
+  DB_SYNCHRONOUS=NORMAL       SQLite synchronous (NORMAL is safe under WAL)
+  DB_CACHE_SIZE_KB=16384      page cache per connection
+  DB_MMAP_SIZE=134217728      memory-mapped I/O size in bytes
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from queue import LifoQueue, Empty
+
+from flask import g, has_app_context
+
+POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "8"))
+POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "10"))
+BUSY_TIMEOUT_MS = int(os.environ.get("DB_BUSY_TIMEOUT_MS", "5000"))
+SYNCHRONOUS = os.environ.get("DB_SYNCHRONOUS", "NORMAL")
+CACHE_SIZE_KB = int(os.environ.get("DB_CACHE_SIZE_KB", "16384"))
+MMAP_SIZE = int(os.environ.get("DB_MMAP_SIZE", str(128 * 1024 * 1024)))
+
+
+class PoolExhausted(Exception):
+    """Raised when no connection frees up within DB_POOL_TIMEOUT."""
+
+    retry_after = 1
+
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3 connection whose close() hands it back to its pool."""
+
+    pool = None
+    request_scoped = False
+    checked_out = False  # Guarded by the pool's lock
+
+    def close(self):
+        if self.request_scoped:
+            return  # Released by the request teardown
+        if self.pool is not None:
+            self.pool.release(self)
+        else:
+            super().close()
+
+    def really_close(self):
+        super().close()
+
+
+class ConnectionPool:
+    def __init__(self, database, size=POOL_SIZE, timeout=POOL_TIMEOUT):
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self._idle = LifoQueue()
+        self._lock = threading.Lock()
+        self._opened = 0
+        self._in_use = 0
+        self._checkouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._timeouts = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.database,
+            factory=PooledConnection,
+            timeout=BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={SYNCHRONOUS}")
+        conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.pool = self
+        return conn
+
+    def acquire(self):
+        start = time.monotonic()
+        conn = None
+        try:
+            conn = self._idle.get_nowait()
+        except Empty:
+            with self._lock:
+                can_open = self._opened < self.size
+                if can_open:
+                    self._opened += 1
+            if can_open:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._opened -= 1
+                    raise
+            else:
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except Empty:
+                    with self._lock:
+                        self._timeouts += 1
+                    raise PoolExhausted(
+                        f"No database connection available after {self.timeout}s"
+                    )
+
+        waited = time.monotonic() - start
+        with self._lock:
+            conn.checked_out = True
+            self._in_use += 1
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        conn.request_scoped = False
+        return conn
+
+    def release(self, conn):
+        """Return a checked-out connection; releasing it again is a no-op."""
+        with self._lock:
+            if not conn.checked_out:
+                return  # Already idle; queueing it twice would hand it to two callers
+            conn.checked_out = False
+            self._in_use -= 1
+        if conn.in_transaction:
+            conn.rollback()  # Never hand out a connection mid-transaction
+        self._idle.put(conn)
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except Empty:
+                break
+            conn.really_close()
+            with self._lock:
+                self._opened -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": self.size,
+                "open": self._opened,
+                "in_use": self._in_use,
+                "idle": self._opened - self._in_use,
+                "checkouts": self._checkouts,
+                "wait_seconds_total": round(self._wait_total, 4),
+                "wait_seconds_avg": round(self._wait_total / self._checkouts, 6) if self._checkouts else 0,
+                "wait_seconds_max": round(self._wait_max, 4),
+                "timeouts": self._timeouts,
+            }
+
+
+_pool = None
+
+
+def init_pool(database):
+    global _pool
+    if _pool is not None:
+        _pool.close_all()
+    _pool = ConnectionPool(database)
+    return _pool
+
+
+def get_pool():
+    return _pool
+
+
+def get_db():
+    """Return a pooled connection; request-scoped when called inside Flask."""
+    if not has_app_context():
+        return _pool.acquire()
+    conn = g.get("_db")
+    if conn is None:
+        conn = _pool.acquire()
+        conn.request_scoped = True
+        g._db = conn
+    return conn
+
+
+def release_db(exc=None):
+    """Return the request's connection to the pool (also the teardown hook).
+
+    Uncommitted work is rolled back, so commit before calling it mid-request.
+    Outside a Flask request there is nothing to release; such callers
+    close() the connection they checked out.
+    """
+    if not has_app_context():
+        return
+    conn = g.pop("_db", None)
+    if conn is not None:
+        conn.request_scoped = False
+        _pool.release(conn)
+
+
+def init_app(app, database):
+    init_pool(database)
+    app.teardown_appcontext(release_db)
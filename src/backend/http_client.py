@@ -0,0 +1,219 @@
+"""
+Shared outbound HTTP client.
+
+One keep-alive requests.Session per upstream host, each with its own
+connection pool, so ElevenLabs and Canvas calls reuse TCP+TLS
+connections instead of opening a new one per request. 429 and 5xx
+responses (and connection errors) are retried with jittered exponential
+backoff, honoring Retry-After when the upstream sends one.
+
+The async server (asgi.py) uses arequest()/aget()/apost() instead: the
+same timeouts, retries and counters on one shared httpx.AsyncClient, so
+waiting on ElevenLabs or Canvas doesn't hold a worker thread.
+
+Tuning (environment variables):
+  HTTP_POOL_SIZE=10          connections kept per host
+  HTTP_MAX_RETRIES=2         retries after the first attempt
+  HTTP_BACKOFF_BASE=0.5      first backoff in seconds (doubles per retry)
+  HTTP_BACKOFF_MAX=8         cap for a single backoff / Retry-After wait
+  HTTP_TIMEOUT=10            default timeout; override per host with
+  HTTP_TIMEOUT_<HOST>=15     e.g. HTTP_TIMEOUT_API_ELEVENLABS_IO=15
+"""
+
+import asyncio
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", "10"))
+MAX_RETRIES = int(os.environ.get("HTTP_MAX_RETRIES", "2"))
+BACKOFF_BASE = float(os.environ.get("HTTP_BACKOFF_BASE", "0.5"))
+BACKOFF_MAX = float(os.environ.get("HTTP_BACKOFF_MAX", "8"))
+DEFAULT_TIMEOUT = float(os.environ.get("HTTP_TIMEOUT", "10"))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Per-host defaults; HTTP_TIMEOUT_<HOST> still wins
+HOST_TIMEOUTS = {
+    "api.elevenlabs.io": 15,
+}
+
+_sessions = {}
+_lock = threading.Lock()
+_counters = {}
+_async_client = None
+
+
+def _host(url):
+    return urlsplit(url).netloc.lower()
+
+
+def host_timeout(host):
+    hostname = host.split(":")[0]
+    env_name = "HTTP_TIMEOUT_" + "".join(c if c.isalnum() else "_" for c in hostname).upper()
+    return float(os.environ.get(env_name, HOST_TIMEOUTS.get(hostname, DEFAULT_TIMEOUT)))
+
+
+def session_for(url):
+    host = _host(url)
+    with _lock:
+        sess = _sessions.get(host)
+        if sess is None:
+            sess = requests.Session()
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=POOL_SIZE)
+            sess.mount("https://", adapter)
+            sess.mount("http://", adapter)
+            _sessions[host] = sess
+        _counters.setdefault(host, {"requests": 0, "retries": 0, "failures": 0})
+        return sess
+
+
+def _retry_after(resp):
+    value = resp.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _backoff(attempt, resp=None):
+    wait = _retry_after(resp) if resp is not None else None
+    if wait is None:
+        # Full jitter keeps a burst of clients from retrying in lockstep
+        wait = random.uniform(0, BACKOFF_BASE * (2 ** attempt))
+    return min(wait, BACKOFF_MAX)
+
+
+def request(method, url, retries=MAX_RETRIES, **kwargs):
+    """requests.request() through the pooled session for url's host, with retries."""
+    host = _host(url)
+    sess = session_for(url)
+    kwargs.setdefault("timeout", host_timeout(host))
+    counters = _counters[host]
+
+    attempt = 0
+    while True:
+        with _lock:
+            counters["requests"] += 1
+        try:
+            resp = sess.request(method, url, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if attempt >= retries:
+                with _lock:
+                    counters["failures"] += 1
+                raise
+            delay = _backoff(attempt)
+        else:
+            if resp.status_code not in RETRY_STATUSES or attempt >= retries:
+                return resp
+            delay = _backoff(attempt, resp)
+            resp.close()
+
+        attempt += 1
+        with _lock:
+            counters["retries"] += 1
+        time.sleep(delay)
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+# --- Async client ---
+def async_client():
+    """The shared httpx.AsyncClient, created on first use inside the event loop."""
+    global _async_client
+    if _async_client is None:
+        _async_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_keepalive_connections=POOL_SIZE),
+            timeout=DEFAULT_TIMEOUT
+        )
+    return _async_client
+
+
+async def arequest(method, url, retries=MAX_RETRIES, stream=False, **kwargs):
+    """request() on the shared httpx.AsyncClient.
+
+    With stream=True the body is left unread: iterate it with
+    resp.aiter_bytes() and call resp.aclose() when done.
+    """
+    host = _host(url)
+    client = async_client()
+    kwargs.setdefault("timeout", host_timeout(host))
+    with _lock:
+        counters = _counters.setdefault(host, {"requests": 0, "retries": 0, "failures": 0})
+
+    attempt = 0
+    while True:
+        with _lock:
+            counters["requests"] += 1
+        try:
+            resp = await client.send(client.build_request(method, url, **kwargs), stream=stream)
+        except (httpx.ConnectError, httpx.TimeoutException):
+            if attempt >= retries:
+                with _lock:
+                    counters["failures"] += 1
+                raise
+            delay = _backoff(attempt)
+        else:
+            if resp.status_code not in RETRY_STATUSES or attempt >= retries:
+                return resp
+            delay = _backoff(attempt, resp)
+            await resp.aclose()
+
+        attempt += 1
+        with _lock:
+            counters["retries"] += 1
+        await asyncio.sleep(delay)
+
+
+async def aget(url, **kwargs):
+    return await arequest("GET", url, **kwargs)
+
+
+async def apost(url, **kwargs):
+    return await arequest("POST", url, **kwargs)
+
+
+async def aclose():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+
+def stats():
+    with _lock:
+        hosts = {}
+        for host, counters in _counters.items():
+            opened = served = 0
+            sess = _sessions.get(host)
+            for adapter in set(sess.adapters.values()) if sess else ():
+                for key in adapter.poolmanager.pools.keys():
+                    pool = adapter.poolmanager.pools.get(key)
+                    if pool is not None:
+                        opened += pool.num_connections
+                        served += pool.num_requests
+            hosts[host] = {
+                **counters,
+                "connections_opened": opened,
+                "connections_reused": max(0, served - opened),
+            }
+        return hosts
@@ -0,0 +1,112 @@
+"""
+Benchmark corpus for the local intent engine (`flask bench-intents`).
+
+Each case is (transcript, expected intent, expected target). Transcripts
+the grammar should leave to the model expect intent None; answering them
+locally counts as a miss.
+"""
+
+import time
+
+from intents import JARVIS_INTENTS, match_command, engine
+
+QUESTS = [
+    {"id": 1, "title": "Solar System Explorer", "topic": "science"},
+    {"id": 2, "title": "Ancient Civilizations", "topic": "history"},
+    {"id": 3, "title": "Fraction Frenzy", "topic": "math"},
+    {"id": 4, "title": "Word Wizard", "topic": "english"},
+    {"id": 5, "title": "Human Body Basics", "topic": "science"},
+]
+
+CORPUS = [
+    ("go to my profile", "navigate", "/profile"),
+    ("Jarvis, take me home", "navigate", "/dashboard"),
+    ("open settings", "navigate", "/settings"),
+    ("show me the quest map", "navigate", "/quests"),
+    ("take me to my achievements", "navigate", "/profile"),
+    ("go back to the dashboard please", "navigate", "/dashboard"),
+    ("Jarvis, can you open my stats", "navigate", "/profile"),
+    ("preferences", "navigate", "/settings"),
+    ("start quest one", "start_quest", 1),
+    ("Jarvis start quest won", "start_quest", 1),
+    ("start the second quest", "start_quest", 2),
+    ("the third one", "start_quest", 3),
+    ("quest number four", "start_quest", 4),
+    ("play the last quest", "start_quest", 5),
+    ("start Fraction Frenzy", "start_quest", 3),
+    ("first", "start_quest", 1),
+    ("show me science quests", "filter", "science"),
+    ("filter by history", "filter", "history"),
+    ("only show math", "filter", "math"),
+    ("show all quests", "filter", "all"),
+    ("log out", "logout", "/"),
+    ("Jarvis, sign me out", "logout", "/"),
+    ("Hello Jarvis, my name is Pratham", "login", "Pratham"),
+    ("call me Alex", "login", "Alex"),
+    ("you can call me Sam", "login", "Sam"),
+    ("what can I do", "help", "help"),
+    ("help", "help", "help"),
+    # Left to the model
+    ("I'm ready", None, None),
+    ("I'm Jordan", None, None),
+    ("this is hard", None, None),
+    ("I'm excited", None, None),
+    ("I'm happy", None, None),
+    ("it's working", None, None),
+    ("I am twelve", None, None),
+    ("its cool", None, None),
+    ("i'm jarvis", None, None),
+    ("my name is not important", None, None),
+    ("call me maybe", None, None),
+    ("call me later", None, None),
+    ("help me study for my calculus test on integrals", None, None),
+    ("quiz me on the French Revolution", None, None),
+    ("I want to learn about space", None, None),
+    ("what's the capital of France", None, None),
+    ("how am I doing this week", None, None),
+    ("tell me a joke", None, None),
+]
+
+
+def _percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def run(classify, corpus=CORPUS, rounds=1):
+    """Score `classify(transcript) -> intent dict or None` over the corpus.
+
+    Returns accuracy, p50/p99 latency in ms and the misclassified cases.
+    """
+    latencies = []
+    misses = []
+    correct = 0
+    for _ in range(rounds):
+        for transcript, intent, target in corpus:
+            started = time.perf_counter()
+            result = classify(transcript)
+            latencies.append((time.perf_counter() - started) * 1000)
+            got = (result.get("intent"), result.get("target")) if result else (None, None)
+            if intent is None:
+                ok = result is None
+            else:
+                ok = got[0] == intent and str(got[1]).lower() == str(target).lower()
+            if ok:
+                correct += 1
+            elif len(misses) < len(corpus):
+                misses.append((transcript, (intent, target), got))
+    total = len(corpus) * rounds
+    return {
+        "cases": total,
+        "accuracy": round(correct / total, 3),
+        "p50_ms": round(_percentile(latencies, 50), 3),
+        "p99_ms": round(_percentile(latencies, 99), 3),
+        "misses": misses,
+    }
+
+
+def local_classifier(quests=QUESTS):
+    def classify(transcript):
+        result = match_command(transcript, quests, JARVIS_INTENTS, logged_in=False)
+        return result if result and result["confidence"] >= engine.min_confidence else None
+    return classify
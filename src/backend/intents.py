@@ -0,0 +1,327 @@
+"""
+Local intent engine for /api/voice/command and /api/jarvis/chat.
+
+Deterministic commands (navigation, logout, topic filters, "my name is
+X", "start quest one", help) are matched by a compiled grammar in this
+process. Both routes consult it before calling the model and get the
+same JSON shape back: intent, target, message, confidence. Matches
+below INTENT_MIN_CONFIDENCE fall through to the LLM.
+
+/api/voice/command additionally keeps an exact cache of earlier LLM
+answers (IntentCache), keyed on the normalized transcript plus a hash of
+the current page and quest list.
+
+Tuning (environment variables):
+  VOICE_INTENT_CACHE_SIZE=2048        cached LLM answers kept (LRU)
+  VOICE_INTENT_CACHE_TTL=86400        seconds an answer stays valid
+  INTENT_MIN_CONFIDENCE=0.8           local matches below this go to the LLM
+                                      (VOICE_INTENT_MIN_CONFIDENCE is still read)
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from difflib import SequenceMatcher
+
+CACHE_SIZE = int(os.environ.get("VOICE_INTENT_CACHE_SIZE", "2048"))
+CACHE_TTL = float(os.environ.get("VOICE_INTENT_CACHE_TTL", "86400"))
+MIN_CONFIDENCE = float(
+    os.environ.get("INTENT_MIN_CONFIDENCE") or os.environ.get("VOICE_INTENT_MIN_CONFIDENCE", "0.8")
+)
+
+VOICE_INTENTS = frozenset({"navigate", "start_quest", "filter", "help"})
+JARVIS_INTENTS = VOICE_INTENTS | {"login", "logout"}
+
+# --- Normalization ---
+WAKE_WORD = re.compile(r"^(?:(?:hey|hi|hello|ok|okay) )?jarvis\b[\s,]*")
+FILLER = re.compile(r"^(?:(?:please|can you|could you|would you|i want to|i wanna|i'd like to|let's|lets) )+")
+NON_WORD = re.compile(r"[^a-z0-9' ]+")
+
+
+def normalize(transcript):
+    """Lowercase, drop punctuation, the wake word and leading politeness."""
+    text = NON_WORD.sub(" ", (transcript or "").lower())
+    text = " ".join(text.split())
+    text = WAKE_WORD.sub("", text)
+    text = FILLER.sub("", text)
+    return text.removesuffix(" please").strip()
+
+
+def context_key(text, current_page, quests):
+    """Cache key for a normalized transcript in a given page/quest context."""
+    quest_sig = [(q.get("id"), q.get("title"), q.get("topic")) for q in quests or []]
+    payload = json.dumps([text, current_page, quest_sig], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# --- Numbers ---
+UNITS = {
+    "zero": 0, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7,
+    "eight": 8, "nine": 9, "ten": 10, "eleven": 11, "twelve": 12, "thirteen": 13,
+    "fourteen": 14, "fifteen": 15, "sixteen": 16, "seventeen": 17, "eighteen": 18, "nineteen": 19,
+}
+TENS = {"twenty": 20, "thirty": 30, "forty": 40, "fifty": 50, "sixty": 60, "seventy": 70, "eighty": 80, "ninety": 90}
+ORDINALS = {
+    "first": 1, "second": 2, "third": 3, "fourth": 4, "fifth": 5, "sixth": 6, "seventh": 7,
+    "eighth": 8, "ninth": 9, "tenth": 10, "eleventh": 11, "twelfth": 12, "thirteenth": 13,
+    "fourteenth": 14, "fifteenth": 15, "sixteenth": 16, "seventeenth": 17, "eighteenth": 18,
+    "nineteenth": 19, "twentieth": 20, "thirtieth": 30, "fortieth": 40, "fiftieth": 50,
+}
+# Speech-to-text often hears "quest one" as "quest won" / "quest to"
+HOMOPHONES = {"won": "one", "to": "two", "too": "two", "for": "four", "ate": "eight"}
+DIGIT_ORDINAL = re.compile(r"^(\d+)(?:st|nd|rd|th)?$")
+
+
+def parse_number(phrase, homophones=False):
+    """'one', 'first', '3', '3rd', 'twenty one', 'twenty first', 'last' -> int (-1 for last), or None."""
+    words = phrase.split()
+    if phrase == "last":
+        return -1
+    if len(words) == 1:
+        word = HOMOPHONES.get(words[0], words[0]) if homophones else words[0]
+        digits = DIGIT_ORDINAL.match(word)
+        if digits:
+            return int(digits.group(1))
+        return UNITS.get(word, ORDINALS.get(word, TENS.get(word)))
+    if len(words) == 2 and words[0] in TENS:
+        unit = UNITS.get(words[1]) or ORDINALS.get(words[1])
+        if unit and unit < 10:
+            return TENS[words[0]] + unit
+    return None
+
+
+# --- Grammar ---
+PAGES = {
+    "/dashboard": ("home", "dashboard", "home page", "main page", "start page"),
+    "/quests": ("quests", "quest map", "quest list", "map"),
+    "/profile": ("profile", "stats", "my stats", "achievements", "progress", "account"),
+    "/settings": ("settings", "preferences", "options"),
+}
+PAGE_NAMES = {"/dashboard": "the dashboard", "/quests": "the quest map", "/profile": "your profile", "/settings": "settings"}
+PAGE_ALIASES = {alias: route for route, aliases in PAGES.items() for alias in aliases}
+
+NAV_VERB = re.compile(
+    r"^(?:go(?: back)?(?: to)?|take me(?: back)?(?: to)?|bring me(?: back)?(?: to)?|navigate to|"
+    r"open(?: up)?|show(?: me)?|head(?: back)? to|switch to|back to|return to)\s+"
+)
+NAV_NOISE = re.compile(r"\b(?:my|the|me|page|screen|tab)\b")
+
+START_VERB = re.compile(r"^(?:start|begin|play|launch|do|pick|choose|select|open|take)\s+")
+NUMBER_PHRASE = r"[a-z0-9]+(?: [a-z]+)?"
+ORDINAL_QUEST = re.compile(
+    rf"^(?:the )?(?:quest (?:number )?(?P<a>{NUMBER_PHRASE})|(?P<b>{NUMBER_PHRASE}) quest|"
+    rf"number (?P<c>{NUMBER_PHRASE})|(?P<d>{NUMBER_PHRASE}) one)$"
+)
+
+HELP = re.compile(r"^(?:help|help me|what can (?:i|you) (?:do|say)|what are my options|commands)$")
+LOGOUT = re.compile(r"^(?:log ?out|log me out|sign ?out|sign me out|log off)$")
+LOGIN_EXPLICIT = re.compile(r"^(?:my name is|my name's|call me|you can call me) (?P<name>[a-z][a-z']*(?: [a-z][a-z']*)?)$")
+# "I'm <word>" / "this is <word>" is left to the model: "this is hard" or "I'm excited" is not a name.
+# Explicit phrasings still get the odd non-name ("call me maybe"), so any of these words rejects the match.
+NOT_NAMES = frozenset({
+    "ready", "done", "back", "here", "bored", "tired", "lost", "confused", "fine", "good", "okay",
+    "ok", "not", "sure", "finished", "stuck", "new", "hungry", "sorry", "me", "a", "an", "the",
+    "maybe", "later", "now", "soon", "crazy", "anything", "whatever", "nothing", "something",
+    "nobody", "someone", "important", "jarvis", "it", "that", "this", "what", "when", "if",
+})
+FILTER = re.compile(
+    r"^(?:filter(?: quests)? (?:by|to|for|on)|show(?: me)?(?: only)?|only show(?: me)?|just show(?: me)?|"
+    r"show me just)(?: the)? (?P<topic>[a-z ]+?)(?: quests| ones)?$"
+)
+
+
+def _intent(intent, target, message, confidence):
+    return {"intent": intent, "target": target, "message": message, "confidence": round(confidence, 2)}
+
+
+def _match_help(text, ctx):
+    if HELP.match(text):
+        return _intent("help", "help", "You can say things like 'go to my profile', 'show me quests' or 'start quest one'.", 0.95)
+    return None
+
+
+def _match_logout(text, ctx):
+    if LOGOUT.match(text):
+        return _intent("logout", "/", "Logging you out. See you next time!", 0.95)
+    return None
+
+
+def _match_login(text, ctx):
+    match = LOGIN_EXPLICIT.match(text)
+    if not match or any(word in NOT_NAMES for word in match.group("name").split()):
+        return None
+    name = match.group("name").title()
+    return _intent("login", name, f"Nice to meet you, {name}! Welcome to VoiceQuest.", 0.95)
+
+
+def _match_filter(text, ctx):
+    match = FILTER.match(text)
+    if not match:
+        return None
+    topic = match.group("topic").strip()
+    explicit = text.startswith("filter")
+    if topic in ("all", "everything", "all of them"):
+        return _intent("filter", "all", "Showing all quests.", 0.9)
+    if topic in ctx["topics"]:
+        return _intent("filter", topic, f"Showing {topic} quests.", 0.9)
+    if explicit and len(topic.split()) <= 2:
+        return _intent("filter", topic, f"Showing {topic} quests.", 0.85)
+    return None
+
+
+def _match_navigation(text, ctx):
+    verb = NAV_VERB.match(text)
+    rest = text[verb.end():] if verb else text
+    rest = " ".join(NAV_NOISE.sub(" ", rest).split())
+    if not rest:
+        return None
+    if rest in PAGE_ALIASES:
+        route, ratio = PAGE_ALIASES[rest], 1.0
+    else:
+        ratio, alias = max((SequenceMatcher(None, rest, a).ratio(), a) for a in PAGE_ALIASES)
+        route = PAGE_ALIASES[alias]
+    # A bare page name is less certain than "go to <page>"
+    confidence = ratio * (0.95 if verb else 0.85)
+    return _intent("navigate", route, f"Taking you to {PAGE_NAMES[route]}.", confidence)
+
+
+def _match_quest(text, ctx):
+    quests = ctx["quests"]
+    if not quests:
+        return None
+    verb = START_VERB.match(text)
+    rest = text[verb.end():] if verb else text
+
+    match = ORDINAL_QUEST.match(rest)
+    phrase = next((w for w in match.groups() if w), None) if match else rest
+    position = parse_number(phrase, homophones=bool(match)) if phrase else None
+    if position:
+        if position == -1:
+            position = len(quests)
+        if not 1 <= position <= len(quests):
+            return None
+        quest = quests[position - 1]
+        confidence = 0.95 if verb or match else 0.85
+        return _intent("start_quest", quest["id"], f"Starting {quest['title']}.", confidence)
+
+    if verb:
+        rest = rest.removeprefix("the ").removesuffix(" quest")
+        titled = [q for q in quests if normalize(q.get("title", "")) == rest]
+        if len(titled) == 1:
+            return _intent("start_quest", titled[0]["id"], f"Starting {titled[0]['title']}.", 0.9)
+    return None
+
+
+GRAMMAR = (
+    ("help", _match_help),
+    ("logout", _match_logout),
+    ("login", _match_login),
+    ("filter", _match_filter),
+    ("start_quest", _match_quest),
+    ("navigate", _match_navigation),
+)
+
+
+def match_command(transcript, quests=None, intents=VOICE_INTENTS, logged_in=True):
+    """Best local guess at a command's intent among `intents`, or None."""
+    text = normalize(transcript)
+    if not text:
+        return None
+    ctx = {
+        "quests": quests or [],
+        "topics": {(q.get("topic") or "").lower() for q in quests or []},
+        "logged_in": logged_in,
+    }
+    best = None
+    for intent, matcher in GRAMMAR:
+        if intent not in intents:
+            continue
+        result = matcher(text, ctx)
+        if result and (best is None or result["confidence"] > best["confidence"]):
+            best = result
+    return best
+
+
+# --- Engine ---
+class IntentEngine:
+    """Grammar fast path with per-route hit counters."""
+
+    def __init__(self, min_confidence=MIN_CONFIDENCE):
+        self.min_confidence = min_confidence
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def match(self, route, transcript, quests=None, intents=VOICE_INTENTS, logged_in=True):
+        """Return a confident local intent, or None if the caller should ask the LLM."""
+        result = match_command(transcript, quests, intents, logged_in)
+        confident = result is not None and result["confidence"] >= self.min_confidence
+        with self._lock:
+            counts = self._counts.setdefault(route, {"requests": 0, "local_hits": 0, "below_threshold": 0})
+            counts["requests"] += 1
+            if confident:
+                counts["local_hits"] += 1
+            elif result:
+                counts["below_threshold"] += 1
+        return result if confident else None
+
+    def stats(self):
+        with self._lock:
+            return {
+                route: {**c, "hit_rate": round(c["local_hits"] / c["requests"], 3) if c["requests"] else 0.0}
+                for route, c in self._counts.items()
+            }
+
+
+engine = IntentEngine()
+
+
+# --- Voice command cache ---
+class IntentCache:
+    def __init__(self, max_entries=CACHE_SIZE, ttl=CACHE_TTL, intent_engine=engine):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.engine = intent_engine
+        self._entries = OrderedDict()  # key -> (stored_at, intent), LRU order
+        self._lock = threading.Lock()
+        self._counts = {"requests": 0, "cache_hits": 0, "local_hits": 0, "llm_calls": 0}
+
+    def resolve(self, transcript, current_page, quests):
+        """Return (intent or None, cache key). None means the caller should ask the LLM."""
+        text = normalize(transcript)
+        key = context_key(text, current_page, quests)
+        now = time.monotonic()
+        with self._lock:
+            self._counts["requests"] += 1
+            entry = self._entries.get(key)
+            if entry and now - entry[0] < self.ttl:
+                self._entries.move_to_end(key)
+                self._counts["cache_hits"] += 1
+                return dict(entry[1]), key
+            if entry:
+                del self._entries[key]
+
+        local = self.engine.match("voice", text, quests, VOICE_INTENTS)
+        with self._lock:
+            self._counts["local_hits" if local else "llm_calls"] += 1
+        return local, key
+
+    def put(self, key, intent):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), dict(intent))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            requests = self._counts["requests"]
+            answered = self._counts["cache_hits"] + self._counts["local_hits"]
+            return {
+                "entries": len(self._entries),
+                **self._counts,
+                "hit_rate": round(answered / requests, 3) if requests else 0.0,
+            }
@@ -0,0 +1,180 @@
+"""
+Jarvis prompt assembly.
+
+The request is laid out so that everything that stays the same from one
+turn to the next comes first, which lets the provider's prompt cache
+reuse it:
+
+  1. the static system prompt (identical for every request)
+  2. the session history (grows by one exchange per turn)
+  3. a compact context message (page, login state, quests, Canvas data)
+  4. the new user message
+
+The context message is built in a fixed order and trimmed to
+JARVIS_CONTEXT_TOKENS (see tokens.py for how tokens are counted).
+Quests, courses and assignments that share words with the user's
+message are kept first.
+
+Tuning (environment variables):
+  JARVIS_CONTEXT_TOKENS=600       budget for the context message
+  JARVIS_MAX_ASSIGNMENTS=15       assignments considered at most
+"""
+
+import os
+import re
+import threading
+
+from canvas import due_date_order
+from tokens import TOKENIZER, count_tokens
+
+CONTEXT_TOKENS = int(os.environ.get("JARVIS_CONTEXT_TOKENS", "600"))
+MAX_ASSIGNMENTS = int(os.environ.get("JARVIS_MAX_ASSIGNMENTS", "15"))
+
+WORD = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset({
+    "the", "and", "for", "with", "about", "help", "study", "quiz", "jarvis", "want", "can",
+    "you", "please", "test", "exam", "prep", "start", "quest", "quests", "this", "that", "what",
+})
+
+
+def _keywords(text):
+    return {w for w in WORD.findall((text or "").lower()) if len(w) > 2 and w not in STOPWORDS}
+
+
+def _relevance(keywords, text):
+    """Number of message keywords that appear in `text`, allowing simple plural/stem variants."""
+    words = _keywords(text)
+    return sum(1 for k in keywords if any(w.startswith(k[:5]) or k.startswith(w[:5]) for w in words))
+
+
+def build_context(context, message, budget=CONTEXT_TOKENS):
+    """Return (context message, {section: tokens}, items trimmed)."""
+    current_page = context.get("current_page", "/")
+    quests = context.get("available_quests", []) or []
+    canvas_data = context.get("canvas_data", {}) or {}
+    courses = canvas_data.get("courses", []) or []
+    assignments = sorted(
+        (dict(a, due_at=a.get("due_at")) for a in canvas_data.get("assignments", []) or []),
+        key=due_date_order
+    )
+
+    header = [f"Current page: {current_page}"]
+    if context.get("user_logged_in", False):
+        header.append(f"User is logged in as: {context.get('user_name', '')}")
+    else:
+        header.append("User is NOT logged in yet. If they tell you their name, use the 'login' intent.")
+    header = "\n".join(header)
+
+    keywords = _keywords(message)
+    # (section, position, line, relevance); position keeps quest numbering and due-date order stable
+    candidates = [
+        ("quests", i, f"  #{i + 1} — ID: {q['id']}, Title: \"{q['title']}\", Topic: {q['topic']}",
+         _relevance(keywords, f"{q['title']} {q['topic']}"))
+        for i, q in enumerate(quests)
+    ] + [
+        ("courses", i, f"  - {c.get('name', 'Unknown')} (ID: {c.get('id')})",
+         _relevance(keywords, c.get("name", "")))
+        for i, c in enumerate(courses)
+    ] + [
+        ("assignments", i,
+         f"  - \"{a.get('name', 'Untitled')}\" (Course: {a.get('course_name', 'Unknown')}, Due: {a['due_at'] or 'No due date'})",
+         _relevance(keywords, f"{a.get('name', '')} {a.get('course_name', '')}"))
+        for i, a in enumerate(assignments)
+    ]
+    titles = {
+        "quests": "Available quests:",
+        "courses": "Canvas LMS courses (user's real school courses):",
+        "assignments": "Canvas LMS assignments (user's real school assignments):",
+    }
+    totals = {"quests": len(quests), "courses": len(courses), "assignments": len(assignments)}
+    section_order = {"quests": 0, "courses": 1, "assignments": 2}
+    assignments_seen = 0
+    kept = {section: [] for section in section_order}
+    # Reserve room for each section's title and its "more not shown" line
+    remaining = budget - count_tokens(header) - sum(
+        count_tokens(titles[s]) + count_tokens(f"  ({totals[s]} more not shown)") + 2 for s in titles if totals[s]
+    )
+    trimmed = 0
+    # Most relevant first; ties go to quests, then courses, then soonest-due assignments
+    for section, position, line, score in sorted(candidates, key=lambda c: (-c[3], section_order[c[0]], c[1])):
+        if section == "assignments":
+            assignments_seen += 1
+            if assignments_seen > MAX_ASSIGNMENTS:
+                trimmed += 1
+                continue
+        cost = count_tokens(line) + 1
+        if cost > remaining:
+            trimmed += 1
+            continue
+        remaining -= cost
+        kept[section].append((position, line))
+
+    parts = [header]
+    tokens = {"header": count_tokens(header)}
+    for section in section_order:
+        if not kept[section]:
+            continue
+        lines = [line for _, line in sorted(kept[section])]
+        hidden = totals[section] - len(lines)
+        if hidden:
+            lines.append(f"  ({hidden} more not shown)")
+        block = titles[section] + "\n" + "\n".join(lines)
+        parts.append(block)
+        tokens[section] = count_tokens(block)
+
+    return "Current context:\n" + "\n".join(parts), tokens, trimmed
+
+
+def build_messages(system_prompt, history, context, message, budget=CONTEXT_TOKENS):
+    """Return (OpenAI messages, {section: tokens}, items trimmed)."""
+    context_message, tokens, trimmed = build_context(context, message, budget)
+    tokens = {
+        "system": count_tokens(system_prompt),
+        "history": sum(count_tokens(m["content"]) for m in history),
+        **tokens,
+        "user": count_tokens(message),
+    }
+    messages = [{"role": "system", "content": system_prompt}]
+    messages.extend(history)
+    messages.append({"role": "system", "content": context_message})
+    messages.append({"role": "user", "content": message})
+    return messages, tokens, trimmed
+
+
+class PromptStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._sections = {}
+        self._max_estimated = 0
+        self._trimmed = 0
+        self._prompt_tokens = 0
+        self._cached_tokens = 0
+
+    def record(self, tokens, trimmed, usage=None):
+        """Record estimated section sizes and, if given, the provider's usage block."""
+        estimated = sum(tokens.values())
+        with self._lock:
+            self._requests += 1
+            for section, count in tokens.items():
+                self._sections[section] = self._sections.get(section, 0) + count
+            self._max_estimated = max(self._max_estimated, estimated)
+            self._trimmed += trimmed
+            if usage is not None:
+                self._prompt_tokens += getattr(usage, "prompt_tokens", 0) or 0
+                details = getattr(usage, "prompt_tokens_details", None)
+                self._cached_tokens += getattr(details, "cached_tokens", 0) or 0
+
+    def stats(self):
+        with self._lock:
+            requests = self._requests or 1
+            return {
+                "requests": self._requests,
+                "tokenizer": TOKENIZER,
+                "avg_estimated_tokens": {s: round(c / requests, 1) for s, c in self._sections.items()},
+                "max_estimated_tokens": self._max_estimated,
+                "items_trimmed": self._trimmed,
+                "prompt_tokens": self._prompt_tokens,
+                "cached_prompt_tokens": self._cached_tokens,
+                "avg_prompt_tokens": round(self._prompt_tokens / requests, 1),
+            }
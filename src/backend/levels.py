@@ -0,0 +1,59 @@
+"""
+Level curves.
+
+A curve precomputes cumulative XP thresholds once (thresholds[i] is the
+total XP needed to reach level i + 1) and answers level lookups with a
+binary search instead of replaying the curve from level 1.
+"""
+
+from array import array
+from bisect import bisect_right
+
+
+class LevelCurve:
+    def __init__(self, first_step, next_step, precompute_levels=100):
+        """`next_step(step)` returns the XP needed for the level after one costing `step`."""
+        self.next_step = next_step
+        self.thresholds = array("q", [0])
+        self._step = first_step
+        self._extend(precompute_levels)
+
+    def _extend(self, levels):
+        for _ in range(levels):
+            self.thresholds.append(self.thresholds[-1] + self._step)
+            self._step = self.next_step(self._step)
+
+    def level_info(self, xp):
+        """Return (level, xp into the current level, xp still needed for the next)."""
+        while self.thresholds[-1] <= xp:
+            self._extend(1)
+        level = bisect_right(self.thresholds, xp)
+        return level, xp - self.thresholds[level - 1], self.thresholds[level] - xp
+
+    def level(self, xp):
+        return self.level_info(xp)[0]
+
+    def xp_to_next(self, xp):
+        return self.level_info(xp)[2]
+
+    def levels_for(self, xps):
+        """Batch form of level_info for leaderboards and backfills."""
+        if xps:
+            top = max(xps)
+            while self.thresholds[-1] <= top:
+                self._extend(1)
+        return [self.level_info(xp) for xp in xps]
+
+
+def geometric_curve(first_step=100, growth=1.2):
+    """Each level costs `growth` times the previous one (rounded down)."""
+    return LevelCurve(first_step, lambda step: int(step * growth))
+
+
+def linear_curve(first_step=100, increment=50):
+    """Each level costs a fixed `increment` more than the previous one."""
+    return LevelCurve(first_step, lambda step: step + increment)
+
+
+# The curve VoiceQuest has always used: 100 XP, then +20% per level
+DEFAULT_CURVE = geometric_curve(100, 1.2)
@@ -0,0 +1,260 @@
+"""
+Structured output parsing for model replies.
+
+Every route that asks the model for JSON parses the reply here.
+JsonScanner finds the first complete top-level object by counting braces
+outside of strings, so nested objects and braces inside string values
+are handled. Because it only needs the characters seen so far, the same
+scanner works on a whole completion or on stream deltas as they arrive.
+Each route declares a Schema. parse() validates and coerces the object,
+and ParseStats counts how each route's replies fared.
+
+Pure-JSON routes also ask the API for JSON mode (response_format
+json_object), so most replies parse on the first try.
+
+Tuning (environment variables):
+  LLM_JSON_MODE=1     request response_format json_object on pure-JSON routes
+"""
+
+import json
+import math
+import os
+import threading
+
+JSON_MODE = os.environ.get("LLM_JSON_MODE", "1") == "1"
+
+# Extra completion arguments for routes whose whole reply is one JSON object
+RESPONSE_FORMAT = {"response_format": {"type": "json_object"}} if JSON_MODE else {}
+
+
+class SchemaError(ValueError):
+    pass
+
+
+class JsonScanner:
+    """Find the first complete top-level JSON object in text fed piece by piece."""
+
+    def __init__(self):
+        self.text = ""  # The object so far, from its opening brace
+        self.done = False
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, text):
+        """Consume `text`; returns how many characters were used.
+
+        Text before the opening brace is skipped. Once the object closes
+        nothing more is consumed, so the caller can keep the remainder.
+        """
+        for i, ch in enumerate(text):
+            if self.done:
+                return i
+            if not self.text:
+                if ch == "{":
+                    self.text = ch
+                    self._depth = 1
+                continue
+            self.text += ch
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch == "{":
+                self._depth += 1
+            elif ch == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    self.done = True
+        return len(text)
+
+
+def extract(raw):
+    """Return (object, start, end) for the first JSON object in `raw`, or (None, None, None).
+
+    A balanced span that is not valid JSON (e.g. "{like this}" in prose)
+    is skipped and the search continues after its opening brace.
+    """
+    start = raw.find("{")
+    while start != -1:
+        scanner = JsonScanner()
+        end = start + scanner.feed(raw[start:])
+        if not scanner.done:
+            break
+        try:
+            obj = json.loads(scanner.text)
+        except ValueError:
+            obj = None
+        if isinstance(obj, dict):
+            return obj, start, end
+        start = raw.find("{", start + 1)
+    return None, None, None
+
+
+# --- Field coercion ---
+# Each coercer returns the cleaned value or raises ValueError/TypeError
+def boolean(value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lower() in ("true", "false"):
+        return value.strip().lower() == "true"
+    raise TypeError(f"expected a boolean, got {value!r}")
+
+
+def _finite(value):
+    """float(value), rejecting NaN and infinities (json.loads accepts NaN, Infinity and 1e999)."""
+    value = float(value)
+    if not math.isfinite(value):
+        raise ValueError(f"expected a finite number, got {value!r}")
+    return value
+
+
+def integer(low=None, high=None):
+    def coerce(value):
+        if isinstance(value, bool):
+            raise TypeError(f"expected an integer, got {value!r}")
+        value = int(_finite(value))
+        if low is not None:
+            value = max(value, low)
+        if high is not None:
+            value = min(value, high)
+        return value
+    return coerce
+
+
+def number(low=None, high=None):
+    def coerce(value):
+        if isinstance(value, bool):
+            raise TypeError(f"expected a number, got {value!r}")
+        value = _finite(value)
+        if low is not None:
+            value = max(value, float(low))
+        if high is not None:
+            value = min(value, float(high))
+        return value
+    return coerce
+
+
+def text(max_length=None):
+    def coerce(value):
+        if not isinstance(value, str):
+            raise TypeError(f"expected a string, got {value!r}")
+        value = value.strip()
+        return value[:max_length] if max_length else value
+    return coerce
+
+
+def one_of(*choices):
+    def coerce(value):
+        value = str(value).strip().lower()
+        if value not in choices:
+            raise ValueError(f"expected one of {', '.join(choices)}, got {value!r}")
+        return value
+    return coerce
+
+
+def scalar(value):
+    """Strings and numbers pass through (quest IDs arrive as either); None becomes ""."""
+    if value is None:
+        return ""
+    if isinstance(value, (str, int, float)) and not isinstance(value, bool):
+        return value
+    raise TypeError(f"expected a string or number, got {value!r}")
+
+
+class Schema:
+    def __init__(self, fields, required=(), defaults=None):
+        """`fields` maps name -> coercer. Unknown keys are dropped.
+
+        A missing or invalid required field fails the whole object. An
+        invalid optional field is dropped and replaced by its default.
+        """
+        self.fields = fields
+        self.required = frozenset(required)
+        self.defaults = defaults or {}
+
+    def validate(self, obj):
+        """Return (cleaned object, number of optional fields dropped)."""
+        cleaned = {}
+        dropped = 0
+        for name, coerce in self.fields.items():
+            if name not in obj:
+                if name in self.required:
+                    raise SchemaError(f"missing field {name!r}")
+                if name in self.defaults:
+                    cleaned[name] = self.defaults[name]
+                continue
+            try:
+                cleaned[name] = coerce(obj[name])
+            except (TypeError, ValueError) as e:
+                if name in self.required:
+                    raise SchemaError(f"field {name!r}: {e}")
+                dropped += 1
+                if name in self.defaults:
+                    cleaned[name] = self.defaults[name]
+        return cleaned, dropped
+
+
+class ParseStats:
+    OUTCOMES = ("ok", "extracted", "no_json", "invalid_json", "schema_errors", "fields_dropped")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def record(self, route, outcome, count=1):
+        with self._lock:
+            counts = self._routes.setdefault(route, dict.fromkeys(self.OUTCOMES, 0))
+            counts[outcome] += count
+
+    def stats(self):
+        with self._lock:
+            summary = {"json_mode": JSON_MODE}
+            for route, counts in self._routes.items():
+                failed = counts["no_json"] + counts["invalid_json"] + counts["schema_errors"]
+                replies = counts["ok"] + failed
+                summary[route] = {
+                    **counts,
+                    "failure_rate": round(failed / replies, 3) if replies else 0.0,
+                }
+            return summary
+
+
+stats = ParseStats()
+
+
+def validate(route, obj, schema, extracted=False):
+    """Validate an already-decoded object for `route`, or return None (counted) if it fails."""
+    try:
+        cleaned, dropped = schema.validate(obj)
+    except SchemaError:
+        stats.record(route, "schema_errors")
+        return None
+    stats.record(route, "ok")
+    if extracted:
+        stats.record(route, "extracted")
+    if dropped:
+        stats.record(route, "fields_dropped", dropped)
+    return cleaned
+
+
+def parse(route, raw, schema):
+    """Parse and validate the JSON object in a model reply; None (counted) if there is no usable one."""
+    raw = (raw or "").strip()
+    try:
+        obj = json.loads(raw)
+        extracted = False
+    except ValueError:
+        obj = None
+    if not isinstance(obj, dict):
+        obj, _, _ = extract(raw)
+        extracted = True
+        if obj is None:
+            stats.record(route, "invalid_json" if "{" in raw else "no_json")
+            return None
+    return validate(route, obj, schema, extracted)
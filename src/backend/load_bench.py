@@ -0,0 +1,61 @@
+"""
+Load generator for the HTTP API (`flask bench-load`).
+
+Sends a fixed number of requests to one endpoint with a fixed number in
+flight, against either server (python app.py or uvicorn asgi:app), and
+reports status counts, latency percentiles and throughput. Point
+OPENAI_BASE_URL and ELEVENLABS_BASE_URL at a local fake server to
+measure this server rather than the upstreams.
+"""
+
+import asyncio
+import time
+from collections import Counter
+
+import httpx
+
+
+def _percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def _run(url, method, body, total, concurrency, timeout):
+    latencies = []
+    statuses = Counter()
+    remaining = iter(range(total))
+
+    async with httpx.AsyncClient(timeout=timeout, limits=httpx.Limits(max_connections=concurrency)) as client:
+        async def worker():
+            # Workers share one iterator, so exactly `total` requests are sent
+            for _ in remaining:
+                started = time.perf_counter()
+                try:
+                    resp = await client.request(method, url, json=body)
+                    status = resp.status_code
+                except httpx.HTTPError as e:
+                    status = type(e).__name__
+                latencies.append((time.perf_counter() - started) * 1000)
+                statuses[status] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "statuses": dict(statuses),
+        "p50_ms": round(_percentile(latencies, 50), 1),
+        "p90_ms": round(_percentile(latencies, 90), 1),
+        "p99_ms": round(_percentile(latencies, 99), 1),
+        "max_ms": round(max(latencies), 1),
+        "throughput_rps": round(total / elapsed, 1),
+    }
+
+
+def run(url, method="GET", body=None, requests=100, concurrency=10, timeout=30):
+    """Send `requests` requests to `url`, `concurrency` at a time; returns the summary."""
+    if requests < 1 or concurrency < 1:
+        raise ValueError("requests and concurrency must be at least 1")
+    return asyncio.run(_run(url, method, body, requests, concurrency, timeout))
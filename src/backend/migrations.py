@@ -0,0 +1,179 @@
+"""
+Versioned schema migrations.
+
+init_db() creates the baseline tables; everything after that is a
+numbered step in MIGRATIONS. The database's PRAGMA user_version records
+the last step applied, so each step runs exactly once per database, in
+order, at startup. To change the schema, append a new step — never edit
+one that has shipped.
+
+Each step runs in one BEGIN IMMEDIATE transaction together with its
+user_version bump, and the version is re-read once the write lock is
+held. Workers starting at once apply a step only once between them, and
+a crash mid-step leaves the database at the previous version. Steps
+therefore use execute(), never executescript() (which commits), and
+never commit themselves.
+
+check_query_plans() runs EXPLAIN QUERY PLAN over the hot queries (the
+same SQL constants the code executes) and reports any that fall back to
+a full table scan or a temporary sort (`flask check-query-plans`, and
+tests/test_migrations.py against a seeded database).
+"""
+
+import sqlite3
+
+from openers import SCHEMA as OPENER_SCHEMA, TAKE_SQL as TAKE_OPENER_SQL
+from queries import (
+    AWARD_ACHIEVEMENTS_SQL, CANVAS_SESSION_SQL, LOAD_SESSION_SQL, QUEST_PROGRESS_SQL, QUESTS_FOR_USER_SQL,
+    QUESTS_SQL, USER_ACHIEVEMENTS_SQL
+)
+from transcripts import APPEND_SQL, MESSAGES_AFTER_SQL, migrate_message_blobs
+from user_stats import TOPIC_STATS_SQL, USER_STATS_SQL, WEEK_STATS_SQL, rebuild as rebuild_user_stats
+from xp_ledger import BUCKETS as XP_BUCKETS, HISTORY_SQL as XP_HISTORY_SQL, backfill as backfill_xp_ledger
+
+
+def _execute_script(db, script):
+    """executescript() without its implicit COMMIT; statements are split on ';'."""
+    for statement in script.split(";"):
+        if statement.strip():
+            db.execute(statement)
+
+
+def _add_column(db, table, column, definition):
+    # Also skips a column left behind by a step that ran before steps were atomic
+    if not any(row[1] == column for row in db.execute(f"PRAGMA table_info({table})")):
+        db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def _secondary_indexes(db):
+    # user_achievements and user_quest_progress are already covered by
+    # their UNIQUE(user_id, ...) autoindexes
+    _execute_script(db, """
+        CREATE INDEX IF NOT EXISTS idx_quest_sessions_user_status_completed
+            ON quest_sessions(user_id, status, completed_at);
+        CREATE INDEX IF NOT EXISTS idx_canvas_sessions_user
+            ON canvas_sessions(user_id);
+        CREATE INDEX IF NOT EXISTS idx_quests_difficulty_topic
+            ON quests(difficulty, topic);
+        CREATE INDEX IF NOT EXISTS idx_achievements_category_value
+            ON achievements(category, requirement_value);
+    """)
+
+
+def _opener_pool(db):
+    # Custom quests get a per-student prompt; only catalog quests are pooled
+    _add_column(db, "quests", "is_custom", "INTEGER NOT NULL DEFAULT 0")
+    db.execute(
+        "UPDATE quests SET is_custom = 1 WHERE system_prompt LIKE ?",
+        ("%You are a knowledgeable and encouraging tutor helping a student study:%",)
+    )
+    _execute_script(db, OPENER_SCHEMA)
+
+
+def _session_context(db):
+    _add_column(db, "quest_sessions", "context_summary", "TEXT")
+    _add_column(db, "quest_sessions", "summarized_seq", "INTEGER NOT NULL DEFAULT -1")
+
+
+def _daily_stats_without_xp(db):
+    # The weekly chart reads xp_events; a second per-day XP total could only drift from it
+    if any(row[1] == "xp_earned" for row in db.execute("PRAGMA table_info(user_daily_stats)")):
+        db.execute("ALTER TABLE user_daily_stats DROP COLUMN xp_earned")
+
+
+MIGRATIONS = [
+    (1, "move transcript blobs into quest_session_messages", migrate_message_blobs),
+    (2, "build the materialized user stats", rebuild_user_stats),
+    (3, "backfill the XP ledger", backfill_xp_ledger),
+    (4, "secondary indexes for hot queries", _secondary_indexes),
+    (5, "opening-turn pool for catalog quests", _opener_pool),
+    (6, "rolling context summary on quest sessions", _session_context),
+    (7, "read XP per day from the ledger only", _daily_stats_without_xp),
+]
+
+
+def schema_version(db):
+    return db.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(db):
+    """Apply every pending migration; returns the list of versions applied.
+
+    Safe to call from several processes at once: whichever takes the
+    write lock first applies a step, the others then see its version.
+    """
+    applied = []
+    for version, description, step in MIGRATIONS:
+        if version <= schema_version(db):
+            continue
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            # Re-read under the write lock; another worker may have got here first
+            if version <= schema_version(db):
+                db.rollback()
+                continue
+            step(db)
+            # PRAGMA can't take bound parameters; version is an int from MIGRATIONS
+            db.execute(f"PRAGMA user_version = {int(version)}")
+            db.commit()
+        except BaseException:
+            db.rollback()
+            raise
+        applied.append((version, description))
+    return applied
+
+
+# name -> (SQL, sample parameters, tables a full read of is expected, by their
+# name in the plan: the alias when the query gives one).
+# The SQL is the statement the code runs, imported from where it is used.
+HOT_QUERIES = {
+    "get_quests": (QUESTS_SQL, (), ()),
+    "get_quests_for_user": (QUESTS_FOR_USER_SQL, (1,), ()),
+    "load_session": (LOAD_SESSION_SQL, ("s",), ()),
+    "transcript_after": (MESSAGES_AFTER_SQL, ("s", -1), ()),
+    "transcript_append": (APPEND_SQL, ("s", "user", "", None, None, "s"), ()),
+    "quest_progress": (QUEST_PROGRESS_SQL, (1, 1), ()),
+    "stats_user": (USER_STATS_SQL, (1,), ("topic_totals",)),
+    "stats_topics": (TOPIC_STATS_SQL, (1,), ()),
+    "stats_week": (WEEK_STATS_SQL, (1, "2000-01-01"), ()),
+    "xp_history": (XP_HISTORY_SQL, (*XP_BUCKETS["week"], 1, "2000-01-01", "2100-01-01"), ()),
+    "user_achievements": (USER_ACHIEVEMENTS_SQL, (1,), ()),
+    "award_achievements": (AWARD_ACHIEVEMENTS_SQL, (1,), ("a",)),  # achievements a: every rule, by design
+    "take_opener": (TAKE_OPENER_SQL, (1,), ()),
+    "canvas_session": (CANVAS_SESSION_SQL, ("s",), ()),
+}
+
+# Per-user tables (quests and achievements are seeded); all empty means nothing realistic to plan against
+POPULATED_TABLES = ("users", "quest_sessions", "quest_session_messages")
+
+
+def check_query_plans(db):
+    """Return {query name: [offending plan lines]} for queries that scan or sort without an index.
+
+    A database without the migrated schema is itself reported as a problem.
+    """
+    latest = MIGRATIONS[-1][0]
+    if schema_version(db) < latest:
+        return {"schema": [f"schema version {schema_version(db)}, expected {latest}; start the app to migrate"]}
+    problems = {}
+    for name, (sql, params, full_reads) in HOT_QUERIES.items():
+        try:
+            plan = db.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+        except sqlite3.OperationalError as e:
+            problems[name] = [str(e)]
+            continue
+        for row in plan:
+            detail = row[3]
+            full_scan = detail.startswith("SCAN") and "INDEX" not in detail
+            allowed = any(detail.split()[1:2] == [table] for table in full_reads)
+            temp_sort = "USE TEMP B-TREE" in detail and "GROUP BY" not in detail
+            if (full_scan and not allowed) or temp_sort:
+                problems.setdefault(name, []).append(detail)
+    return problems
+
+
+def is_empty(db):
+    """True when none of the hot tables has a row, so plans say little about production."""
+    return not any(
+        db.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone() for table in POPULATED_TABLES
+    )
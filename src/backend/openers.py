@@ -0,0 +1,166 @@
+"""
+Pre-generated opening turns for catalog quests.
+
+Catalog quests have a fixed system prompt, so their greeting and first
+question are interchangeable between learners. The pool keeps a few
+ready-made openers per quest in SQLite. start_quest takes one instead of
+waiting on the model, and the pool is refilled in the background. A new
+opener that is too similar to one already pooled, or to one recently
+served, is regenerated.
+
+Refills run on their own small executor, so they never compete with
+request fan-out for workers. A database connection is only checked out
+briefly, to read the quest and to insert each finished opener, never
+across a model call.
+
+Tuning (environment variables):
+  OPENER_POOL_SIZE=3           ready openers per catalog quest (0 disables the pool)
+  OPENER_MAX_SIMILARITY=0.8    reject openers at least this similar (0-1) to a pooled one
+  OPENER_ATTEMPTS=3            generation attempts per slot before giving up
+  OPENER_WORKERS=2             concurrent refills (also paces a startup prewarm)
+  OPENER_PREWARM=0             fill every catalog quest's pool at startup
+  OPENER_TTS=0                 also synthesize each opener into the TTS cache
+"""
+
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from difflib import SequenceMatcher
+
+from db import get_db
+
+POOL_SIZE = int(os.environ.get("OPENER_POOL_SIZE", "3"))
+MAX_SIMILARITY = float(os.environ.get("OPENER_MAX_SIMILARITY", "0.8"))
+ATTEMPTS = int(os.environ.get("OPENER_ATTEMPTS", "3"))
+WORKERS = int(os.environ.get("OPENER_WORKERS", "2"))
+PREWARM = os.environ.get("OPENER_PREWARM", "0") == "1"
+SYNTHESIZE = os.environ.get("OPENER_TTS", "0") == "1"
+
+# Retries get a little more randomness to move away from the rejected text
+TEMPERATURES = (0.7, 0.9, 1.0)
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS quest_openers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        quest_id INTEGER NOT NULL,
+        content TEXT NOT NULL,
+        tts_key TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (quest_id) REFERENCES quests(id)
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_quest_openers_quest ON quest_openers(quest_id, id);
+"""
+
+TAKE_SQL = "SELECT id, content, tts_key FROM quest_openers WHERE quest_id = ? ORDER BY id LIMIT 1"
+
+
+def similarity(a, b):
+    """Word-sequence similarity between two openers, 0 (unrelated) to 1 (identical)."""
+    return SequenceMatcher(None, a.lower().split(), b.lower().split()).ratio()
+
+
+_executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="openers")
+
+
+class OpenerPool:
+    def __init__(self, generate, executor=_executor, synthesize=None, size=POOL_SIZE,
+                 max_similarity=MAX_SIMILARITY, attempts=ATTEMPTS):
+        """`generate(quest_row, temperature)` returns opener text; `synthesize(text)` returns a TTS cache key."""
+        self.generate = generate
+        self.executor = executor
+        self.synthesize = synthesize
+        self.size = size
+        self.max_similarity = max_similarity
+        self.attempts = attempts
+        self._lock = threading.Lock()
+        self._refilling = set()
+        self._served = {}  # quest_id -> recently served openers
+        self._counts = {"hits": 0, "misses": 0, "generated": 0, "rejected_similar": 0, "failures": 0}
+
+    def take(self, db, quest_id):
+        """Claim a pooled opener for `quest_id` ({"content", "tts_key"}) or None. Caller commits."""
+        if self.size <= 0:
+            return None
+        row = db.execute(TAKE_SQL, (quest_id,)).fetchone()
+        # Another worker may have claimed the same row first
+        claimed = row is not None and db.execute(
+            "DELETE FROM quest_openers WHERE id = ?", (row["id"],)
+        ).rowcount == 1
+        with self._lock:
+            self._counts["hits" if claimed else "misses"] += 1
+            if claimed:
+                self._served.setdefault(quest_id, deque(maxlen=max(self.size, 1))).append(row["content"])
+        return {"content": row["content"], "tts_key": row["tts_key"]} if claimed else None
+
+    def refill_async(self, quest_id):
+        """Top up a quest's pool in the background; call after the claiming transaction commits."""
+        if self.size <= 0:
+            return
+        with self._lock:
+            if quest_id in self._refilling:
+                return
+            self._refilling.add(quest_id)
+        self.executor.submit(self._refill, quest_id)
+
+    def warm(self, db):
+        for row in db.execute("SELECT id FROM quests WHERE is_custom = 0").fetchall():
+            self.refill_async(row["id"])
+
+    def _refill(self, quest_id):
+        try:
+            db = get_db()
+            try:
+                quest = db.execute("SELECT * FROM quests WHERE id = ? AND is_custom = 0", (quest_id,)).fetchone()
+                pooled = [r["content"] for r in db.execute(
+                    "SELECT content FROM quest_openers WHERE quest_id = ?", (quest_id,)
+                ).fetchall()]
+            finally:
+                db.close()
+            if not quest:
+                return
+            with self._lock:
+                served = list(self._served.get(quest_id, ()))
+            for _ in range(self.size - len(pooled)):
+                text = self._generate_distinct(quest, pooled + served)
+                if text is None:
+                    break
+                tts_key = self.synthesize(text) if self.synthesize else None
+                db = get_db()
+                try:
+                    db.execute(
+                        "INSERT INTO quest_openers (quest_id, content, tts_key) VALUES (?, ?, ?)",
+                        (quest_id, text, tts_key)
+                    )
+                    db.commit()
+                finally:
+                    db.close()
+                pooled.append(text)
+        except Exception:
+            with self._lock:
+                self._counts["failures"] += 1
+        finally:
+            with self._lock:
+                self._refilling.discard(quest_id)
+
+    def _generate_distinct(self, quest, existing):
+        for attempt in range(self.attempts):
+            text = self.generate(quest, TEMPERATURES[min(attempt, len(TEMPERATURES) - 1)])
+            if all(similarity(text, other) < self.max_similarity for other in existing):
+                with self._lock:
+                    self._counts["generated"] += 1
+                return text
+            with self._lock:
+                self._counts["rejected_similar"] += 1
+        return None
+
+    def stats(self):
+        with self._lock:
+            taken = self._counts["hits"] + self._counts["misses"]
+            return {
+                "size": self.size,
+                **self._counts,
+                "hit_rate": round(self._counts["hits"] / taken, 3) if taken else 0.0,
+                "refilling": len(self._refilling),
+            }
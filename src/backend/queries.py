@@ -0,0 +1,55 @@
+"""
+SQL for the hot paths in app.py.
+
+The statements live here rather than inline so that check_query_plans()
+in migrations.py explains exactly what the routes run. Queries owned by
+other modules (transcripts, user_stats, xp_ledger, openers) are defined
+next to their code and shared the same way.
+"""
+
+QUESTS_SQL = "SELECT * FROM quests ORDER BY difficulty, topic"
+
+QUESTS_FOR_USER_SQL = """
+    SELECT q.*, uqp.completed as is_completed, uqp.best_score
+    FROM quests q
+    LEFT JOIN user_quest_progress uqp ON q.id = uqp.quest_id AND uqp.user_id = ?
+    ORDER BY q.difficulty, q.topic
+"""
+
+LOAD_SESSION_SQL = "SELECT * FROM quest_sessions WHERE session_id = ?"
+
+QUEST_PROGRESS_SQL = "SELECT completed, best_score FROM user_quest_progress WHERE user_id = ? AND quest_id = ?"
+
+USER_ACHIEVEMENTS_SQL = """
+    SELECT a.*, ua.unlocked_at
+    FROM achievements a
+    LEFT JOIN user_achievements ua ON a.id = ua.achievement_id AND ua.user_id = ?
+    ORDER BY a.category, a.requirement_value
+"""
+
+# requirement_type -> users column it is measured against; add a rule type here
+ACHIEVEMENT_REQUIREMENTS = {
+    "quests_completed": "quests_completed",
+    "xp": "xp",
+    "streak": "streak",
+    "level": "level",
+}
+
+_ACHIEVEMENT_PROGRESS = "CASE a.requirement_type " + " ".join(
+    f"WHEN '{req_type}' THEN u.{column}" for req_type, column in ACHIEVEMENT_REQUIREMENTS.items()
+) + " END"
+
+# Every rule in one set-based statement against the user row. OR IGNORE
+# skips rows a concurrent request inserted first, and RETURNING yields
+# only the rows this statement inserted.
+AWARD_ACHIEVEMENTS_SQL = f"""
+    INSERT OR IGNORE INTO user_achievements (user_id, achievement_id)
+    SELECT u.id, a.id
+    FROM achievements a
+    JOIN users u ON u.id = ?
+    LEFT JOIN user_achievements ua ON ua.achievement_id = a.id AND ua.user_id = u.id
+    WHERE ua.id IS NULL AND {_ACHIEVEMENT_PROGRESS} >= a.requirement_value
+    RETURNING achievement_id
+"""
+
+CANVAS_SESSION_SQL = "SELECT * FROM canvas_sessions WHERE session_id = ?"
@@ -0,0 +1,160 @@
+"""
+Conversation-window compaction for quest sessions.
+
+The tutor prompt carries the last QUEST_CONTEXT_TURNS turns verbatim.
+Older messages are folded into a compact summary: score so far, how
+many answers were right, and the questions already asked, so the tutor
+does not repeat them. The summary is stored on the quest_sessions row,
+together with the last seq it covers. Each turn therefore only folds
+the messages that have just left the window. If the summary plus the
+verbatim turns exceed QUEST_CONTEXT_TOKENS, more turns are folded, down
+to the student's latest message.
+
+Tuning (environment variables):
+  QUEST_CONTEXT_TURNS=3         exchanges kept verbatim
+  QUEST_CONTEXT_TOKENS=1200     budget for summary + verbatim history
+  QUEST_CONTEXT_MAX_ASKED=30    questions remembered in the summary
+"""
+
+import json
+import os
+import re
+import threading
+
+from tokens import count_tokens
+from transcripts import load_after
+
+RECENT_TURNS = int(os.environ.get("QUEST_CONTEXT_TURNS", "3"))
+TOKEN_BUDGET = int(os.environ.get("QUEST_CONTEXT_TOKENS", "1200"))
+MAX_ASKED = int(os.environ.get("QUEST_CONTEXT_MAX_ASKED", "30"))
+MAX_QUESTION_CHARS = 200
+
+QUESTION = re.compile(r"[^.!?]*\?")
+
+
+def empty_summary():
+    return {"asked": [], "results": [], "folded_messages": 0, "folded_tokens": 0}
+
+
+def load_summary(session):
+    """(summary, last summarized seq) stored on a quest_sessions row."""
+    try:
+        summary = json.loads(session["context_summary"]) if session["context_summary"] else None
+    except (json.JSONDecodeError, TypeError):
+        summary = None
+    if summary is None:
+        return empty_summary(), -1
+    return summary, session["summarized_seq"]
+
+
+def fold(summary, messages):
+    """Fold transcript messages into the summary (returns a new summary)."""
+    summary = {**summary, "asked": list(summary["asked"]), "results": list(summary["results"])}
+    for msg in messages:
+        summary["folded_messages"] += 1
+        summary["folded_tokens"] += count_tokens(msg["content"])
+        if msg["role"] != "tutor":
+            continue
+        if "is_correct" in msg:
+            summary["results"].append(msg["is_correct"])
+        for question in QUESTION.findall(msg["content"]):
+            question = " ".join(question.split())
+            if len(question) > 1:
+                summary["asked"].append(question[:MAX_QUESTION_CHARS])
+    summary["asked"] = summary["asked"][-MAX_ASKED:]
+    return summary
+
+
+def render(summary, score):
+    """The summary as a prompt message (None before anything has been folded)."""
+    if not summary["folded_messages"]:
+        return None
+    results = summary["results"]
+    lines = [
+        "Summary of earlier turns in this session (older messages are omitted):",
+        f"- Score so far: {score}. Answers evaluated in the summarized turns: {len(results)}, "
+        f"{sum(1 for r in results if r)} correct.",
+    ]
+    if summary["asked"]:
+        lines.append("- Questions already asked (do NOT repeat these):")
+        lines.extend(f"  {i}. {q}" for i, q in enumerate(summary["asked"], start=1))
+    return "\n".join(lines)
+
+
+def build_history(db, session, user_entry, recent_turns=RECENT_TURNS, budget=TOKEN_BUDGET):
+    """Compact prompt history for the next turn.
+
+    Returns (messages, summary, summarized_seq, accounting) where messages
+    are OpenAI-format history messages (summary first, then verbatim turns
+    ending with `user_entry`) and summary/summarized_seq are what should
+    be stored back on the session when the turn is saved.
+    """
+    summary, summarized_seq = load_summary(session)
+    pending = load_after(db, session["session_id"], summarized_seq)
+
+    keep = recent_turns * 2
+    verbatim = pending[-keep:] if keep else []
+    summary = fold(summary, pending[:len(pending) - len(verbatim)])
+
+    def tokens(summary_text):
+        return (count_tokens(summary_text) if summary_text else 0) + sum(
+            count_tokens(m["content"]) for m in verbatim + [user_entry]
+        )
+
+    summary_text = render(summary, session["score"])
+    while verbatim and tokens(summary_text) > budget:
+        summary = fold(summary, verbatim[:1])
+        verbatim = verbatim[1:]
+        summary_text = render(summary, session["score"])
+
+    folded = len(pending) - len(verbatim)
+    if folded:
+        summarized_seq = pending[folded - 1]["seq"]
+
+    messages = []
+    if summary_text:
+        messages.append({"role": "system", "content": summary_text})
+    for msg in verbatim + [user_entry]:
+        role = "assistant" if msg["role"] == "tutor" else "user"
+        messages.append({"role": role, "content": msg["content"]})
+
+    history_tokens = tokens(summary_text)
+    summary_tokens = count_tokens(summary_text) if summary_text else 0
+    accounting = {
+        "history_tokens": history_tokens,
+        "tokens_saved": max(0, summary["folded_tokens"] - summary_tokens),
+        "verbatim_messages": len(verbatim) + 1,
+        "summarized_messages": summary["folded_messages"],
+    }
+    return messages, summary, summarized_seq, accounting
+
+
+class ContextStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._turns = 0
+        self._compacted = 0
+        self._history_tokens = 0
+        self._tokens_saved = 0
+        self._max_history_tokens = 0
+
+    def record(self, accounting):
+        with self._lock:
+            self._turns += 1
+            if accounting["summarized_messages"]:
+                self._compacted += 1
+            self._history_tokens += accounting["history_tokens"]
+            self._tokens_saved += accounting["tokens_saved"]
+            self._max_history_tokens = max(self._max_history_tokens, accounting["history_tokens"])
+
+    def stats(self):
+        with self._lock:
+            turns = self._turns or 1
+            return {
+                "turns": self._turns,
+                "compacted_turns": self._compacted,
+                "avg_history_tokens": round(self._history_tokens / turns, 1),
+                "max_history_tokens": self._max_history_tokens,
+                "tokens_saved": self._tokens_saved,
+                "avg_tokens_saved": round(self._tokens_saved / turns, 1),
+            }
@@ -0,0 +1,113 @@
+"""
+Respond-and-speak pipeline.
+
+While the tutor reply is still streaming from the model, every finished
+sentence is handed to a TTS worker. SentenceSpeaker returns the audio in
+sentence order as it becomes ready. The first sentence can then play
+while later ones are still being generated and synthesized.
+
+TurnTimer records when each stage first happened in a turn.
+PipelineStats keeps percentiles over recent turns.
+
+Tuning (environment variables):
+  TTS_PIPELINE_WORKERS=4      concurrent sentence syntheses (all turns)
+  PIPELINE_TIMING_WINDOW=500  turns kept for timing percentiles
+"""
+
+import base64
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+WORKERS = int(os.environ.get("TTS_PIPELINE_WORKERS", "4"))
+TIMING_WINDOW = int(os.environ.get("PIPELINE_TIMING_WINDOW", "500"))
+
+_executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="tts")
+
+STAGES = ("llm_ttft_ms", "first_sentence_ms", "tts_ttfb_ms", "first_audio_ms", "llm_total_ms", "total_ms")
+
+
+class SentenceSpeaker:
+    """Synthesize sentences concurrently; hand back ("audio" | "audio_error", payload) events in order."""
+
+    def __init__(self, synthesize, executor=_executor):
+        """`synthesize(text)` returns (audio bytes, cache key, {"cached", "ttfb_ms", "total_ms"})."""
+        self.synthesize = synthesize
+        self.executor = executor
+        self._pending = deque()  # (index, text, future), sentence order
+        self._count = 0
+
+    def submit(self, text):
+        index = self._count
+        self._count += 1
+        self._pending.append((index, text, self.executor.submit(self.synthesize, text)))
+        return index
+
+    def ready(self):
+        """Events for the leading sentences whose audio is already done."""
+        while self._pending and self._pending[0][2].done():
+            yield self._event(*self._pending.popleft())
+
+    def drain(self):
+        """Events for every remaining sentence, waiting for each in turn."""
+        while self._pending:
+            yield self._event(*self._pending.popleft())
+
+    def cancel(self):
+        while self._pending:
+            self._pending.popleft()[2].cancel()
+
+    def _event(self, index, text, future):
+        try:
+            audio, key, timing = future.result()
+        except Exception as e:
+            return "audio_error", {"index": index, "text": text, "message": f"TTS error: {str(e)}"}
+        return "audio", {
+            "index": index,
+            "text": text,
+            "etag": key,
+            "cached": timing["cached"],
+            "tts_ttfb_ms": timing["ttfb_ms"],
+            "tts_ms": timing["total_ms"],
+            "audio": base64.b64encode(audio).decode("ascii"),
+        }
+
+
+class TurnTimer:
+    """Milliseconds from the start of a turn to the first time each stage happened."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.marks = {}
+
+    def mark(self, stage, value=None):
+        if stage not in self.marks:
+            self.marks[stage] = round(value if value is not None else (time.monotonic() - self.started) * 1000, 1)
+
+
+class PipelineStats:
+    def __init__(self, window=TIMING_WINDOW):
+        self._turns = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._count = 0
+
+    def record(self, marks):
+        with self._lock:
+            self._turns.append(dict(marks))
+            self._count += 1
+
+    def stats(self):
+        with self._lock:
+            turns = list(self._turns)
+            count = self._count
+        summary = {"turns": count}
+        for stage in STAGES:
+            values = sorted(t[stage] for t in turns if stage in t)
+            if values:
+                summary[stage] = {
+                    "p50": values[len(values) // 2],
+                    "p95": values[min(len(values) - 1, int(len(values) * 0.95))],
+                }
+        return summary
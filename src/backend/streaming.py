@@ -0,0 +1,174 @@
+"""
+Incremental parsing of streamed tutor replies.
+
+Tutor replies carry a JSON evaluation header followed by the spoken
+text, e.g. '{"is_correct": true, "score_delta": 15}\\nNice work! Next...'.
+Anything the model says before the header is spoken too.
+TutorReplyStream consumes completion deltas as they arrive, reports the
+header as soon as its closing brace streams in, and cuts the spoken text
+into sentences so the frontend can start TTS on the first one early.
+The header is found with llm_json's brace scanner and checked against
+TUTOR_HEADER; parse_tutor_reply does the same for a whole completion.
+"""
+
+import json
+import re
+
+import llm_json
+from llm_json import JsonScanner, Schema, boolean, integer
+
+FALLBACK_TUTOR_MESSAGE = "Great effort! Let's continue."
+FALLBACK_SCORE_DELTA = 10  # Partial credit when the header is present but unusable
+
+TUTOR_HEADER = Schema(
+    {"is_correct": boolean, "score_delta": integer(0, 20)},
+    defaults={"is_correct": False, "score_delta": 0},
+)
+
+SENTENCE_END = re.compile(r'[.!?]+["\')\]]*\s+')
+
+
+def sse_event(event, data):
+    """Format one Server-Sent Events message."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def evaluate_header(header, extracted=False):
+    """(is_correct, score_delta) from a decoded header object."""
+    cleaned = llm_json.validate("tutor", header, TUTOR_HEADER, extracted=extracted)
+    if cleaned is None:
+        return False, FALLBACK_SCORE_DELTA
+    return cleaned["is_correct"], cleaned["score_delta"]
+
+
+def missing_header(raw):
+    """(is_correct, score_delta) for a reply with no header object in it."""
+    if "{" in raw:
+        llm_json.stats.record("tutor", "invalid_json")
+        return False, FALLBACK_SCORE_DELTA
+    llm_json.stats.record("tutor", "no_json")
+    return False, 0
+
+
+def parse_tutor_reply(raw_response):
+    """Split a whole tutor completion into (is_correct, score_delta, tutor_message)."""
+    raw_response = raw_response or ""
+    parsed, start, end = llm_json.extract(raw_response)
+    if parsed is None:
+        is_correct, score_delta = missing_header(raw_response)
+        return is_correct, score_delta, raw_response.strip() or FALLBACK_TUTOR_MESSAGE
+
+    is_correct, score_delta = evaluate_header(parsed, extracted=bool(raw_response[:start].strip()))
+    # Anything the model said around the header is the spoken reply
+    tutor_message = " ".join(part for part in (raw_response[:start].strip(), raw_response[end:].strip()) if part)
+    return is_correct, score_delta, tutor_message or FALLBACK_TUTOR_MESSAGE
+
+
+class TutorReplyStream:
+    """Feed completion deltas in, get ("evaluation" | "token" | "sentence", payload) events out.
+
+    The header is searched for exactly as llm_json.extract() does, so the
+    result always matches parse_tutor_reply() on the same completion.
+    Text before a candidate "{" is spoken as it arrives; from the brace on,
+    text is held until the object closes and turns out to be the header
+    or just braces in prose.
+    """
+
+    def __init__(self):
+        self.raw = ""
+        self.is_correct = False
+        self.score_delta = 0
+        self.evaluated = False
+        self._scanned = 0  # raw[:_scanned] is spoken text (or, once evaluated, everything up to the header's end)
+        self._header = None  # JsonScanner for the candidate header starting at raw[_scanned]
+        self._header_end = 0  # How far into raw the candidate has been fed
+        self._separate = False  # Join the text after the header to the text before it with one space
+        self._body = ""
+        self._pending = ""
+
+    def feed(self, delta):
+        if not delta:
+            return []
+        self.raw += delta
+        if self.evaluated:
+            return self._speak(delta)
+        return self._search()
+
+    def finish(self):
+        """Flush the trailing sentence; returns remaining events."""
+        events = []
+        if not self.evaluated:
+            # No header object: same fallbacks as parse_tutor_reply, and the held text is spoken
+            events.extend(self._speak(self.raw[self._scanned:]))
+            self.is_correct, self.score_delta = missing_header(self.raw)
+            self.evaluated = True
+            events.append(("evaluation", {"is_correct": self.is_correct, "score_delta": self.score_delta}))
+        tail = self._pending.strip()
+        if tail:
+            events.append(("sentence", {"text": tail}))
+        self._pending = ""
+        return events
+
+    @property
+    def tutor_message(self):
+        return self._body.strip() or FALLBACK_TUTOR_MESSAGE
+
+    def _search(self):
+        events = []
+        while not self.evaluated:
+            if self._header is None:
+                brace = self.raw.find("{", self._scanned)
+                events.extend(self._speak(self.raw[self._scanned:brace if brace != -1 else len(self.raw)]))
+                if brace == -1:
+                    self._scanned = len(self.raw)
+                    break
+                self._scanned = self._header_end = brace
+                self._header = JsonScanner()
+            self._header_end += self._header.feed(self.raw[self._header_end:])
+            if not self._header.done:
+                break  # Wait for the rest of the candidate
+            try:
+                parsed = json.loads(self._header.text)
+            except ValueError:
+                parsed = None
+            self._header = None
+            if isinstance(parsed, dict):
+                self.is_correct, self.score_delta = evaluate_header(
+                    parsed, extracted=bool(self.raw[:self._scanned].strip())
+                )
+                self.evaluated = True
+                events.append(("evaluation", {"is_correct": self.is_correct, "score_delta": self.score_delta}))
+                self._body = self._body.rstrip()
+                self._pending = self._pending.rstrip()
+                self._separate = True
+                self._scanned = self._header_end
+                events.extend(self._speak(self.raw[self._header_end:]))
+            else:
+                # Braces in prose: speak the "{" and keep looking after it
+                events.extend(self._speak("{"))
+                self._scanned += 1
+        return events
+
+    def _speak(self, text):
+        if self._separate or not self._body:
+            text = text.lstrip()
+            if not text:
+                return []
+            if self._separate and self._body:
+                text = " " + text
+            self._separate = False
+        return self._feed_body(text)
+
+    def _feed_body(self, text):
+        events = [("token", {"text": text})]
+        self._body += text
+        self._pending += text
+        while True:
+            match = SENTENCE_END.search(self._pending)
+            if not match:
+                break
+            sentence = self._pending[:match.end()].strip()
+            self._pending = self._pending[match.end():]
+            if sentence:
+                events.append(("sentence", {"text": sentence}))
+        return events
@@ -0,0 +1,183 @@
+"""
+Shared fixtures for the backend tests.
+
+    pip install -r requirements-dev.txt
+    python -m pytest          # from src/backend
+
+The backend modules import each other by bare name, so src/backend goes
+on sys.path. No real upstream is ever called: the API keys are dummies
+and the `upstream` fixture points the OpenAI and ElevenLabs clients at
+FakeUpstream, a local HTTP server whose replies each test sets.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+os.environ.setdefault("ELEVENLABS_API_KEY", "test-key")
+
+import pytest
+from openai import OpenAI
+
+import app as voicequest
+import db as db_pool
+from tts_cache import TTSCache
+
+
+class _FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        self.server.requests.append((self.path, body))
+        if self.path.endswith("/chat/completions"):
+            self._chat(body)
+        elif "/text-to-speech/" in self.path:
+            self._tts()
+        else:
+            self.send_error(404)
+
+    def _chat(self, body):
+        reply = self.server.chat_reply
+        time.sleep(self.server.chat_delay)
+        if not body.get("stream"):
+            self._send_json({
+                "id": "fake", "object": "chat.completion", "created": 0, "model": body.get("model", "fake"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": reply}}],
+            })
+            return
+        self._start_chunked(200, "text/event-stream")
+        step = self.server.delta_size
+        for i in range(0, len(reply), step):
+            chunk = {
+                "id": "fake", "object": "chat.completion.chunk", "created": 0, "model": body.get("model", "fake"),
+                "choices": [{"index": 0, "finish_reason": None, "delta": {"content": reply[i:i + step]}}],
+            }
+            self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+    def _tts(self):
+        if self.server.audio_status != 200:
+            self._send_json({"detail": "voice not found"}, self.server.audio_status)
+            return
+        self._start_chunked(200, "audio/mpeg")
+        for chunk in self.server.audio:
+            self._write_chunk(chunk)
+            time.sleep(self.server.audio_delay)
+        if self.server.audio_fail:
+            self.close_connection = True  # Drop the connection before the terminating chunk
+            return
+        self._write_chunk(b"")
+
+    def _send_json(self, payload, status=200):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _start_chunked(self, status, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _write_chunk(self, data):
+        try:
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+        except OSError:
+            self.close_connection = True  # The client went away
+
+
+class FakeUpstream(ThreadingHTTPServer):
+    """OpenAI chat completions (plain and streamed) and ElevenLabs streaming TTS on localhost."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _FakeHandler)
+        self.requests = []
+        self.chat_reply = '{"is_correct": true, "score_delta": 15}\nNice work! Next question.'
+        self.delta_size = 5  # Characters per streamed delta
+        self.chat_delay = 0  # Seconds before a completion starts, like model latency
+        self.audio = [b"ID3-fake-mp3-", b"chunk-1-", b"chunk-2"]
+        self.audio_delay = 0  # Seconds between audio chunks
+        self.audio_fail = False  # Cut the connection after the last chunk instead of ending the body
+        self.audio_status = 200
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+@pytest.fixture
+def database(tmp_path):
+    """A freshly created and migrated database behind the connection pool."""
+    path = str(tmp_path / "voicequest.db")
+    db_pool.init_pool(path)
+    with voicequest.app.app_context():
+        voicequest.init_db()
+    yield path
+    db_pool.get_pool().close_all()
+
+
+@pytest.fixture
+def upstream(monkeypatch, tmp_path):
+    """A running FakeUpstream that the app's OpenAI client and ElevenLabs calls go to."""
+    server = FakeUpstream()
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    thread.start()
+    monkeypatch.setattr(voicequest, "openai_client", OpenAI(api_key="test-key", base_url=f"{server.url}/v1"))
+    monkeypatch.setattr(voicequest, "ELEVENLABS_BASE_URL", server.url)
+    monkeypatch.setattr(voicequest, "tts_cache", TTSCache(directory=str(tmp_path / "tts_cache")))
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client(database):
+    return voicequest.app.test_client()
+
+
+def create_session(session_id, user_id=1, quest_id=1):
+    """An active quest session with the tutor's opening question, for driving respond routes."""
+    db = db_pool.get_db()
+    try:
+        db.execute(
+            "INSERT OR IGNORE INTO users (id, username, display_name) VALUES (?, ?, ?)",
+            (user_id, f"student{user_id}", f"Student {user_id}")
+        )
+        db.execute(
+            "INSERT INTO quest_sessions (session_id, user_id, quest_id, total_questions) VALUES (?, ?, ?, 5)",
+            (session_id, user_id, quest_id)
+        )
+        voicequest.append_messages(db, session_id, [
+            {"role": "tutor", "content": "What is the largest planet?", "timestamp": "2026-01-05T10:00:00"}
+        ])
+        db.commit()
+    finally:
+        db.close()
+    return session_id
+
+
+def read_sse(body):
+    """[(event, data)] from a text/event-stream body."""
+    events = []
+    for block in body.decode().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines() if ": " in line)
+        if "event" in lines:
+            events.append((lines["event"], json.loads(lines["data"])))
+    return events
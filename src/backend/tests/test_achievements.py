@@ -0,0 +1,39 @@
+"""Achievement awards: one statement, and each unlock counted once."""
+
+import pytest
+
+import app as voicequest
+from db import get_db
+
+
+@pytest.fixture
+def db(database):
+    db = get_db()
+    db.execute("INSERT INTO users (id, username, display_name, xp, quests_completed) VALUES (1, 'ada', 'Ada', 120, 5)")
+    db.commit()
+    yield db
+    db.close()
+
+
+def unlocked(db):
+    return db.execute("SELECT achievements_unlocked FROM user_stats WHERE user_id = 1").fetchone()[0]
+
+
+def test_awards_each_rule_once(db):
+    awarded = voicequest.check_and_award_achievements(db, 1)
+    assert sorted(ach["name"] for ach in awarded) == ["First Steps", "Quest Warrior", "XP Starter"]
+    assert unlocked(db) == 3
+
+    assert voicequest.check_and_award_achievements(db, 1) == []
+    assert unlocked(db) == 3
+
+
+def test_award_made_elsewhere_is_not_counted_again(db):
+    # As if a concurrent request had inserted this one first
+    db.execute("""INSERT INTO user_achievements (user_id, achievement_id)
+                  SELECT 1, id FROM achievements WHERE name = 'First Steps'""")
+    db.commit()
+
+    awarded = voicequest.check_and_award_achievements(db, 1)
+    assert sorted(ach["name"] for ach in awarded) == ["Quest Warrior", "XP Starter"]
+    assert unlocked(db) == 2
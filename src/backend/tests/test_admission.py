@@ -0,0 +1,39 @@
+"""Rate limiter accounting and who a request is charged to."""
+
+import pytest
+
+from admission import Overloaded, RateLimiter
+from app import app, rate_limit_client
+
+
+def test_route_refusal_does_not_charge_the_client():
+    limiter = RateLimiter(client_limit="5/60", route_limit="1/60")
+    limiter.check("chat", "ip:a")
+    for _ in range(3):
+        with pytest.raises(Overloaded):
+            limiter.check("chat", "ip:a")
+    assert limiter._clients[("chat", "ip:a")].tokens == pytest.approx(4, abs=0.01)
+    assert limiter.stats()["routes"]["chat"] == {"allowed": 1, "limited_client": 0, "limited_route": 3}
+
+
+def test_client_refusal_does_not_charge_the_route():
+    limiter = RateLimiter(client_limit="1/60", route_limit="3/60")
+    limiter.check("chat", "ip:a")
+    for _ in range(5):
+        with pytest.raises(Overloaded):
+            limiter.check("chat", "ip:a")
+    # The noisy client's refusals left the route's other two tokens alone
+    limiter.check("chat", "ip:b")
+    limiter.check("chat", "ip:c")
+    assert limiter.stats()["routes"]["chat"] == {"allowed": 3, "limited_client": 5, "limited_route": 0}
+
+
+def test_client_supplied_ids_do_not_pick_the_bucket(database):
+    claims = {"headers": {"X-User-Id": "7", "X-Client-Session": "tab"}, "json": {"user_id": 8, "session_id": "s"}}
+    with app.test_request_context(method="POST", environ_base={"REMOTE_ADDR": "10.0.0.5"}, **claims):
+        assert rate_limit_client() == "ip:10.0.0.5"
+
+    from asgi import AsyncRequest  # Runs init_db against the test database
+
+    scope = {"client": ("10.0.0.6", 50000), "headers": [(b"x-user-id", b"7"), (b"x-client-session", b"tab")]}
+    assert AsyncRequest(scope, claims["json"]).client() == "ip:10.0.0.6"
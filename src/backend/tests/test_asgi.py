@@ -0,0 +1,135 @@
+"""The async server: TTS relay cleanup, and both servers under concurrent load."""
+
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+import uvicorn
+from openai import AsyncOpenAI
+from werkzeug.serving import make_server
+
+import admission
+import app as voicequest
+import http_client
+import load_bench
+
+
+@pytest.fixture
+def asgi(database, upstream, monkeypatch):
+    import asgi as module  # Runs init_db against the test database
+    monkeypatch.setattr(module, "async_openai", AsyncOpenAI(api_key="test-key", base_url=f"{upstream.url}/v1"))
+    return module
+
+
+async def call(app, path, body, fail_on=None):
+    """Drive one POST through an ASGI app; returns (status, body). `fail_on` makes that send raise."""
+    sent = []
+    delivered = False
+
+    async def receive():
+        nonlocal delivered
+        delivered = True
+        return {"type": "http.request", "body": json.dumps(body).encode(), "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+        if fail_on and fail_on(message, sent):
+            raise OSError("client disconnected")
+
+    scope = {
+        "type": "http", "method": "POST", "path": path, "query_string": b"",
+        "headers": [(b"content-type", b"application/json")], "client": ("127.0.0.1", 50000),
+    }
+    await app(scope, receive, send)
+    status = next(m["status"] for m in sent if m["type"] == "http.response.start")
+    return status, b"".join(m.get("body", b"") for m in sent if m["type"] == "http.response.body")
+
+
+def run(*calls):
+    """Run calls concurrently on a fresh event loop; returns their results."""
+    async def main():
+        try:
+            return await asyncio.gather(*calls)
+        finally:
+            await http_client.aclose()  # The shared async client belongs to this event loop
+    return asyncio.run(main())
+
+
+def tts_key(text):
+    return voicequest.tts_cache_key(text, voicequest.ELEVENLABS_VOICE_ID, voicequest.TTS_MODEL_ID,
+                                    voicequest.TTS_VOICE_SETTINGS)
+
+
+def test_tts_relay_streams_and_caches(asgi, upstream):
+    [(status, body)] = run(call(asgi.app, "/api/tts", {"text": "Hello there"}))
+    assert status == 200
+    assert body == b"".join(upstream.audio)
+    assert voicequest.tts_cache.get(tts_key("Hello there")) == body
+    assert voicequest.tts_gate.stats()["in_flight"] == 0
+
+
+def test_concurrent_relays_of_one_clip(asgi, upstream):
+    upstream.audio = [bytes([i]) * 8192 for i in range(10)]
+    upstream.audio_delay = 0.005
+
+    results = run(*(call(asgi.app, "/api/tts", {"text": "Twice"}) for _ in range(2)))
+    assert [status for status, _ in results] == [200, 200]
+    assert all(body == b"".join(upstream.audio) for _, body in results)
+    assert voicequest.tts_cache.get(tts_key("Twice")) == b"".join(upstream.audio)
+
+
+@pytest.mark.parametrize("disconnect", [
+    lambda message, sent: message["type"] == "http.response.start",
+    lambda message, sent: message["type"] == "http.response.body" and len(sent) == 3,
+], ids=["before-headers", "mid-stream"])
+def test_tts_disconnect_frees_the_slot(asgi, upstream, disconnect):
+    # Larger than TTS_STREAM_CHUNK_SIZE, so the relay is still reading upstream when the client goes
+    upstream.audio = [bytes([i]) * 8192 for i in range(20)]
+    upstream.audio_delay = 0.01
+    with pytest.raises(OSError):
+        run(call(asgi.app, "/api/tts", {"text": "Gone already"}, fail_on=disconnect))
+    assert voicequest.tts_gate.stats()["in_flight"] == 0
+    assert tts_key("Gone already") not in voicequest.tts_cache
+
+
+def serve_flask():
+    server = make_server("127.0.0.1", 0, voicequest.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", server.shutdown
+
+
+def serve_asgi(app):
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=0, lifespan="off", log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    port = server.servers[0].sockets[0].getsockname()[1]
+
+    def stop():
+        server.should_exit = True
+    return f"http://127.0.0.1:{port}", stop
+
+
+def test_both_servers_under_concurrent_load(asgi, upstream, monkeypatch):
+    # Every request reaches the model, which takes a while to answer. More requests than the
+    # LLM gate admits are in flight, so some queue for a slot; none should be shed or time out.
+    unlimited = admission.RateLimiter(client_limit="0", route_limit="0")
+    monkeypatch.setattr(admission, "limiter", unlimited)
+    monkeypatch.setattr(asgi, "limiter", unlimited)
+    upstream.chat_reply = '{"intent": "chat", "target": "", "message": "Volcanoes vent molten rock."}'
+    upstream.chat_delay = 0.05
+    body = {"session_id": "load", "message": "tell me something about volcanoes", "context": {}}
+
+    results = {}
+    for name, serve in (("flask", serve_flask), ("asgi", lambda: serve_asgi(asgi.app))):
+        url, stop = serve()
+        try:
+            results[name] = load_bench.run(f"{url}/api/jarvis/chat", "POST", body, requests=120, concurrency=40)
+        finally:
+            stop()
+
+    for name, result in results.items():
+        assert result["statuses"] == {200: 120}, (name, result)
+    assert voicequest.llm_gate.stats()["in_flight"] == 0
@@ -0,0 +1,50 @@
+"""Jarvis conversation history in the SQLite store."""
+
+import threading
+
+from conversation_store import SQLiteConversationStore
+from db import get_db
+
+
+def test_concurrent_appends_get_distinct_seqs(database):
+    store = SQLiteConversationStore(max_messages=1000)
+    errors = []
+
+    def turn(worker):
+        try:
+            for i in range(20):
+                store.append("shared", {"role": "user", "content": f"{worker}-{i}"},
+                             {"role": "assistant", "content": "ok"})
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=turn, args=(w,)) for w in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert errors == []
+    db = get_db()
+    try:
+        seqs = [r["seq"] for r in db.execute(
+            "SELECT seq FROM jarvis_messages WHERE session_id = 'shared' ORDER BY seq"
+        )]
+        next_seq = db.execute(
+            "SELECT next_seq FROM jarvis_conversations WHERE session_id = 'shared'"
+        ).fetchone()["next_seq"]
+    finally:
+        db.close()
+    assert seqs == list(range(240))
+    assert next_seq == 240
+
+
+def test_history_is_a_ring_buffer(database):
+    store = SQLiteConversationStore(max_messages=4)
+    for i in range(5):
+        store.append("s", {"role": "user", "content": str(i)}, {"role": "assistant", "content": f"re {i}"})
+    assert [m["content"] for m in store.get("s")] == ["3", "re 3", "4", "re 4"]
+    store.reset("s")
+    assert store.get("s") == []
+    store.append("s", {"role": "user", "content": "again"})
+    assert store.get("s") == [{"role": "user", "content": "again"}]
@@ -0,0 +1,21 @@
+"""Connection pool checkout accounting."""
+
+from db import ConnectionPool
+
+
+def test_second_release_is_a_no_op(tmp_path):
+    pool = ConnectionPool(str(tmp_path / "pool.db"), size=2, timeout=0.1)
+    conn = pool.acquire()
+    conn.close()
+    conn.close()
+    pool.release(conn)
+    assert pool.stats()["in_use"] == 0
+
+    # Queued once, so two checkouts get two different connections
+    first, second = pool.acquire(), pool.acquire()
+    assert first is not second
+    assert pool.stats()["in_use"] == 2
+    pool.release(first)
+    pool.release(second)
+    pool.close_all()
+    assert pool.stats()["open"] == 0
@@ -0,0 +1,67 @@
+"""Schema migrations and the hot-query plan check."""
+
+import sqlite3
+
+import migrations
+from db import get_db
+
+
+def seed_history(db):
+    """A couple of users with sessions, transcripts, progress and XP, so plans are realistic."""
+    for user_id in (1, 2):
+        db.execute(
+            "INSERT INTO users (id, username, display_name, xp, quests_completed) VALUES (?, ?, ?, 150, 1)",
+            (user_id, f"student{user_id}", f"Student {user_id}")
+        )
+        session_id = f"session-{user_id}"
+        db.execute(
+            """INSERT INTO quest_sessions (session_id, user_id, quest_id, score, status, completed_at)
+               VALUES (?, ?, 1, 40, 'completed', '2026-01-05T10:00:00')""",
+            (session_id, user_id)
+        )
+        for seq, role in enumerate(("tutor", "user", "tutor")):
+            db.execute(
+                "INSERT INTO quest_session_messages (session_id, seq, role, content) VALUES (?, ?, ?, 'hi')",
+                (session_id, seq, role)
+            )
+        db.execute(
+            "INSERT INTO user_quest_progress (user_id, quest_id, completed, best_score) VALUES (?, 1, 1, 40)",
+            (user_id,)
+        )
+        db.execute(
+            "INSERT INTO xp_events (user_id, day, xp, source) VALUES (?, '2026-01-05', 150, 'quest_completed')",
+            (user_id,)
+        )
+    db.commit()
+
+
+def test_hot_queries_use_indexes(database):
+    db = get_db()
+    try:
+        seed_history(db)
+        assert migrations.schema_version(db) == migrations.MIGRATIONS[-1][0]
+        assert not migrations.is_empty(db)
+        assert migrations.check_query_plans(db) == {}
+    finally:
+        db.close()
+
+
+def test_unmigrated_database_is_reported(tmp_path):
+    db = sqlite3.connect(str(tmp_path / "empty.db"))
+    try:
+        assert "schema" in migrations.check_query_plans(db)
+    finally:
+        db.close()
+
+
+def test_migrate_resumes_after_a_half_applied_step(database):
+    db = get_db()
+    try:
+        # The old runner could add a column and die before bumping the version
+        db.execute("PRAGMA user_version = 4")
+        db.commit()
+        applied = migrations.migrate(db)
+        assert [version for version, _ in applied] == [v for v, _, _ in migrations.MIGRATIONS if v > 4]
+        assert migrations.migrate(db) == []
+    finally:
+        db.close()
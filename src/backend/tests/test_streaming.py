@@ -0,0 +1,39 @@
+"""Streamed and whole tutor replies must score and persist the same way."""
+
+import pytest
+
+import llm_json
+
+from tests.conftest import create_session, read_sse
+
+REPLIES = [
+    '{"is_correct": true, "score_delta": 15}\nNice work! Next question: what orbits Earth?',
+    'Sure! {"is_correct": true, "score_delta": 12} Nice work. Which planet has rings?',
+    'I think {maybe} yes. {"is_correct": false, "score_delta": 0}Not quite. Try again?',
+    '{"is_correct": true, "score_delta": 5',  # Header never closes
+    'No header at all, just a reply.',
+    '{"is_correct": "maybe", "score_delta": 99} Hmm.',
+]
+
+
+@pytest.mark.parametrize("reply", REPLIES)
+def test_stream_matches_whole_reply(client, upstream, reply):
+    upstream.chat_reply = reply
+    whole = client.post(f"/api/quests/session/{create_session('whole')}/respond", json={"message": "Jupiter"})
+    assert whole.status_code == 200
+
+    streamed = client.post(f"/api/quests/session/{create_session('streamed')}/respond/stream",
+                           json={"message": "Jupiter"})
+    assert streamed.status_code == 200
+    events = read_sse(streamed.data)
+    done = dict(events)["done"]
+    evaluation = [data for event, data in events if event == "evaluation"]
+
+    expected = whole.get_json()
+    assert (done["is_correct"], done["score_delta"], done["tutor_message"]) == \
+        (expected["is_correct"], expected["score_delta"], expected["tutor_message"])
+    assert evaluation == [{"is_correct": expected["is_correct"], "score_delta": expected["score_delta"]}]
+    if llm_json.extract(reply)[0] is not None:
+        # The header is scored, never spoken
+        spoken = "".join(data["text"] for event, data in events if event == "token")
+        assert "is_correct" not in spoken
@@ -0,0 +1,66 @@
+"""The Flask /api/tts relay against a stub ElevenLabs server."""
+
+import os
+
+import app as voicequest
+
+
+def cache_files(directory):
+    return [name for _, _, names in os.walk(directory) for name in names if name != "index.json"]
+
+
+def tts_key(text):
+    return voicequest.tts_cache_key(text, voicequest.ELEVENLABS_VOICE_ID, voicequest.TTS_MODEL_ID,
+                                    voicequest.TTS_VOICE_SETTINGS)
+
+
+def test_chunks_pass_through_and_are_cached(client, upstream):
+    response = client.post("/api/tts", json={"text": "Hello there"}, buffered=True)
+    assert response.status_code == 200
+    assert response.headers["X-Cache"] == "MISS"
+    assert response.data == b"".join(upstream.audio)
+    assert voicequest.tts_gate.stats()["in_flight"] == 0
+
+    again = client.post("/api/tts", json={"text": "Hello there"}, buffered=True)
+    assert again.headers["X-Cache"] == "HIT"
+    assert again.data == response.data
+    assert len(upstream.requests) == 1
+
+
+def test_upstream_error_mid_stream_is_not_cached(client, upstream):
+    upstream.audio = [bytes([i]) * 8192 for i in range(4)]
+    upstream.audio_fail = True
+    response = client.post("/api/tts", json={"text": "Cut short"}, buffered=True)
+    assert response.status_code == 200  # Headers were already sent when the upstream failed
+    assert len(response.data) <= 4 * 8192
+    assert tts_key("Cut short") not in voicequest.tts_cache
+    assert cache_files(voicequest.tts_cache.directory) == []
+    assert voicequest.tts_gate.stats()["in_flight"] == 0
+
+
+def test_upstream_error_status_is_reported(client, upstream):
+    upstream.audio_status = 404
+    response = client.post("/api/tts", json={"text": "Wrong voice"}, buffered=True)
+    assert response.status_code == 500
+    assert "voice not found" in response.get_json()["message"]
+    assert voicequest.tts_gate.stats()["in_flight"] == 0
+
+
+def test_client_disconnect_frees_the_slot_and_discards_the_clip(client, upstream):
+    upstream.audio = [bytes([i]) * 8192 for i in range(50)]
+    upstream.audio_delay = 0.01
+    response = client.post("/api/tts", json={"text": "Nobody listening"}, buffered=False)
+    chunks = iter(response.response)
+    assert next(chunks)
+    response.close()  # What the WSGI server does when the client goes away
+
+    assert voicequest.tts_gate.stats()["in_flight"] == 0
+    assert tts_key("Nobody listening") not in voicequest.tts_cache
+    assert cache_files(voicequest.tts_cache.directory) == []
+
+
+def test_client_gone_before_the_body_frees_the_slot(client, upstream):
+    response = client.post("/api/tts", json={"text": "Never read"}, buffered=False)
+    response.close()
+    assert voicequest.tts_gate.stats()["in_flight"] == 0
+    assert cache_files(voicequest.tts_cache.directory) == []
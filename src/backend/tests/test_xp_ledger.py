@@ -0,0 +1,47 @@
+"""XP history buckets and the weekly chart, both read from the xp_events ledger."""
+
+from datetime import date, timedelta
+
+import pytest
+
+import user_stats
+import xp_ledger
+from db import get_db
+
+
+class FixedDate(date):
+    @classmethod
+    def today(cls):
+        return cls(2026, 1, 6)  # A Tuesday
+
+
+@pytest.fixture
+def ledger(database, monkeypatch):
+    monkeypatch.setattr(xp_ledger, "date", FixedDate)
+    monkeypatch.setattr(user_stats, "date", FixedDate)
+    db = get_db()
+    db.execute("INSERT INTO users (id, username, display_name) VALUES (1, 'ada', 'Ada')")
+    # 10 XP on every day from Monday 2025-12-22 through today
+    day = date(2025, 12, 22)
+    while day <= FixedDate.today():
+        xp_ledger.record_xp(db, 1, 10, "quest_completed", day=day.isoformat())
+        day += timedelta(days=1)
+    db.commit()
+    yield db
+    db.close()
+
+
+def test_weeks_are_not_split_at_new_year(ledger):
+    result = xp_ledger.history(ledger, 1, 16, bucket="week")
+    assert [(b["bucket"], b["xp"]) for b in result["buckets"]] == [
+        ("2025-12-22", 70),
+        ("2025-12-29", 70),  # Monday 29 Dec to Sunday 4 Jan, one week
+        ("2026-01-05", 20),
+    ]
+    assert result["total_xp"] == 160
+
+
+def test_weekly_chart_matches_history(ledger):
+    _, _, weekly = user_stats.read_stats(ledger, 1)
+    days = xp_ledger.history(ledger, 1, 7, bucket="day")["buckets"]
+    assert weekly == [b["xp"] for b in days] == [10] * 7
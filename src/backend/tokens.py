@@ -0,0 +1,28 @@
+"""
+Prompt token counting.
+
+Uses tiktoken's o200k_base encoding (the gpt-4o family) when tiktoken is
+installed and the encoding can be loaded, otherwise estimates one token
+per four characters.
+"""
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+_encoding = None
+if tiktoken is not None:
+    try:
+        _encoding = tiktoken.get_encoding("o200k_base")
+    except Exception:
+        # The encoding file is downloaded on first use; fall back if that fails
+        _encoding = None
+
+TOKENIZER = "tiktoken" if _encoding is not None else "estimate"
+
+
+def count_tokens(text):
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return (len(text) + 3) // 4
@@ -0,0 +1,109 @@
+"""
+Quest session transcripts.
+
+Messages are stored as append-only rows in quest_session_messages keyed
+by (session_id, seq), so a turn only writes its two new messages and
+only reads the messages the prompt still needs, instead of rewriting the
+whole quest_sessions.messages JSON blob.
+
+Each message's seq is computed inside its own INSERT, so it is read
+under the write lock and concurrent appends to one session can't pick
+the same seq.
+"""
+
+import json
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS quest_session_messages (
+        session_id TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        role TEXT NOT NULL,
+        content TEXT NOT NULL,
+        is_correct BOOLEAN,
+        created_at TIMESTAMP,
+        PRIMARY KEY (session_id, seq),
+        FOREIGN KEY (session_id) REFERENCES quest_sessions(session_id)
+    ) WITHOUT ROWID;
+"""
+
+
+def _to_message(row):
+    msg = {
+        "seq": row["seq"],
+        "role": row["role"],
+        "content": row["content"],
+        "timestamp": row["created_at"],
+    }
+    if row["role"] == "tutor" and row["is_correct"] is not None:
+        msg["is_correct"] = bool(row["is_correct"])
+        msg["feedback"] = row["content"]
+    return msg
+
+
+APPEND_SQL = """
+    INSERT INTO quest_session_messages (session_id, seq, role, content, is_correct, created_at)
+    SELECT ?, COALESCE(MAX(seq), -1) + 1, ?, ?, ?, ?
+    FROM quest_session_messages WHERE session_id = ?
+"""
+MESSAGES_AFTER_SQL = "SELECT * FROM quest_session_messages WHERE session_id = ? AND seq > ? ORDER BY seq"
+
+
+def append_messages(db, session_id, messages):
+    """Append messages after the current last seq. Caller commits."""
+    db.executemany(
+        APPEND_SQL,
+        [
+            (session_id, m["role"], m["content"], m.get("is_correct"), m.get("timestamp"), session_id)
+            for m in messages
+        ]
+    )
+
+
+def load_after(db, session_id, after_seq):
+    """Messages with seq greater than `after_seq`, in chronological order."""
+    rows = db.execute(MESSAGES_AFTER_SQL, (session_id, after_seq)).fetchall()
+    return [_to_message(r) for r in rows]
+
+
+def load_page(db, session_id, before=None, limit=PAGE_SIZE):
+    """A page of messages older than seq `before` (newest page when None).
+
+    `limit` is clamped to 1..MAX_PAGE_SIZE; SQLite would read LIMIT -1 as no limit.
+    Returns (messages in chronological order, seq to pass as `before` for the previous page or None).
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    if before is None:
+        rows = db.execute(
+            """SELECT * FROM quest_session_messages WHERE session_id = ?
+               ORDER BY seq DESC LIMIT ?""",
+            (session_id, limit)
+        ).fetchall()
+    else:
+        rows = db.execute(
+            """SELECT * FROM quest_session_messages WHERE session_id = ? AND seq < ?
+               ORDER BY seq DESC LIMIT ?""",
+            (session_id, before, limit)
+        ).fetchall()
+    messages = [_to_message(r) for r in reversed(rows)]
+    next_before = messages[0]["seq"] if messages and messages[0]["seq"] > 0 else None
+    return messages, next_before
+
+
+def migrate_message_blobs(db):
+    """Move transcripts still held in quest_sessions.messages into rows (idempotent). Caller commits."""
+    sessions = db.execute(
+        "SELECT session_id, messages FROM quest_sessions WHERE messages IS NOT NULL AND messages != '[]'"
+    ).fetchall()
+    for session in sessions:
+        try:
+            messages = json.loads(session["messages"])
+        except (json.JSONDecodeError, TypeError):
+            messages = []
+        db.execute("DELETE FROM quest_session_messages WHERE session_id = ?", (session["session_id"],))
+        if messages:
+            append_messages(db, session["session_id"], messages)
+        db.execute("UPDATE quest_sessions SET messages = '[]' WHERE session_id = ?", (session["session_id"],))
+    return len(sessions)
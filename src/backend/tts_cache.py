@@ -0,0 +1,201 @@
+"""
+Content-addressed cache for synthesized TTS audio.
+
+Audio is keyed on sha256(text, voice_id, model_id, voice_settings), kept
+on disk under TTS_CACHE_DIR with size-bounded LRU eviction, and the most
+recently used clips are also held in memory. The key doubles as the
+response ETag.
+
+Tuning (environment variables):
+  TTS_CACHE_DIR=tts_cache             where clips are stored
+  TTS_CACHE_MAX_BYTES=268435456       disk budget (256 MB)
+  TTS_CACHE_MEMORY_BYTES=16777216     hot in-memory tier (16 MB)
+  TTS_CACHE_MAX_AGE=86400             Cache-Control max-age in seconds
+"""
+
+import hashlib
+import json
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
+CACHE_DIR = os.environ.get("TTS_CACHE_DIR", "tts_cache")
+MAX_BYTES = int(os.environ.get("TTS_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+MEMORY_BYTES = int(os.environ.get("TTS_CACHE_MEMORY_BYTES", str(16 * 1024 * 1024)))
+MAX_AGE = int(os.environ.get("TTS_CACHE_MAX_AGE", "86400"))
+
+
+def cache_key(text, voice_id, model_id, voice_settings):
+    payload = json.dumps([text, voice_id, model_id, voice_settings], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TTSCache:
+    def __init__(self, directory=CACHE_DIR, max_bytes=MAX_BYTES, memory_bytes=MEMORY_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.memory_bytes = memory_bytes
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> audio bytes, LRU order
+        self._memory_size = 0
+        self._disk = OrderedDict()  # key -> size on disk, LRU order
+        self._disk_size = 0
+        self._counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "bytes_saved": 0,
+            "stores": 0,
+            "evictions": 0,
+        }
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.mp3")
+
+    def _load_index(self):
+        entries = []
+        for root, _dirs, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(".mp3"):
+                    continue
+                st = os.stat(os.path.join(root, name))
+                entries.append((st.st_mtime, name[:-4], st.st_size))
+        for _mtime, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_size += size
+        self._evict_disk()
+
+    def get(self, key):
+        """Return cached audio bytes or None."""
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                if key in self._disk:
+                    self._disk.move_to_end(key)
+                self._counters["memory_hits"] += 1
+                self._counters["bytes_saved"] += len(data)
+                return data
+            if key not in self._disk:
+                self._counters["misses"] += 1
+                return None
+
+        try:
+            with open(self._path(key), "rb") as f:
+                data = f.read()
+            os.utime(self._path(key))
+        except OSError:
+            with self._lock:
+                self._forget_disk(key)
+                self._counters["misses"] += 1
+            return None
+
+        with self._lock:
+            if key in self._disk:
+                self._disk.move_to_end(key)
+            self._remember(key, data)
+            self._counters["disk_hits"] += 1
+            self._counters["bytes_saved"] += len(data)
+        return data
+
+    def put(self, key, data):
+        if not data or len(data) > self.max_bytes:
+            return
+        writer = self.open_writer(key)
+        writer.write(data)
+        writer.commit()
+
+    def open_writer(self, key):
+        """Stream a clip to disk chunk by chunk; it is only cached on commit()."""
+        return CacheWriter(self, key)
+
+    def _commit(self, key, tmp_path, size):
+        if not size or size > self.max_bytes:
+            os.remove(tmp_path)
+            return
+        os.replace(tmp_path, self._path(key))
+        with self._lock:
+            self._forget_disk(key)
+            self._disk[key] = size
+            self._disk_size += size
+            self._counters["stores"] += 1
+            self._evict_disk()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._memory or key in self._disk
+
+    def _remember(self, key, data):
+        if len(data) > self.memory_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_size -= len(old)
+        self._memory[key] = data
+        self._memory_size += len(data)
+        while self._memory_size > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+
+    def _forget_disk(self, key):
+        size = self._disk.pop(key, None)
+        if size is not None:
+            self._disk_size -= size
+
+    def _evict_disk(self):
+        while self._disk_size > self.max_bytes and self._disk:
+            key, size = self._disk.popitem(last=False)
+            self._disk_size -= size
+            self._counters["evictions"] += 1
+            old = self._memory.pop(key, None)
+            if old is not None:
+                self._memory_size -= len(old)
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            lookups = self._counters["memory_hits"] + self._counters["disk_hits"] + self._counters["misses"]
+            hits = lookups - self._counters["misses"]
+            return {
+                **self._counters,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0,
+                "entries": len(self._disk),
+                "disk_bytes": self._disk_size,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_size,
+            }
+
+
+class CacheWriter:
+    """Write-through handle used while proxying a streamed clip."""
+
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key = key
+        self.size = 0
+        path = cache._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Unique per writer: the async server relays every clip from the one event-loop thread
+        self._tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        self._file = open(self._tmp_path, "wb")
+
+    def write(self, chunk):
+        self._file.write(chunk)
+        self.size += len(chunk)
+
+    def commit(self):
+        self._file.close()
+        self.cache._commit(self.key, self._tmp_path, self.size)
+
+    def discard(self):
+        self._file.close()
+        try:
+            os.remove(self._tmp_path)
+        except OSError:
+            pass
@@ -0,0 +1,188 @@
+"""
+Materialized per-user stats.
+
+/api/user/<id>/stats reads these tables instead of aggregating quests,
+progress and sessions on every poll. They are updated in the same
+transaction as quest completion (record_quest_completion) and
+achievement unlocks (record_achievements); rebuild() recomputes them
+from history. XP per day is not kept here: the weekly chart reads the
+xp_events ledger (xp_ledger.py), the one record of XP earned.
+"""
+
+from datetime import date, datetime, timedelta
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS user_stats (
+        user_id INTEGER PRIMARY KEY,
+        achievements_unlocked INTEGER NOT NULL DEFAULT 0,
+        FOREIGN KEY (user_id) REFERENCES users(id)
+    );
+
+    CREATE TABLE IF NOT EXISTS user_topic_stats (
+        user_id INTEGER NOT NULL,
+        topic TEXT NOT NULL,
+        quests_completed INTEGER NOT NULL DEFAULT 0,
+        best_score_sum INTEGER NOT NULL DEFAULT 0,
+        scored_quests INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, topic)
+    ) WITHOUT ROWID;
+
+    CREATE TABLE IF NOT EXISTS user_daily_stats (
+        user_id INTEGER NOT NULL,
+        day DATE NOT NULL,
+        score INTEGER NOT NULL DEFAULT 0,
+        quests_completed INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, day)
+    ) WITHOUT ROWID;
+
+    CREATE TABLE IF NOT EXISTS topic_totals (
+        topic TEXT PRIMARY KEY,
+        total_quests INTEGER NOT NULL DEFAULT 0
+    );
+"""
+
+
+def quest_xp(xp_reward, score, total_questions):
+    """XP for a finished quest: base reward scaled by score, minimum 30%."""
+    max_score = total_questions * 20
+    score_ratio = score / max_score if max_score > 0 else 0
+    return int(xp_reward * max(0.3, score_ratio))
+
+
+def record_quest_added(db, topic):
+    db.execute(
+        """INSERT INTO topic_totals (topic, total_quests) VALUES (?, 1)
+           ON CONFLICT(topic) DO UPDATE SET total_quests = total_quests + 1""",
+        (topic,)
+    )
+
+
+def record_quest_completion(db, user_id, topic, progress, score, day=None):
+    """Fold one completed session into the snapshot. Caller commits.
+
+    `progress` is the user_quest_progress row as it was before this completion.
+    """
+    day = day or date.today().isoformat()
+    old_best = progress["best_score"] if progress else 0
+    new_best = max(old_best, score)
+    newly_completed = 0 if progress and progress["completed"] else 1
+    newly_scored = 1 if old_best <= 0 < new_best else 0
+
+    db.execute(
+        """INSERT INTO user_topic_stats (user_id, topic, quests_completed, best_score_sum, scored_quests)
+           VALUES (?, ?, ?, ?, ?)
+           ON CONFLICT(user_id, topic) DO UPDATE SET
+               quests_completed = quests_completed + excluded.quests_completed,
+               best_score_sum = best_score_sum + excluded.best_score_sum,
+               scored_quests = scored_quests + excluded.scored_quests""",
+        (user_id, topic, newly_completed, new_best - old_best, newly_scored)
+    )
+    db.execute(
+        """INSERT INTO user_daily_stats (user_id, day, score, quests_completed)
+           VALUES (?, ?, ?, 1)
+           ON CONFLICT(user_id, day) DO UPDATE SET
+               score = score + excluded.score,
+               quests_completed = quests_completed + 1""",
+        (user_id, day, score)
+    )
+
+
+def record_achievements(db, user_id, count):
+    db.execute(
+        """INSERT INTO user_stats (user_id, achievements_unlocked) VALUES (?, ?)
+           ON CONFLICT(user_id) DO UPDATE SET achievements_unlocked = achievements_unlocked + excluded.achievements_unlocked""",
+        (user_id, count)
+    )
+
+
+USER_STATS_SQL = """
+    SELECT u.*,
+           COALESCE(s.achievements_unlocked, 0) AS achievements_unlocked,
+           (SELECT COUNT(*) FROM achievements) AS total_achievements,
+           (SELECT COALESCE(SUM(total_quests), 0) FROM topic_totals) AS total_quests
+    FROM users u
+    LEFT JOIN user_stats s ON s.user_id = u.id
+    WHERE u.id = ?
+"""
+TOPIC_STATS_SQL = """
+    SELECT t.topic,
+           COALESCE(uts.quests_completed, 0) AS completed,
+           t.total_quests AS total,
+           CASE WHEN uts.scored_quests > 0
+                THEN 1.0 * uts.best_score_sum / uts.scored_quests ELSE 0 END AS avg_score
+    FROM topic_totals t
+    LEFT JOIN user_topic_stats uts ON uts.topic = t.topic AND uts.user_id = ?
+    ORDER BY t.topic
+"""
+WEEK_STATS_SQL = "SELECT day, SUM(xp) AS xp FROM xp_events WHERE user_id = ? AND day > ? GROUP BY day"
+
+
+def read_stats(db, user_id):
+    """Return (user row with counters, topic rows, weekly XP list) or None."""
+    user = db.execute(USER_STATS_SQL, (user_id,)).fetchone()
+    if not user:
+        return None
+
+    topics = db.execute(TOPIC_STATS_SQL, (user_id,)).fetchall()
+
+    # Last 7 calendar days, oldest first
+    today = date.today()
+    days = db.execute(WEEK_STATS_SQL, (user_id, (today - timedelta(days=7)).isoformat())).fetchall()
+    weekly = [0] * 7
+    for row in days:
+        days_ago = (today - date.fromisoformat(row["day"])).days
+        if 0 <= days_ago < 7:
+            weekly[6 - days_ago] += row["xp"]
+
+    return user, topics, weekly
+
+
+def rebuild(db, user_id=None):
+    """Recompute the snapshot from quests, progress, sessions and achievements. Caller commits."""
+    where, params = ("WHERE user_id = ?", (user_id,)) if user_id else ("", ())
+
+    db.execute("DELETE FROM topic_totals")
+    db.execute("INSERT INTO topic_totals (topic, total_quests) SELECT topic, COUNT(*) FROM quests GROUP BY topic")
+
+    for table in ("user_stats", "user_topic_stats", "user_daily_stats"):
+        db.execute(f"DELETE FROM {table} {where}", params)
+
+    db.execute(f"""
+        INSERT INTO user_stats (user_id, achievements_unlocked)
+        SELECT user_id, COUNT(*) FROM user_achievements {where} GROUP BY user_id
+    """, params)
+
+    db.execute(f"""
+        INSERT INTO user_topic_stats (user_id, topic, quests_completed, best_score_sum, scored_quests)
+        SELECT uqp.user_id, q.topic,
+               SUM(CASE WHEN uqp.completed = 1 THEN 1 ELSE 0 END),
+               SUM(CASE WHEN uqp.best_score > 0 THEN uqp.best_score ELSE 0 END),
+               SUM(CASE WHEN uqp.best_score > 0 THEN 1 ELSE 0 END)
+        FROM user_quest_progress uqp
+        JOIN quests q ON q.id = uqp.quest_id
+        {where.replace("user_id", "uqp.user_id")}
+        GROUP BY uqp.user_id, q.topic
+    """, params)
+
+    daily = {}
+    sessions = db.execute(f"""
+        SELECT qs.user_id, qs.score, qs.completed_at
+        FROM quest_sessions qs
+        JOIN quests q ON q.id = qs.quest_id
+        WHERE qs.status = 'completed' AND qs.completed_at IS NOT NULL
+        {where.replace("WHERE", "AND").replace("user_id", "qs.user_id")}
+    """, params).fetchall()
+    for s in sessions:
+        try:
+            day = datetime.fromisoformat(s["completed_at"]).date().isoformat()
+        except (ValueError, TypeError):
+            continue
+        bucket = daily.setdefault((s["user_id"], day), [0, 0])
+        bucket[0] += s["score"]
+        bucket[1] += 1
+
+    db.executemany(
+        """INSERT INTO user_daily_stats (user_id, day, score, quests_completed)
+           VALUES (?, ?, ?, ?)""",
+        [(uid, day, *bucket) for (uid, day), bucket in daily.items()]
+    )
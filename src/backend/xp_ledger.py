@@ -0,0 +1,126 @@
+"""
+Append-only XP ledger.
+
+Every XP award is written to xp_events with the local calendar day it
+was earned on. The ledger is the only record of XP per day: xp_history
+and the weekly chart on /stats both read it. The (user_id, day, xp) index covers history queries, so
+range aggregates are computed in SQL from the index alone.
+"""
+
+import re
+from datetime import date, datetime, timedelta
+
+from user_stats import quest_xp
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS xp_events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        day DATE NOT NULL,
+        xp INTEGER NOT NULL,
+        source TEXT NOT NULL,
+        session_id TEXT,
+        quest_id INTEGER,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(id)
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_xp_events_user_day ON xp_events(user_id, day, xp);
+"""
+
+MAX_RANGE_DAYS = 3660
+RANGE_PATTERN = re.compile(r"^(\d+)([dwmy]?)$")
+RANGE_UNIT_DAYS = {"": 1, "d": 1, "w": 7, "m": 30, "y": 365}
+
+# bucket -> (strftime format, two date modifiers); weeks are ISO weeks (Monday to
+# Sunday, never split at New Year) labelled by their Monday's date
+BUCKETS = {
+    "day": ("%Y-%m-%d", "+0 days", "+0 days"),
+    "week": ("%Y-%m-%d", "weekday 0", "-6 days"),
+    "month": ("%Y-%m", "+0 days", "+0 days"),
+}
+
+
+def record_xp(db, user_id, xp, source, session_id=None, quest_id=None, day=None):
+    """Append one XP award. Caller commits."""
+    db.execute(
+        """INSERT INTO xp_events (user_id, day, xp, source, session_id, quest_id)
+           VALUES (?, ?, ?, ?, ?, ?)""",
+        (user_id, day or date.today().isoformat(), xp, source, session_id, quest_id)
+    )
+
+
+def parse_range(value):
+    """'90d', '12w', '6m', '1y' or a plain day count -> number of days (None if invalid)."""
+    match = RANGE_PATTERN.match((value or "").strip().lower())
+    if not match:
+        return None
+    days = int(match.group(1)) * RANGE_UNIT_DAYS[match.group(2)]
+    if days <= 0:
+        return None
+    return min(days, MAX_RANGE_DAYS)
+
+
+HISTORY_SQL = """
+    SELECT strftime(?, day, ?, ?) AS bucket, SUM(xp) AS xp, COUNT(*) AS events
+    FROM xp_events
+    WHERE user_id = ? AND day >= ? AND day <= ?
+    GROUP BY bucket
+    ORDER BY bucket
+"""
+
+
+def bucket_label(day, bucket):
+    """The label HISTORY_SQL gives `day` (a date) in `bucket`."""
+    if bucket == "week":
+        day -= timedelta(days=day.weekday())
+    return day.strftime(BUCKETS[bucket][0])
+
+
+def history(db, user_id, days, bucket="day"):
+    """XP per bucket over the last `days` days, ending today (oldest first)."""
+    today = date.today()
+    start = today - timedelta(days=days - 1)
+    rows = db.execute(HISTORY_SQL, (*BUCKETS[bucket], user_id, start.isoformat(), today.isoformat())).fetchall()
+    totals = {r["bucket"]: (r["xp"], r["events"]) for r in rows}
+
+    # Zero-fill so charts get one point per bucket
+    buckets = []
+    seen = set()
+    current = start
+    while current <= today:
+        label = bucket_label(current, bucket)
+        if label not in seen:
+            seen.add(label)
+            xp, events = totals.get(label, (0, 0))
+            buckets.append({"bucket": label, "xp": xp, "events": events})
+        current += timedelta(days=1)
+    return {
+        "start": start.isoformat(),
+        "end": today.isoformat(),
+        "bucket": bucket,
+        "total_xp": sum(b["xp"] for b in buckets),
+        "buckets": buckets,
+    }
+
+
+def backfill(db):
+    """Seed the ledger from completed sessions if it is empty. Caller commits."""
+    if db.execute("SELECT 1 FROM xp_events LIMIT 1").fetchone():
+        return 0
+    sessions = db.execute("""
+        SELECT qs.session_id, qs.user_id, qs.quest_id, qs.score, qs.total_questions, qs.completed_at, q.xp_reward
+        FROM quest_sessions qs
+        JOIN quests q ON q.id = qs.quest_id
+        WHERE qs.status = 'completed' AND qs.completed_at IS NOT NULL
+    """).fetchall()
+    count = 0
+    for s in sessions:
+        try:
+            day = datetime.fromisoformat(s["completed_at"]).date().isoformat()
+        except (ValueError, TypeError):
+            continue
+        record_xp(db, s["user_id"], quest_xp(s["xp_reward"], s["score"], s["total_questions"]),
+                  "quest_completed", s["session_id"], s["quest_id"], day)
+        count += 1
+    return count